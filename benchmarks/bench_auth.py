@@ -0,0 +1,88 @@
+"""
+Cost of authenticating a request, with and without the verified-claims cache.
+
+Each simulated request presents one of ``--clients`` bearer tokens, as a pool of hot clients
+would. Without the cache every request verifies the token's signature and claims; with it only
+the first request of each token does, and later ones pay a SHA-256 digest and an LRU lookup.
+The dependency numbers run ``project.auth.current_user`` itself, as FastAPI would per request.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_auth --requests 100000
+"""
+import argparse
+import asyncio
+import time
+from typing import Callable, List
+
+import project.auth
+from fastapi.security import HTTPAuthorizationCredentials
+
+
+def issue_tokens(count: int) -> List[str]:
+    return [
+        project.auth.create_access_token(f"user-{index}", f"user{index}@example.com", "USER")
+        for index in range(count)
+    ]
+
+
+def time_per_request(verify: Callable[[str], object], tokens: List[str], requests: int) -> float:
+    started = time.perf_counter()
+    for index in range(requests):
+        verify(tokens[index % len(tokens)])
+    return (time.perf_counter() - started) / requests
+
+
+def time_dependency(tokens: List[str], requests: int) -> float:
+    credentials = [
+        HTTPAuthorizationCredentials(scheme="Bearer", credentials=token) for token in tokens
+    ]
+
+    async def run() -> float:
+        started = time.perf_counter()
+        for index in range(requests):
+            await project.auth.current_user(credentials[index % len(credentials)])
+        return (time.perf_counter() - started) / requests
+
+    return asyncio.run(run())
+
+
+def report(label: str, seconds: float, baseline: float) -> None:
+    print(f"{label:<34} {seconds * 1e6:8.2f} us/request   {baseline / seconds:6.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=100000, help="requests per run")
+    parser.add_argument("--clients", type=int, default=100, help="distinct tokens in rotation")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per setting; best is kept")
+    args = parser.parse_args()
+
+    tokens = issue_tokens(args.clients)
+    print(
+        f"{args.requests} requests from {args.clients} clients, "
+        f"{project.auth.JWT_ALGORITHM} tokens, cache size {project.auth.JWT_CLAIMS_CACHE_SIZE}\n"
+    )
+    uncached = min(
+        time_per_request(project.auth.decode_token, tokens, args.requests)
+        for _ in range(args.repeat)
+    )
+    report("verify every request", uncached, uncached)
+    cached = min(
+        time_per_request(project.auth.claims_cache.verify, tokens, args.requests)
+        for _ in range(args.repeat)
+    )
+    report("claims cache", cached, uncached)
+
+    project.auth.claims_cache = project.auth.ClaimsCache(0)
+    dependency_uncached = min(
+        time_dependency(tokens, args.requests) for _ in range(args.repeat)
+    )
+    report("current_user, cache disabled", dependency_uncached, dependency_uncached)
+    project.auth.claims_cache = project.auth.ClaimsCache(project.auth.JWT_CLAIMS_CACHE_SIZE)
+    dependency_cached = min(time_dependency(tokens, args.requests) for _ in range(args.repeat))
+    report("current_user, cache enabled", dependency_cached, dependency_uncached)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Throughput of the speed/pitch DSP stage, reported as a real-time factor.
+
+The real-time factor (RTF) is processing time divided by audio duration, so 0.01 means one
+second of audio takes 10 ms and one core can keep up with roughly 1 / RTF concurrent streams.
+The DSP-only numbers exclude MP3 decoding and encoding; the pipeline numbers run
+``project.audio_dsp.process`` end to end on an MP3 input.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_dsp --seconds 60
+"""
+import argparse
+import time
+
+import numpy as np
+import project.audio_dsp
+
+SAMPLE_RATE = 24000
+
+SETTINGS = [
+    (1.25, 0.0),
+    (0.8, 0.0),
+    (1.0, 4.0),
+    (1.0, -4.0),
+    (1.5, 2.0),
+]
+
+
+def speech_like_signal(seconds: float, sample_rate: int) -> np.ndarray:
+    """
+    A voiced, syllable-modulated harmonic signal with a drifting fundamental and some noise.
+    """
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    fundamental = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(fundamental) / sample_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t) ** 2
+    signal = envelope * voiced + 0.05 * rng.standard_normal(len(t))
+    return 0.3 * signal / np.max(np.abs(signal))
+
+
+def time_dsp(signal: np.ndarray, speed: float, pitch: float, block: int) -> float:
+    shifter = project.audio_dsp.TimePitchShifter(speed, pitch)
+    started = time.perf_counter()
+    for start in range(0, len(signal), block):
+        shifter.process(signal[start : start + block])
+    shifter.flush()
+    return time.perf_counter() - started
+
+
+def time_pipeline(audio: bytes, speed: float, pitch: float, output_format: str) -> float:
+    started = time.perf_counter()
+    project.audio_dsp.process(audio, speed, pitch, output_format)
+    return time.perf_counter() - started
+
+
+def report(label: str, elapsed: float, seconds: float) -> None:
+    rtf = elapsed / seconds
+    print(f"{label:<32} {elapsed * 1000:9.1f} ms   RTF {rtf:.4f}   ~{1 / rtf:6.0f} streams/core")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=60.0, help="audio duration")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per setting; best is kept")
+    parser.add_argument(
+        "--block",
+        type=int,
+        default=project.audio_dsp.AUDIO_DSP_BLOCK_SAMPLES,
+        help="samples fed to the DSP stage per call",
+    )
+    args = parser.parse_args()
+
+    signal = speech_like_signal(args.seconds, SAMPLE_RATE)
+    print(f"{args.seconds:.0f} s of {SAMPLE_RATE} Hz mono, blocks of {args.block} samples\n")
+    print("DSP only")
+    for speed, pitch in SETTINGS:
+        elapsed = min(
+            time_dsp(signal, speed, pitch, args.block) for _ in range(args.repeat)
+        )
+        report(f"  speed={speed} pitch={pitch:+}", elapsed, args.seconds)
+
+    audio = project.audio_dsp.encode_mp3([signal], SAMPLE_RATE)
+    print("\nDecode + DSP + encode")
+    for speed, pitch, output_format in [
+        (1.0, 0.0, "WAV"),
+        (1.25, 0.0, "MP3"),
+        (1.5, 2.0, "MP3"),
+        (1.5, 2.0, "WAV"),
+    ]:
+        elapsed = min(
+            time_pipeline(audio, speed, pitch, output_format) for _ in range(args.repeat)
+        )
+        report(f"  speed={speed} pitch={pitch:+} -> {output_format}", elapsed, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,621 @@
+"""
+Throughput and latency of every endpoint under a realistic traffic mix, run in-process.
+
+The FastAPI app runs in this process with its lifespan, and ``--users`` virtual users drive it
+through httpx's ASGI transport (WebSocket sessions through a minimal ASGI client), so no
+sockets or network are involved. Synthesis goes to the simulated ``fake`` engine with the
+latency distribution given by the ``--tts-*`` options. By default the Prisma client is replaced
+by ``benchmarks.inmemory_prisma``; with ``--database-url`` the generated client is used against
+that database instead, which must be a scratch database with the schema pushed.
+
+Each virtual user is a seeded account with a subscription plan and saved preferences, and
+repeatedly picks an operation by the weights of ``--mix``: repeated short prompts (cache hits),
+long documents, templated SSML prompts with breaks, streamed and batch conversions, queued
+jobs, output downloads, login bursts, token refreshes, preference reads and writes, WebSocket
+sessions and metrics scrapes.
+Latencies are recorded per endpoint after ``--warmup`` seconds, and reported with throughput
+and error counts. ``--output`` writes them as JSON; ``--compare`` diffs two such files, e.g.
+from two commits, and exits with status 1 if an endpoint regressed beyond ``--threshold``.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_endpoints --duration 30 --output after.json
+    python -m benchmarks.bench_endpoints --compare before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+MIX = {
+    "convert_repeated": 25,
+    "convert_document": 8,
+    "convert_ssml": 4,
+    "convert_stream": 6,
+    "convert_batch": 3,
+    "job": 4,
+    "output": 8,
+    "login_burst": 2,
+    "refresh": 3,
+    "preferences_read": 20,
+    "preferences_write": 4,
+    "preferences_replace": 1,
+    "websocket": 3,
+    "metrics": 1,
+}
+
+PLAN_SHARES = {"FREE": 0.6, "BASIC": 0.25, "PREMIUM": 0.15}
+
+PASSWORD = "correct horse battery staple"
+
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while seven bright stars shine above quiet "
+    "hills and rivers carry news of distant towns where people gather to read write sing and "
+    "listen to stories about ships trains letters gardens markets music weather and time"
+).split()
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = dict(MIX)
+    for pair in value.split(","):
+        name, _, weight = pair.partition("=")
+        if weight.strip():
+            if name.strip() not in MIX:
+                raise argparse.ArgumentTypeError(f"Unknown operation: {name}")
+            mix[name.strip()] = float(weight)
+    return mix
+
+
+def configure_environment(args: argparse.Namespace) -> None:
+    """
+    Point the service at the simulated upstream and scratch directories before it is imported.
+
+    Settings already exported in the environment win over these defaults, except for the
+    simulated upstream, which is set from the command line, and the startup cache pre-warm,
+    which would synthesize behind the measured traffic.
+    """
+    os.environ["SYNTHESIS_ENGINE"] = "fake"
+    os.environ["FAKE_TTS_LATENCY_SECONDS"] = str(args.tts_latency)
+    os.environ["FAKE_TTS_JITTER_SECONDS"] = str(args.tts_jitter)
+    os.environ["FAKE_TTS_TAIL_RATE"] = str(args.tts_tail_rate)
+    os.environ["FAKE_TTS_TAIL_SECONDS"] = str(args.tts_tail_seconds)
+    os.environ["FAKE_TTS_FAILURE_RATE"] = str(args.tts_failure_rate)
+    os.environ["FAKE_TTS_SEED"] = str(args.seed)
+    os.environ["CACHE_PREWARM_ON_STARTUP"] = "false"
+    scratch = tempfile.mkdtemp(prefix="tts-bench-")
+    os.environ.setdefault("AUDIO_STORE_DIR", os.path.join(scratch, "audio"))
+    os.environ.setdefault("SINGLE_FLIGHT_LOCK_DIR", os.path.join(scratch, "locks"))
+    os.environ.setdefault("REQUEST_PROFILE_DIR", os.path.join(scratch, "profiles"))
+    os.environ.setdefault("JWT_SECRET_KEY", "bench-secret")
+    os.environ.setdefault("BCRYPT_ROUNDS", str(args.bcrypt_rounds))
+    # Per-user rate limits would turn most of a closed-loop run into 429s.
+    os.environ.setdefault("SYNTHESIS_PLAN_RATES", "FREE=0,BASIC=0,PREMIUM=0")
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+
+
+def percentile(ordered: List[float], percentile: float) -> float:
+    if not ordered:
+        return 0.0
+    rank = min(len(ordered) - 1, max(0, int(round(percentile / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+class Recorder:
+    """
+    Latencies and statuses per endpoint, recorded only while ``enabled``.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint: str, status: int, seconds: float) -> None:
+        if self.enabled:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][status] += 1
+
+    def summary(self, duration: float) -> Dict[str, Dict[str, Any]]:
+        results = {}
+        for endpoint in sorted(self.latencies):
+            ordered = sorted(self.latencies[endpoint])
+            statuses = self.statuses[endpoint]
+            results[endpoint] = {
+                "requests": len(ordered),
+                # HTTP statuses from 400 up, and WebSocket close codes other than normal.
+                "errors": sum(
+                    count for status, count in statuses.items() if status >= 400 and status != 1000
+                ),
+                "statuses": {str(status): count for status, count in sorted(statuses.items())},
+                "throughput_rps": len(ordered) / duration,
+                "mean_ms": 1000 * sum(ordered) / len(ordered),
+                "p50_ms": 1000 * percentile(ordered, 50),
+                "p95_ms": 1000 * percentile(ordered, 95),
+                "p99_ms": 1000 * percentile(ordered, 99),
+                "max_ms": 1000 * ordered[-1],
+            }
+        return results
+
+
+class VirtualUser:
+    def __init__(self, index: int, user_id: str, email: str, token: str, seed: int):
+        self.index = index
+        self.user_id = user_id
+        self.email = email
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.token = token
+        self.rng = random.Random(seed)
+        self.output_ids: List[str] = []
+
+
+class LoadTest:
+    """
+    The operations of the traffic mix, each issuing one or more timed requests.
+    """
+
+    def __init__(self, app: Any, client: httpx.AsyncClient, args: argparse.Namespace):
+        self.app = app
+        self.client = client
+        self.args = args
+        self.recorder = Recorder()
+        prompts = random.Random(args.seed)
+        self.prompts = [self._sentence(prompts) for _ in range(args.prompts)]
+        self.operations: Dict[str, Callable[[VirtualUser], Awaitable[None]]] = {
+            name: getattr(self, name) for name in MIX
+        }
+
+    @staticmethod
+    def _sentence(rng: random.Random) -> str:
+        words = rng.choices(WORDS, k=rng.randint(5, 14))
+        return " ".join(words).capitalize() + "."
+
+    def _document(self, rng: random.Random, sentences: int) -> str:
+        return " ".join(self._sentence(rng) for _ in range(sentences))
+
+    def _convert_params(self, text: str, **extra: Any) -> Dict[str, Any]:
+        return {
+            "text": text,
+            "language": "en",
+            "voice_preference": "default",
+            "input_format": "TEXT",
+            "speed": 1.0,
+            "pitch": 0.0,
+            **extra,
+        }
+
+    async def _request(
+        self, endpoint: str, method: str, url: str, **kwargs: Any
+    ) -> Optional[httpx.Response]:
+        started_at = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.record(endpoint, 599, time.perf_counter() - started_at)
+            return None
+        self.recorder.record(endpoint, response.status_code, time.perf_counter() - started_at)
+        return response
+
+    async def convert_repeated(self, user: VirtualUser) -> None:
+        params = self._convert_params(user.rng.choice(self.prompts))
+        await self._request(
+            "POST /speech/convert", "POST", "/speech/convert", params=params, headers=user.headers
+        )
+
+    async def convert_document(self, user: VirtualUser) -> None:
+        text = self._document(user.rng, user.rng.randint(8, 20))
+        await self._request(
+            "POST /speech/convert (document)",
+            "POST",
+            "/speech/convert",
+            params=self._convert_params(text),
+            headers=user.headers,
+        )
+
+    async def convert_ssml(self, user: VirtualUser) -> None:
+        # A fixed template around one variable sentence, the way notification prompts are built.
+        text = (
+            f"<speak>{self.prompts[0]}<break time=\"400ms\"/>"
+            f"<prosody rate=\"fast\">{self._sentence(user.rng)}</prosody>"
+            f"<break time=\"1s\"/>{self.prompts[1]}</speak>"
+        )
+        await self._request(
+            "POST /speech/convert (ssml)",
+            "POST",
+            "/speech/convert",
+            params=self._convert_params(text, input_format="SSML"),
+            headers=user.headers,
+        )
+
+    async def convert_stream(self, user: VirtualUser) -> None:
+        text = self._document(user.rng, user.rng.randint(3, 8))
+        await self._request(
+            "POST /speech/convert (stream)",
+            "POST",
+            "/speech/convert",
+            params=self._convert_params(text, stream=True),
+            headers=user.headers,
+        )
+
+    async def convert_batch(self, user: VirtualUser) -> None:
+        texts = [user.rng.choice(self.prompts) for _ in range(self.args.batch_size // 2)]
+        texts += [self._sentence(user.rng) for _ in range(self.args.batch_size - len(texts))]
+        items = [
+            {"text": text, "language": "en", "voice_preference": "default"} for text in texts
+        ]
+        await self._request(
+            "POST /speech/convert/batch",
+            "POST",
+            "/speech/convert/batch",
+            json={"items": items},
+            headers=user.headers,
+        )
+
+    async def job(self, user: VirtualUser) -> None:
+        params = self._convert_params(self._document(user.rng, 3))
+        del params["speed"], params["pitch"]
+        response = await self._request(
+            "POST /speech/jobs", "POST", "/speech/jobs", params=params, headers=user.headers
+        )
+        if response is None or response.status_code != 202:
+            return
+        await self._request(
+            "GET /speech/jobs/{jobId}",
+            "GET",
+            f"/speech/jobs/{response.json()['job_id']}",
+            params={"wait": 10},
+            headers=user.headers,
+        )
+
+    async def output(self, user: VirtualUser) -> None:
+        if not user.output_ids:
+            return
+        await self._request(
+            "GET /speech/output/{fileId}",
+            "GET",
+            f"/speech/output/{user.rng.choice(user.output_ids)}",
+            headers=user.headers,
+        )
+
+    async def login_burst(self, user: VirtualUser) -> None:
+        await asyncio.gather(
+            *(
+                self._request(
+                    "POST /auth/login",
+                    "POST",
+                    "/auth/login",
+                    params={"email": user.email, "password": PASSWORD},
+                )
+                for _ in range(self.args.login_burst)
+            )
+        )
+
+    async def refresh(self, user: VirtualUser) -> None:
+        await self._request(
+            "POST /auth/refresh", "POST", "/auth/refresh", params={"existing_token": user.token}
+        )
+
+    async def preferences_read(self, user: VirtualUser) -> None:
+        await self._request(
+            "GET /user/preferences", "GET", "/user/preferences", headers=user.headers
+        )
+
+    def _preference_params(self, user: VirtualUser) -> Dict[str, Any]:
+        return {
+            "voice": user.rng.choice(["default", "warm", "bright"]),
+            "speed": user.rng.choice([0.9, 1.0, 1.1]),
+            "pitch": 0.0,
+            "language": "en",
+        }
+
+    async def preferences_write(self, user: VirtualUser) -> None:
+        await self._request(
+            "PUT /user/preferences",
+            "PUT",
+            "/user/preferences",
+            params=self._preference_params(user),
+            headers=user.headers,
+        )
+
+    async def preferences_replace(self, user: VirtualUser) -> None:
+        await self._request(
+            "DELETE /user/preferences", "DELETE", "/user/preferences", headers=user.headers
+        )
+        await self._request(
+            "POST /user/preferences",
+            "POST",
+            "/user/preferences",
+            params=self._preference_params(user),
+            headers=user.headers,
+        )
+
+    async def metrics(self, user: VirtualUser) -> None:
+        await self._request("GET /metrics", "GET", "/metrics")
+
+    async def websocket(self, user: VirtualUser) -> None:
+        fragments = [self._sentence(user.rng) + " " for _ in range(user.rng.randint(2, 4))]
+        started_at = time.perf_counter()
+        code = await websocket_session(
+            self.app, "/speech/stream", "language=en&voice_preference=default", user, fragments
+        )
+        self.recorder.record("WS /speech/stream", code, time.perf_counter() - started_at)
+
+    async def run_user(self, user: VirtualUser, mix: Dict[str, float], deadline: float) -> None:
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        while time.perf_counter() < deadline:
+            await self.operations[user.rng.choices(names, weights)[0]](user)
+
+
+async def websocket_session(
+    app: Any, path: str, query: str, user: VirtualUser, fragments: List[str]
+) -> int:
+    """
+    Run one ``/speech/stream`` session against the ASGI app and return its close code.
+    """
+    inbound: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    outbound: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+    scope = {
+        "type": "websocket",
+        "asgi": {"version": "3.0"},
+        "scheme": "ws",
+        "server": ("bench", 80),
+        "client": ("bench", 1),
+        "root_path": "",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": [(b"authorization", user.headers["Authorization"].encode())],
+        "subprotocols": [],
+    }
+    await inbound.put({"type": "websocket.connect"})
+    session = asyncio.ensure_future(app(scope, inbound.get, outbound.put))
+    try:
+        message = await outbound.get()
+        if message["type"] == "websocket.close":
+            return message.get("code", 1000)
+        messages = [{"type": "text", "text": fragment} for fragment in fragments]
+        for message in messages + [{"type": "close"}]:
+            await inbound.put({"type": "websocket.receive", "text": json.dumps(message)})
+        while True:
+            message = await outbound.get()
+            if message["type"] == "websocket.close":
+                return message.get("code", 1000)
+    finally:
+        await inbound.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.gather(session, return_exceptions=True)
+
+
+async def seed(args: argparse.Namespace, run_id: str) -> List[Tuple[str, str]]:
+    """
+    Create the virtual users' accounts, subscriptions and preferences.
+
+    Returns:
+        List[Tuple[str, str]]: The id and email of each account.
+    """
+    import prisma.enums
+    import prisma.models
+    import project.password_hashing
+
+    password_hash = project.password_hashing.pwd_context.hash(PASSWORD)
+    rng = random.Random(args.seed)
+    accounts = []
+    for index in range(args.users):
+        email = f"bench-{run_id}-{index}@example.com"
+        user = await prisma.models.User.prisma().create(
+            data={"email": email, "password": password_hash}
+        )
+        plan = rng.choices(list(PLAN_SHARES), list(PLAN_SHARES.values()))[0]
+        await prisma.models.Subscription.prisma().create(
+            data={
+                "userId": user.id,
+                "plan": prisma.enums.SubscriptionPlan[plan],
+                "status": prisma.enums.SubscriptionStatus.ACTIVE,
+            }
+        )
+        await prisma.models.UserPreference.prisma().create(
+            data={
+                "userId": user.id,
+                "voice": "default",
+                "speed": 1.0,
+                "pitch": 0.0,
+                "language": "en",
+            }
+        )
+        accounts.append((user.id, email))
+    return accounts
+
+
+async def collect_outputs(load_test: LoadTest, user: VirtualUser) -> None:
+    """
+    Convert a prompt for the user, unrecorded, and remember the id of its output.
+    """
+    import prisma.models
+
+    await load_test.convert_repeated(user)
+    request = await prisma.models.SpeechRequest.prisma().find_first(
+        where={"userId": user.user_id},
+        include={"speechResult": True},
+        order={"createdAt": "desc"},
+    )
+    if request is not None and request.speechResult is not None:
+        user.output_ids.append(request.speechResult.id)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    configure_environment(args)
+    # The service reads its configuration when imported, so it is imported only now.
+    import project.auth
+    import project.server
+
+    if not args.database_url:
+        import benchmarks.inmemory_prisma
+
+        database = benchmarks.inmemory_prisma.InMemoryDatabase()
+        benchmarks.inmemory_prisma.install(database)
+        project.server.db_client = database
+
+    app = project.server.app
+    run_id = f"{int(time.time())}-{os.getpid()}"
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=120
+    ) as client:
+        accounts = await seed(args, run_id)
+        load_test = LoadTest(app, client, args)
+        users = [
+            VirtualUser(
+                index,
+                user_id,
+                email,
+                project.auth.create_access_token(user_id, email, "USER"),
+                args.seed + index,
+            )
+            for index, (user_id, email) in enumerate(accounts)
+        ]
+        await asyncio.gather(*(collect_outputs(load_test, user) for user in users))
+
+        deadline = time.perf_counter() + args.warmup + args.duration
+
+        async def record_window() -> None:
+            # Requests still running at the deadline finish unrecorded, so that throughput is
+            # counted over exactly the measured duration.
+            await asyncio.sleep(args.warmup)
+            load_test.recorder.enabled = True
+            await asyncio.sleep(args.duration)
+            load_test.recorder.enabled = False
+
+        await asyncio.gather(
+            record_window(), *(load_test.run_user(user, args.mix, deadline) for user in users)
+        )
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "database": "postgres" if args.database_url else "in-memory",
+            "users": args.users,
+            "duration_seconds": args.duration,
+            "warmup_seconds": args.warmup,
+            "mix": args.mix,
+            "tts": {
+                "latency_seconds": args.tts_latency,
+                "jitter_seconds": args.tts_jitter,
+                "tail_rate": args.tts_tail_rate,
+                "tail_seconds": args.tts_tail_seconds,
+                "failure_rate": args.tts_failure_rate,
+            },
+            "seed": args.seed,
+        },
+        "endpoints": load_test.recorder.summary(args.duration),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(results: Dict[str, Any]) -> None:
+    meta = results["meta"]
+    print(
+        f"commit {meta['commit']}, {meta['users']} users, {meta['duration_seconds']:.0f} s, "
+        f"{meta['database']} database, upstream {meta['tts']['latency_seconds'] * 1000:.0f} ms\n"
+    )
+    print(f"{'endpoint':<34} {'req/s':>8} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, result in results["endpoints"].items():
+        print(
+            f"{endpoint:<34} {result['throughput_rps']:8.1f} {result['errors']:7d} "
+            f"{result['p50_ms']:9.1f} {result['p95_ms']:9.1f} {result['p99_ms']:9.1f}"
+        )
+
+
+def change(before: float, after: float) -> float:
+    return (after - before) / before * 100 if before else 0.0
+
+
+def compare(before_path: str, after_path: str, threshold: float) -> bool:
+    """
+    Print per-endpoint changes between two result files.
+
+    Returns:
+        bool: Whether any endpoint lost more than ``threshold`` percent of its throughput or
+        gained more than that on its p99 latency.
+    """
+    with open(before_path) as before_file, open(after_path) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+    print(f"{before['meta']['commit']} -> {after['meta']['commit']}\n")
+    print(f"{'endpoint':<34} {'req/s':>16} {'p50 ms':>18} {'p99 ms':>18}")
+    regressed = False
+    for endpoint in sorted(set(before["endpoints"]) | set(after["endpoints"])):
+        old, new = before["endpoints"].get(endpoint), after["endpoints"].get(endpoint)
+        if old is None or new is None:
+            print(f"{endpoint:<34} only in {'after' if old is None else 'before'}")
+            continue
+        throughput = change(old["throughput_rps"], new["throughput_rps"])
+        p50 = change(old["p50_ms"], new["p50_ms"])
+        p99 = change(old["p99_ms"], new["p99_ms"])
+        flag = throughput < -threshold or p99 > threshold
+        regressed = regressed or flag
+        print(
+            f"{endpoint:<34} {new['throughput_rps']:8.1f} {throughput:+6.1f}% "
+            f"{new['p50_ms']:9.1f} {p50:+7.1f}% {new['p99_ms']:9.1f} {p99:+7.1f}%"
+            + ("  REGRESSION" if flag else "")
+        )
+    return regressed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=32, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="unmeasured seconds first")
+    parser.add_argument(
+        "--mix", type=parse_mix, default=dict(MIX), help="operation weights, e.g. refresh=0,job=10"
+    )
+    parser.add_argument("--prompts", type=int, default=20, help="distinct repeated prompts")
+    parser.add_argument("--batch-size", type=int, default=10, help="items per batch conversion")
+    parser.add_argument("--login-burst", type=int, default=5, help="concurrent logins per burst")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12, help="cost of seeded hashes")
+    parser.add_argument("--tts-latency", type=float, default=0.3, help="upstream seconds")
+    parser.add_argument("--tts-jitter", type=float, default=0.1, help="uniform +/- seconds")
+    parser.add_argument("--tts-tail-rate", type=float, default=0.01, help="share of slow calls")
+    parser.add_argument("--tts-tail-seconds", type=float, default=3.0, help="slow call seconds")
+    parser.add_argument("--tts-failure-rate", type=float, default=0.0, help="share of failures")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the traffic and upstream")
+    parser.add_argument("--database-url", default="", help="use this Postgres database")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="diff two result files"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=10.0, help="percent change flagged by --compare"
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+    results = asyncio.run(run(args))
+    report(results)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Queue wait per plan while FREE traffic floods the synthesis scheduler.
+
+FREE users send conversions at ``--overload`` times the scheduler's capacity while PREMIUM
+users send a steady ``--premium-share`` of it. Each conversion holds its slot for a jittered
+``--service-ms``. The baseline treats everyone as one plan, which is first-come-first-served;
+the plan-aware run uses the configured weights, caps and queues (rate limits are left off so
+only scheduling is measured). Rejected conversions are counted, not retried.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_scheduler --seconds 10
+"""
+import argparse
+import asyncio
+import random
+import time
+from typing import Dict, List
+
+import project.synthesis_scheduler as scheduling
+
+
+class StaticPlans:
+    """
+    Plan lookup without a database: the plan is encoded in the user id.
+    """
+
+    def __init__(self, single_plan: bool):
+        self.single_plan = single_plan
+
+    async def get(self, user_id: str) -> str:
+        return scheduling.DEFAULT_PLAN if self.single_plan else user_id.split("-")[0]
+
+
+def percentile(samples: List[float], percentile: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(percentile / 100 * len(ordered)))]
+
+
+async def run(args: argparse.Namespace, plan_aware: bool) -> Dict[str, Dict[str, float]]:
+    policies = {
+        plan: policy._replace(rate=0.0)
+        for plan, policy in scheduling.configured_policies().items()
+    }
+    if not plan_aware:
+        policies[scheduling.DEFAULT_PLAN] = scheduling.PlanPolicy(
+            1.0, 0.0, 0.0, args.concurrency, 10**9
+        )
+    scheduler = scheduling.SynthesisScheduler(
+        args.concurrency, policies, StaticPlans(not plan_aware), 10000
+    )
+    rng = random.Random(0)
+    waits: Dict[str, List[float]] = {"FREE": [], "PREMIUM": []}
+    rejected = {"FREE": 0, "PREMIUM": 0}
+    capacity = args.concurrency / (args.service_ms / 1000)
+
+    async def convert(plan: str) -> None:
+        user_id = f"{plan}-{rng.randrange(200)}"
+        started = time.perf_counter()
+        try:
+            admission = await scheduler.acquire(user_id)
+        except scheduling.SynthesisQueueFull:
+            rejected[plan] += 1
+            return
+        waits[plan].append(time.perf_counter() - started)
+        try:
+            await asyncio.sleep(args.service_ms / 1000 * rng.uniform(0.5, 1.5))
+        finally:
+            scheduler.release(admission)
+
+    async def arrivals(plan: str, rate: float, tasks: List["asyncio.Task[None]"]) -> None:
+        deadline = time.perf_counter() + args.seconds
+        while time.perf_counter() < deadline:
+            tasks.append(asyncio.ensure_future(convert(plan)))
+            await asyncio.sleep(rng.expovariate(rate))
+
+    tasks: List["asyncio.Task[None]"] = []
+    await asyncio.gather(
+        arrivals("FREE", capacity * args.overload, tasks),
+        arrivals("PREMIUM", capacity * args.premium_share, tasks),
+    )
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {
+        plan: {
+            "p50": percentile(samples, 50),
+            "p99": percentile(samples, 99),
+            "admitted": len(samples),
+            "rejected": rejected[plan],
+        }
+        for plan, samples in waits.items()
+    }
+
+
+def report(label: str, results: Dict[str, Dict[str, float]]) -> None:
+    for plan, result in results.items():
+        print(
+            f"{label:<12} {plan:<8} wait p50 {result['p50'] * 1000:8.1f} ms   "
+            f"p99 {result['p99'] * 1000:8.1f} ms   "
+            f"admitted {result['admitted']:6d}   rejected {result['rejected']:6d}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=10.0, help="length of each run")
+    parser.add_argument("--concurrency", type=int, default=16, help="scheduler slots")
+    parser.add_argument("--service-ms", type=float, default=50.0, help="mean slot hold time")
+    parser.add_argument(
+        "--overload", type=float, default=1.5, help="FREE arrival rate, as a share of capacity"
+    )
+    parser.add_argument(
+        "--premium-share", type=float, default=0.2, help="PREMIUM arrival rate, as a share"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{args.concurrency} slots of {args.service_ms:.0f} ms, FREE at {args.overload:.1f}x "
+        f"capacity, PREMIUM at {args.premium_share:.1f}x, {args.seconds:.0f} s per run\n"
+    )
+    report("fcfs", asyncio.run(run(args, plan_aware=False)))
+    report("plan-aware", asyncio.run(run(args, plan_aware=True)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""
+In-memory stand-in for the generated Prisma client, for hermetic benchmarks.
+
+It implements the part of the client API the service uses: per-model ``create``,
+``create_many``, ``find_unique``, ``find_first``, ``find_many``, ``update``, ``update_many``,
+``delete_many`` and ``count`` with equality filters, the ``speechResult`` / ``speechRequest``
+relations (nested create, connect and include), transactions, and the raw statements of the job
+queue, the audio store sweeper, preference invalidation and the cache pre-warm. Records are
+plain namespaces with the schema's defaults filled in. Nothing here is meant to match Postgres
+performance: it takes the database out of the measurement so that regressions in the service
+itself show.
+"""
+import copy
+import types
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import prisma
+import prisma.enums
+import prisma.models
+import project.audio_store
+import project.cache_prewarm
+import project.speech_job_queue
+
+MODELS = ["User", "UserPreference", "SpeechRequest", "SpeechResult", "Subscription", "Log"]
+
+# Unique fields besides id, indexed so lookups by them do not scan a table that grows with the run.
+UNIQUE_FIELDS = {"User": ["email"], "SpeechResult": ["speechRequestId"]}
+
+# (model, relation field) -> (related model, field on the related record, field on this one)
+RELATIONS: Dict[Tuple[str, str], Tuple[str, str, str]] = {
+    ("SpeechRequest", "speechResult"): ("SpeechResult", "speechRequestId", "id"),
+    ("SpeechResult", "speechRequest"): ("SpeechRequest", "id", "speechRequestId"),
+}
+
+
+# Columns of a cache pre-warm prompt row, in GROUP BY order, followed by its count.
+TOP_PROMPT_COLUMNS = (
+    "text",
+    "inputFormat",
+    "outputFormat",
+    "language",
+    "voicePreference",
+    "speed",
+    "pitch",
+    "requests",
+)
+
+
+def defaults(model: str) -> Dict[str, Any]:
+    now = datetime.now(timezone.utc)
+    values: Dict[str, Any] = {"id": str(uuid.uuid4())}
+    if model in ("User", "SpeechRequest", "Subscription"):
+        values.update(createdAt=now, updatedAt=now)
+    if model == "User":
+        values.update(lastLogin=None, role=prisma.enums.Role.USER)
+    if model == "SpeechRequest":
+        values.update(
+            language="en",
+            voicePreference="",
+            speed=None,
+            pitch=None,
+            attempts=0,
+            nextAttemptAt=None,
+            lastError=None,
+            processedAt=None,
+        )
+    if model == "SpeechResult":
+        values.update(durationSeconds=0.0, bitrate=0, frameCount=0, sampleRate=0)
+    if model == "Log":
+        values.update(loggedAt=now)
+    return values
+
+
+class Record(types.SimpleNamespace):
+    pass
+
+
+class ModelActions:
+    """
+    The ``Model.prisma()`` actions of one model, backed by an InMemoryDatabase table.
+    """
+
+    def __init__(self, database: "InMemoryDatabase", model: str):
+        self.database = database
+        self.model = model
+        self.rows: Dict[str, Record] = database.tables[model]
+        self.indexes: Dict[str, Dict[Any, str]] = {
+            field: {} for field in UNIQUE_FIELDS.get(model, [])
+        }
+
+    def _matches(self, record: Record, where: Optional[Dict[str, Any]]) -> bool:
+        return all(
+            getattr(record, field, None) == value for field, value in (where or {}).items()
+        )
+
+    def _select(self, where: Optional[Dict[str, Any]]) -> List[Record]:
+        if where is not None and len(where) == 1:
+            field, value = next(iter(where.items()))
+            if field == "id" or field in self.indexes:
+                record = self.rows.get(value if field == "id" else self.indexes[field].get(value))
+                return [] if record is None else [record]
+        return [record for record in self.rows.values() if self._matches(record, where)]
+
+    def _with_relations(self, record: Record, include: Optional[Dict[str, Any]]) -> Record:
+        result = copy.copy(record)
+        for field in include or {}:
+            related_model, related_field, own_field = RELATIONS[(self.model, field)]
+            matches = self.database.actions(related_model)._select(
+                {related_field: getattr(record, own_field)}
+            )
+            setattr(result, field, matches[0] if matches else None)
+        return result
+
+    def _nested(self, record: Record, data: Dict[str, Any]) -> None:
+        for (model, field), (related_model, related_field, own_field) in RELATIONS.items():
+            if model == self.model and isinstance(data.get(field), dict):
+                nested = dict(data[field]["create"])
+                nested[related_field] = getattr(record, own_field)
+                self.database.actions(related_model)._insert(nested)
+
+    def _insert(self, data: Dict[str, Any]) -> Record:
+        values = defaults(self.model)
+        for field, value in data.items():
+            if isinstance(value, dict) and "connect" in value:
+                values[f"{field}Id"] = value["connect"]["id"]
+            elif not isinstance(value, dict):
+                values[field] = value
+        record = Record(**values)
+        self.rows[record.id] = record
+        for field, index in self.indexes.items():
+            index[values[field]] = record.id
+        self._nested(record, data)
+        return record
+
+    def _apply(self, record: Record, data: Dict[str, Any]) -> None:
+        for field, value in data.items():
+            if isinstance(value, dict) and "increment" in value:
+                setattr(record, field, getattr(record, field) + value["increment"])
+            elif isinstance(value, dict) and "decrement" in value:
+                setattr(record, field, getattr(record, field) - value["decrement"])
+            elif not isinstance(value, dict):
+                setattr(record, field, value)
+        if hasattr(record, "updatedAt"):
+            record.updatedAt = datetime.now(timezone.utc)
+        self._nested(record, data)
+
+    async def create(
+        self, data: Dict[str, Any], include: Optional[Dict[str, Any]] = None
+    ) -> Record:
+        return self._with_relations(self._insert(data), include)
+
+    async def create_many(self, data: List[Dict[str, Any]], skip_duplicates: bool = False) -> int:
+        for row in data:
+            self._insert(row)
+        return len(data)
+
+    async def find_unique(
+        self, where: Dict[str, Any], include: Optional[Dict[str, Any]] = None
+    ) -> Optional[Record]:
+        matches = self._select(where)
+        return self._with_relations(matches[0], include) if matches else None
+
+    async def find_first(
+        self,
+        where: Optional[Dict[str, Any]] = None,
+        include: Optional[Dict[str, Any]] = None,
+        order: Optional[Dict[str, str]] = None,
+    ) -> Optional[Record]:
+        matches = await self.find_many(where=where, include=include, order=order)
+        return matches[0] if matches else None
+
+    async def find_many(
+        self,
+        where: Optional[Dict[str, Any]] = None,
+        include: Optional[Dict[str, Any]] = None,
+        order: Optional[Dict[str, str]] = None,
+        take: Optional[int] = None,
+    ) -> List[Record]:
+        matches = self._select(where)
+        for field, direction in (order or {}).items():
+            matches.sort(key=lambda record: getattr(record, field), reverse=direction == "desc")
+        return [self._with_relations(record, include) for record in matches[:take]]
+
+    async def update(
+        self,
+        where: Dict[str, Any],
+        data: Dict[str, Any],
+        include: Optional[Dict[str, Any]] = None,
+    ) -> Optional[Record]:
+        matches = self._select(where)
+        if not matches:
+            return None
+        self._apply(matches[0], data)
+        return self._with_relations(matches[0], include)
+
+    async def update_many(self, where: Dict[str, Any], data: Dict[str, Any]) -> int:
+        matches = self._select(where)
+        for record in matches:
+            self._apply(record, data)
+        return len(matches)
+
+    async def delete_many(self, where: Optional[Dict[str, Any]] = None) -> int:
+        matches = self._select(where)
+        for record in matches:
+            del self.rows[record.id]
+            for field, index in self.indexes.items():
+                index.pop(getattr(record, field), None)
+        return len(matches)
+
+    async def count(self, where: Optional[Dict[str, Any]] = None) -> int:
+        return len(self._select(where))
+
+
+class InMemoryDatabase:
+    """
+    Tables of records keyed by id, plus the client-level calls the service makes.
+    """
+
+    def __init__(self):
+        self.tables: Dict[str, Dict[str, Record]] = {model: {} for model in MODELS}
+        self._actions = {model: ModelActions(self, model) for model in MODELS}
+        self.advisory_locks: Set[str] = set()
+
+    def actions(self, model: str) -> ModelActions:
+        return self._actions[model]
+
+    async def connect(self) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+    def is_connected(self) -> bool:
+        return True
+
+    def tx(self, timeout: Optional[timedelta] = None) -> "InMemoryTransaction":
+        return InMemoryTransaction(self)
+
+    def _claim_job(self, lease_seconds: float, max_attempts: int) -> List[Dict[str, Any]]:
+        now = datetime.now(timezone.utc)
+        stale = now - timedelta(seconds=lease_seconds)
+        claimable = [
+            record
+            for record in self.tables["SpeechRequest"].values()
+            if (
+                record.status == prisma.enums.ProcessStatus.PENDING
+                and (record.nextAttemptAt is None or record.nextAttemptAt <= now)
+            )
+            or (
+                record.status == prisma.enums.ProcessStatus.PROCESSING
+                and record.updatedAt < stale
+                and record.attempts < max_attempts
+            )
+        ]
+        if not claimable:
+            return []
+        job = min(claimable, key=lambda record: record.createdAt)
+        job.status = prisma.enums.ProcessStatus.PROCESSING
+        job.attempts += 1
+        job.updatedAt = now
+        return [
+            {
+                "id": job.id,
+                "userId": job.userId,
+                "inputText": job.inputText,
+                "inputFormat": job.inputFormat.value,
+                "language": job.language,
+                "voicePreference": job.voicePreference,
+                "speed": job.speed,
+                "pitch": job.pitch,
+                "attempts": job.attempts,
+            }
+        ]
+
+    def _fail_abandoned_jobs(self, lease_seconds: float, max_attempts: int) -> int:
+        now = datetime.now(timezone.utc)
+        stale = now - timedelta(seconds=lease_seconds)
+        failed = 0
+        for record in self.tables["SpeechRequest"].values():
+            if (
+                record.status == prisma.enums.ProcessStatus.PROCESSING
+                and record.updatedAt < stale
+                and record.attempts >= max_attempts
+            ):
+                record.status = prisma.enums.ProcessStatus.FAILED
+                record.processedAt = record.updatedAt = now
+                record.lastError = "The job's worker stopped before it finished, on every attempt."
+                failed += 1
+        return failed
+
+    def _extend_lease(self, job_id: str, attempts: int) -> int:
+        record = self.tables["SpeechRequest"].get(job_id)
+        if (
+            record is None
+            or record.status != prisma.enums.ProcessStatus.PROCESSING
+            or record.attempts != attempts
+        ):
+            return 0
+        record.updatedAt = datetime.now(timezone.utc)
+        return 1
+
+    def _recent_completed(self, window_seconds: float) -> List[Record]:
+        since = datetime.now(timezone.utc) - timedelta(seconds=window_seconds)
+        return [
+            record
+            for record in self.tables["SpeechRequest"].values()
+            if record.status == prisma.enums.ProcessStatus.COMPLETED and record.createdAt >= since
+        ]
+
+    def _top_prompts(self, window_seconds: float, limit: int) -> List[Dict[str, Any]]:
+        counts: Dict[Tuple[Any, ...], int] = {}
+        for record in self._recent_completed(window_seconds):
+            prompt = (
+                record.inputText,
+                record.inputFormat.value,
+                record.outputFormat.value,
+                record.language,
+                record.voicePreference,
+                record.speed,
+                record.pitch,
+            )
+            counts[prompt] = counts.get(prompt, 0) + 1
+        top = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [dict(zip(TOP_PROMPT_COLUMNS, prompt + (requests,))) for prompt, requests in top]
+
+    async def query_raw(self, query: str, *args: Any) -> List[Dict[str, Any]]:
+        if query == project.speech_job_queue.CLAIM_JOB_SQL:
+            return self._claim_job(*args)
+        if query == project.audio_store.REFERENCED_PATHS_SQL:
+            paths = {result.audioFilePath for result in self.tables["SpeechResult"].values()}
+            return [{"path": path} for path in paths]
+        if query == project.cache_prewarm.TOP_PROMPTS_SQL:
+            return self._top_prompts(*args)
+        if query == project.cache_prewarm.RECENT_REQUESTS_SQL:
+            return [{"requests": len(self._recent_completed(*args))}]
+        raise NotImplementedError(f"Raw query not supported in memory: {query}")
+
+    async def execute_raw(self, query: str, *args: Any) -> int:
+        if query.startswith("SELECT pg_notify"):
+            # Every worker shares this process, where the sender already dropped its entry.
+            return 0
+        if query == project.speech_job_queue.FAIL_ABANDONED_JOBS_SQL:
+            return self._fail_abandoned_jobs(*args)
+        if query == project.speech_job_queue.EXTEND_LEASE_SQL:
+            return self._extend_lease(*args)
+        raise NotImplementedError(f"Raw statement not supported in memory: {query}")
+
+
+class InMemoryTransaction:
+    """
+    ``async with client.tx() as transaction`` without isolation: writes apply immediately.
+
+    Advisory locks taken through the transaction are held until it ends, like Postgres's
+    transaction-level advisory locks; everything else goes straight to the database.
+    """
+
+    def __init__(self, database: InMemoryDatabase):
+        self.database = database
+        self.advisory_locks: Set[str] = set()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.database, name)
+
+    async def __aenter__(self) -> "InMemoryTransaction":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.database.advisory_locks -= self.advisory_locks
+        self.advisory_locks.clear()
+
+    def _try_advisory_lock(self, name: str) -> bool:
+        if name not in self.advisory_locks:
+            if name in self.database.advisory_locks:
+                return False
+            self.database.advisory_locks.add(name)
+            self.advisory_locks.add(name)
+        return True
+
+    async def query_raw(self, query: str, *args: Any) -> List[Dict[str, Any]]:
+        if query == project.cache_prewarm.PREWARM_LOCK_SQL:
+            return [{"locked": self._try_advisory_lock("tts_cache_prewarm")}]
+        return await self.database.query_raw(query, *args)
+
+
+def install(database: InMemoryDatabase) -> None:
+    """
+    Route ``prisma.get_client()`` and every ``Model.prisma()`` to ``database``.
+
+    Call this before the application starts; ``project.server.db_client`` must be replaced
+    separately, since it is created when the server module is imported.
+    """
+    prisma.get_client = lambda: database
+    for model in MODELS:
+        getattr(prisma.models, model).prisma = classmethod(
+            lambda cls, client=None, model=model: database.actions(model)
+        )
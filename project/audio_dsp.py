@@ -0,0 +1,318 @@
+import math
+import os
+from typing import Iterable, Iterator, Optional
+
+import lameenc
+import miniaudio
+import numpy as np
+import project.mp3
+import project.wav
+
+AUDIO_DSP_BLOCK_SAMPLES = int(os.getenv("AUDIO_DSP_BLOCK_SAMPLES", "16384"))
+
+AUDIO_DSP_MP3_BITRATE_KBPS = int(os.getenv("AUDIO_DSP_MP3_BITRATE_KBPS", "64"))
+
+MIN_SPEED, MAX_SPEED = 0.25, 4.0
+
+MIN_PITCH, MAX_PITCH = -12.0, 12.0
+
+# Upper bound on analysis frames transformed at once; keeps the per-call working set at a few
+# MiB however large the block handed to the stretcher is.
+_MAX_BATCH_FRAMES = 512
+
+
+def has_effects(speed: Optional[float], pitch: Optional[float]) -> bool:
+    """
+    Whether ``speed`` or ``pitch`` ask for anything other than the voice as synthesized.
+    """
+    return (speed is not None and round(speed, 3) != 1.0) or (
+        pitch is not None and round(pitch, 3) != 0.0
+    )
+
+
+def validate_effects(speed: Optional[float], pitch: Optional[float]) -> None:
+    """
+    Check that ``speed`` and ``pitch`` are within the range the DSP stage supports.
+
+    Raises:
+        ValueError: If speed is outside [MIN_SPEED, MAX_SPEED] or pitch outside
+        [MIN_PITCH, MAX_PITCH] semitones.
+    """
+    if speed is not None and not MIN_SPEED <= speed <= MAX_SPEED:
+        raise ValueError(f"speed must be between {MIN_SPEED} and {MAX_SPEED}.")
+    if pitch is not None and not MIN_PITCH <= pitch <= MAX_PITCH:
+        raise ValueError(f"pitch must be between {MIN_PITCH} and {MAX_PITCH} semitones.")
+
+
+def _nearest_peaks(magnitude: np.ndarray) -> np.ndarray:
+    """
+    For every bin of every frame, the index of the closest local maximum of its frame.
+    """
+    bins = np.arange(magnitude.shape[1])
+    peak = np.zeros(magnitude.shape, dtype=bool)
+    peak[:, 1:-1] = (magnitude[:, 1:-1] > magnitude[:, :-2]) & (
+        magnitude[:, 1:-1] >= magnitude[:, 2:]
+    )
+    peak[:, 0] |= ~peak.any(axis=1)
+    left = np.maximum.accumulate(np.where(peak, bins, -len(bins)), axis=1)
+    right = np.minimum.accumulate(np.where(peak, bins, 2 * len(bins))[:, ::-1], axis=1)[:, ::-1]
+    return np.where(bins - left <= right - bins, left, right)
+
+
+class TimeStretcher:
+    """
+    Streaming phase-vocoder time stretch of mono float PCM.
+
+    ``rate`` > 1 shortens the audio, < 1 lengthens it; pitch is preserved. Each output frame
+    takes its magnitude from the input at the scaled position and advances its phase by the
+    input's own phase advance over one hop at that position, so no frequency estimation or
+    unwrapping is needed and a rate of 1 reconstructs the input exactly. All frames available
+    in a block are transformed together with NumPy; only the tail needed by the next frame is
+    kept between calls.
+    """
+
+    def __init__(self, rate: float, frame_size: int = 1024, hop: int = 256):
+        self.rate = rate
+        self.frame_size = frame_size
+        self.hop = hop
+        self._analysis_hop = hop * rate
+        self._window = np.hanning(frame_size + 1)[:-1]
+        self._norm = float(np.sum(self._window**2)) / hop
+        self._offsets = np.arange(frame_size)
+        # Virtual input starts with hop + frame_size zeros so the first frames see silence.
+        self._buffer = np.zeros(hop + frame_size)
+        self._buffer_start = 0
+        self._next_frame = 0
+        self._phase = np.zeros(frame_size // 2 + 1)
+        self._overlap = np.zeros(frame_size - hop)
+        self._skip = round(frame_size / rate)
+        self._input_samples = 0
+        self._output_samples = 0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Feed a block of input and return the output that is now final.
+        """
+        self._input_samples += len(samples)
+        self._buffer = np.concatenate([self._buffer, samples])
+        return self._trim(self._run())
+
+    def flush(self) -> np.ndarray:
+        """
+        Return the remaining output once the input has ended.
+        """
+        self._buffer = np.concatenate([self._buffer, np.zeros(self.frame_size + self.hop)])
+        tail = np.concatenate([self._run(), self._overlap / self._norm])
+        self._overlap = np.zeros(0)
+        before = self._output_samples
+        tail = self._trim(tail)
+        wanted = max(round(self._input_samples / self.rate) - before, 0)
+        if len(tail) < wanted:
+            tail = np.concatenate([tail, np.zeros(wanted - len(tail))])
+        self._output_samples = before + wanted
+        return tail[:wanted]
+
+    def _trim(self, output: np.ndarray) -> np.ndarray:
+        if self._skip:
+            skipped = min(self._skip, len(output))
+            output = output[skipped:]
+            self._skip -= skipped
+        self._output_samples += len(output)
+        return output
+
+    def _run(self) -> np.ndarray:
+        end = self._buffer_start + len(self._buffer)
+        last_frame = math.floor((end - self.hop - self.frame_size) / self._analysis_hop)
+        pieces = []
+        while self._next_frame <= last_frame:
+            count = min(last_frame - self._next_frame + 1, _MAX_BATCH_FRAMES)
+            pieces.append(self._transform(count))
+        next_position = math.floor(self._next_frame * self._analysis_hop)
+        self._buffer = self._buffer[next_position - self._buffer_start :]
+        self._buffer_start = next_position
+        if not pieces:
+            return np.zeros(0)
+        return np.concatenate(pieces)
+
+    def _transform(self, count: int) -> np.ndarray:
+        frames = np.arange(self._next_frame, self._next_frame + count)
+        positions = np.floor(frames * self._analysis_hop).astype(np.int64) - self._buffer_start
+        indices = positions[:, None] + self._offsets
+        reference = np.fft.rfft(self._buffer[indices] * self._window)
+        current = np.fft.rfft(self._buffer[indices + self.hop] * self._window)
+        magnitude, angle = np.abs(current), np.angle(current)
+        phase = self._phase + np.cumsum(angle - np.angle(reference), axis=0)
+        self._phase = np.mod(phase[-1], 2 * np.pi)
+        # Identity phase locking: every bin keeps its analysed phase offset from the nearest
+        # spectral peak, so the bins of one partial stay coherent instead of cancelling.
+        peaks = _nearest_peaks(magnitude)
+        locked = np.take_along_axis(phase - angle, peaks, axis=1) + angle
+        synthesized = np.fft.irfft(magnitude * np.exp(1j * locked), self.frame_size)
+        synthesized *= self._window
+        output = np.zeros((count - 1) * self.hop + self.frame_size)
+        output[: len(self._overlap)] += self._overlap
+        for block in range(self.frame_size // self.hop):
+            start = block * self.hop
+            output[start : start + count * self.hop] += synthesized[
+                :, start : start + self.hop
+            ].reshape(-1)
+        self._overlap = output[count * self.hop :]
+        self._next_frame += count
+        return output[: count * self.hop] / self._norm
+
+
+class Resampler:
+    """
+    Streaming linear-interpolation resampler: output sample ``j`` is read at input ``j * ratio``.
+    """
+
+    def __init__(self, ratio: float):
+        self.ratio = ratio
+        self._buffer = np.zeros(0)
+        self._buffer_start = 0
+        self._next_output = 0
+        self._input_samples = 0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        self._input_samples += len(samples)
+        self._buffer = np.concatenate([self._buffer, samples])
+        return self._run(self._buffer_start + len(self._buffer) - 2)
+
+    def flush(self) -> np.ndarray:
+        self._buffer = np.concatenate([self._buffer, np.zeros(2)])
+        wanted = round(self._input_samples / self.ratio)
+        return self._run(
+            min(self._buffer_start + len(self._buffer) - 2, (wanted - 1) * self.ratio)
+        )
+
+    def _run(self, last_position: float) -> np.ndarray:
+        if last_position < 0:
+            return np.zeros(0)
+        last_output = math.floor(last_position / self.ratio)
+        if last_output < self._next_output:
+            return np.zeros(0)
+        positions = (
+            np.arange(self._next_output, last_output + 1) * self.ratio - self._buffer_start
+        )
+        whole = positions.astype(np.int64)
+        fraction = positions - whole
+        output = self._buffer[whole] * (1 - fraction) + self._buffer[whole + 1] * fraction
+        self._next_output = last_output + 1
+        keep_from = math.floor(self._next_output * self.ratio)
+        self._buffer = self._buffer[keep_from - self._buffer_start :]
+        self._buffer_start = keep_from
+        return output
+
+
+class TimePitchShifter:
+    """
+    Changes the speed and pitch of mono float PCM independently, block by block.
+
+    The audio is time-stretched by ``speed / ratio`` and then resampled by ``ratio``, where
+    ``ratio = 2 ** (pitch / 12)``: the resampling moves the pitch by ``pitch`` semitones and
+    the stretch makes the overall duration change by exactly ``1 / speed``.
+    """
+
+    def __init__(self, speed: Optional[float], pitch: Optional[float]):
+        ratio = 2 ** ((pitch or 0.0) / 12)
+        rate = (speed or 1.0) / ratio
+        self._stretcher = TimeStretcher(rate) if round(rate, 6) != 1.0 else None
+        self._resampler = Resampler(ratio) if round(ratio, 6) != 1.0 else None
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        if self._stretcher is not None:
+            samples = self._stretcher.process(samples)
+        if self._resampler is not None:
+            samples = self._resampler.process(samples)
+        return samples
+
+    def flush(self) -> np.ndarray:
+        samples = np.zeros(0)
+        if self._stretcher is not None:
+            samples = self._stretcher.flush()
+        if self._resampler is not None:
+            samples = np.concatenate([self._resampler.process(samples), self._resampler.flush()])
+        return samples
+
+
+def decode_mp3(audio: bytes, sample_rate: int) -> Iterator[np.ndarray]:
+    """
+    Decode MP3 audio to mono float PCM in [-1, 1], AUDIO_DSP_BLOCK_SAMPLES at a time.
+    """
+    for block in miniaudio.stream_memory(
+        audio,
+        output_format=miniaudio.SampleFormat.SIGNED16,
+        nchannels=1,
+        sample_rate=sample_rate,
+        frames_to_read=AUDIO_DSP_BLOCK_SAMPLES,
+    ):
+        yield np.frombuffer(block, dtype=np.int16) / 32768.0
+
+
+def to_pcm16(samples: np.ndarray) -> bytes:
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def encode_wav(blocks: Iterable[np.ndarray], sample_rate: int) -> bytes:
+    data = b"".join(to_pcm16(block) for block in blocks)
+    return project.wav.header(sample_rate, 1, len(data)) + data
+
+
+def encode_mp3(blocks: Iterable[np.ndarray], sample_rate: int) -> bytes:
+    encoder = lameenc.Encoder()
+    encoder.set_bit_rate(AUDIO_DSP_MP3_BITRATE_KBPS)
+    encoder.set_in_sample_rate(sample_rate)
+    encoder.set_channels(1)
+    encoder.set_quality(5)
+    encoded = [bytes(encoder.encode(to_pcm16(block))) for block in blocks]
+    encoded.append(bytes(encoder.flush()))
+    return b"".join(encoded)
+
+
+def process(
+    audio: bytes,
+    speed: Optional[float] = None,
+    pitch: Optional[float] = None,
+    output_format: str = "MP3",
+) -> bytes:
+    """
+    Apply speed and pitch changes to synthesized MP3 audio and encode it as MP3 or WAV.
+
+    The audio is decoded, processed and encoded block by block, so apart from the input and
+    the encoded result only a few blocks of PCM are held at once. This is CPU bound and is
+    meant to run on a synthesis pool worker.
+
+    Args:
+        audio (bytes): The synthesized MP3 audio.
+        speed (Optional[float]): Playback rate; 2.0 is twice as fast. None means 1.0.
+        pitch (Optional[float]): Pitch shift in semitones. None means 0.
+        output_format (str): ``MP3`` or ``WAV``.
+
+    Returns:
+        bytes: The processed audio in ``output_format``.
+
+    Raises:
+        ValueError: If the input is not MP3 audio, or speed or pitch are out of range.
+    """
+    validate_effects(speed, pitch)
+    wav = output_format.upper() == "WAV"
+    effects = has_effects(speed, pitch)
+    if not effects and not wav:
+        return audio
+    sample_rate = project.mp3.probe(audio).sample_rate
+    if not sample_rate:
+        raise ValueError("The synthesized audio is not MP3.")
+
+    def blocks() -> Iterator[np.ndarray]:
+        decoded = decode_mp3(audio, sample_rate)
+        if not effects:
+            yield from decoded
+            return
+        shifter = TimePitchShifter(speed, pitch)
+        for block in decoded:
+            yield shifter.process(block)
+        yield shifter.flush()
+
+    if wav:
+        return encode_wav(blocks(), sample_rate)
+    return encode_mp3(blocks(), sample_rate)
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import List, NamedTuple, Optional, Set
+
+import prisma
+import project.metrics
+
+logger = logging.getLogger(__name__)
+
+# Falls back to the speech cache's old setting so existing files stay in use.
+AUDIO_STORE_DIR = os.getenv(
+    "AUDIO_STORE_DIR",
+    os.getenv("SPEECH_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tts-speech-cache")),
+)
+
+AUDIO_STORE_MAX_BYTES = int(os.getenv("AUDIO_STORE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# Unreferenced files and abandoned staging files younger than this are left alone.
+AUDIO_STORE_ORPHAN_GRACE_SECONDS = int(os.getenv("AUDIO_STORE_ORPHAN_GRACE_SECONDS", "3600"))
+
+AUDIO_STORE_SWEEP_INTERVAL_SECONDS = float(
+    os.getenv("AUDIO_STORE_SWEEP_INTERVAL_SECONDS", "300")
+)
+
+# A quota pass evicts down to this fraction of the quota, so it does not run on every write.
+LOW_WATERMARK = 0.9
+
+# Access times are only bumped when older than this, to keep reads cheap.
+ATIME_RESOLUTION_SECONDS = 60
+
+STAGING_SUFFIX = ".part"
+
+REFERENCED_PATHS_SQL = 'SELECT DISTINCT "audioFilePath" AS path FROM speech_results'
+
+store_bytes = project.metrics.gauge(
+    "tts_audio_store_bytes", "Bytes of audio in the managed audio store, as of the last write."
+)
+
+store_files = project.metrics.gauge(
+    "tts_audio_store_files", "Files in the managed audio store, as of the last scan."
+)
+
+store_evictions = project.metrics.counter(
+    "tts_audio_store_evictions", "Files removed from the managed audio store.", ["reason"]
+)
+
+store_sweep_time = project.metrics.histogram(
+    "tts_audio_store_sweep_seconds", "Time a quota or orphan sweep took."
+)
+
+
+class StoredFile(NamedTuple):
+    path: str
+    size: int
+    atime: float
+
+
+class AudioStore:
+    """
+    Owns the audio files of synthesis results, under sharded content-addressed directories.
+
+    Files live at ``<directory>/<key[:2]>/<key><extension>`` and are written next to their
+    final path and renamed into place, so readers never see a partial file. Rows store paths
+    relative to ``directory``, which keeps them valid across machines that mount the store in
+    different places. Once the store exceeds ``max_bytes``, the least recently accessed files
+    are evicted; access times are bumped explicitly on reads because most mounts use relatime.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, orphan_grace_seconds: int):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.orphan_grace_seconds = orphan_grace_seconds
+        self._bytes = 0
+        self._scanned = False
+        self._bytes_lock = threading.Lock()
+        self._quota_lock = threading.Lock()
+
+    def path_for(self, key: str, extension: str = ".mp3") -> str:
+        return os.path.join(self.directory, key[:2], key + extension)
+
+    def stored_path(self, path: str) -> str:
+        """
+        Return the form of ``path`` kept in SpeechResult rows: relative to the store if inside it.
+        """
+        relative = os.path.relpath(path, self.directory)
+        return path if relative.startswith(os.pardir) else relative
+
+    def resolve(self, stored_path: str) -> str:
+        """
+        Return the absolute path of a path kept in a SpeechResult row.
+
+        Rows written before the store managed files hold absolute paths; they are returned as is.
+        """
+        return os.path.join(self.directory, stored_path)
+
+    def write_file(self, path: str, audio: bytes) -> None:
+        """
+        Atomically write ``audio`` at ``path``, a path returned by path_for, and enforce the
+        quota if needed.
+
+        This performs blocking file I/O and should be called off the event loop.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        staging_path = f"{path}.{os.getpid()}.{threading.get_ident()}{STAGING_SUFFIX}"
+        with open(staging_path, "wb") as staging_file:
+            staging_file.write(audio)
+        try:
+            # Another worker may already have written the same content.
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(staging_path, path)
+        with self._bytes_lock:
+            self._bytes += len(audio) - replaced
+            over_quota = not self._scanned or self._bytes > self.max_bytes
+        store_bytes.set(self._bytes)
+        if over_quota:
+            self.enforce_quota(blocking=False)
+
+    def touch(self, path: str) -> None:
+        """
+        Mark ``path`` as just accessed, for LRU eviction.
+        """
+        try:
+            stat = os.stat(path)
+            now = time.time()
+            if now - stat.st_atime > ATIME_RESOLUTION_SECONDS:
+                os.utime(path, (now, stat.st_mtime))
+        except FileNotFoundError:
+            pass
+
+    def scan(self) -> List[StoredFile]:
+        """
+        List every file in the store, staging files included.
+        """
+        files = []
+        try:
+            shards = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return files
+        for shard in shards:
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append(StoredFile(entry.path, stat.st_size, stat.st_atime))
+        return files
+
+    def _remove(self, paths: List[str], reason: str) -> int:
+        removed = 0
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+        store_evictions.inc(removed, reason=reason)
+        return removed
+
+    def enforce_quota(self, blocking: bool = True) -> int:
+        """
+        Evict the least recently accessed files until the store is below its low watermark.
+
+        Args:
+            blocking (bool): Wait for a quota pass already running elsewhere in this process
+                instead of skipping this one.
+
+        Returns:
+            int: The number of files evicted.
+        """
+        if not self._quota_lock.acquire(blocking=blocking):
+            return 0
+        started_at = time.perf_counter()
+        try:
+            files = self.scan()
+            total = sum(stored.size for stored in files)
+            evicted: List[str] = []
+            if total > self.max_bytes:
+                target = self.max_bytes * LOW_WATERMARK
+                for stored in sorted(files, key=lambda stored: stored.atime):
+                    if total <= target:
+                        break
+                    evicted.append(stored.path)
+                    total -= stored.size
+            with self._bytes_lock:
+                self._bytes = total
+                self._scanned = True
+            store_bytes.set(total)
+            store_files.set(len(files) - len(evicted))
+            return self._remove(evicted, "quota")
+        finally:
+            self._quota_lock.release()
+            store_sweep_time.observe(time.perf_counter() - started_at)
+
+    def sweep_orphans(self, referenced: Set[str]) -> int:
+        """
+        Remove files that no SpeechResult row references and that were not accessed recently.
+
+        Cached segments and transcodes have no row of their own; the grace period keeps them
+        for as long as they are in use. Staging files left behind by crashed writers go too.
+
+        Args:
+            referenced (Set[str]): Absolute paths referenced by SpeechResult rows.
+
+        Returns:
+            int: The number of files removed.
+        """
+        started_at = time.perf_counter()
+        cutoff = time.time() - self.orphan_grace_seconds
+        orphans = [
+            stored.path
+            for stored in self.scan()
+            if stored.atime < cutoff and stored.path not in referenced
+        ]
+        removed = self._remove(orphans, "orphan")
+        store_sweep_time.observe(time.perf_counter() - started_at)
+        return removed
+
+
+async def referenced_paths(store: AudioStore) -> Set[str]:
+    rows = await prisma.get_client().query_raw(REFERENCED_PATHS_SQL)
+    return {store.resolve(row["path"]) for row in rows}
+
+
+class AudioStoreSweeper:
+    """
+    Background task that enforces the store's quota and removes orphaned files.
+
+    Every ``interval_seconds`` it runs a quota pass, then reconciles the files on disk against
+    the paths referenced by SpeechResult rows and deletes the orphans in one pass.
+    """
+
+    def __init__(self, store: AudioStore, interval_seconds: float):
+        self.store = store
+        self.interval_seconds = interval_seconds
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    async def sweep(self) -> None:
+        await asyncio.to_thread(self.store.enforce_quota)
+        referenced = await referenced_paths(self.store)
+        await asyncio.to_thread(self.store.sweep_orphans, referenced)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Audio store sweep failed")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+audio_store = AudioStore(AUDIO_STORE_DIR, AUDIO_STORE_MAX_BYTES, AUDIO_STORE_ORPHAN_GRACE_SECONDS)
+
+audio_store_sweeper = AudioStoreSweeper(audio_store, AUDIO_STORE_SWEEP_INTERVAL_SECONDS)
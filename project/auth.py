@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+import jwt
+import project.metrics
+from fastapi import Depends, HTTPException, WebSocket
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "")
+
+if not JWT_SECRET_KEY:
+    logger.warning(
+        "JWT_SECRET_KEY is not set; using a random key, so tokens do not survive a restart "
+        "and are not accepted by other workers"
+    )
+    JWT_SECRET_KEY = secrets.token_urlsafe(32)
+
+JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+
+JWT_CLAIMS_CACHE_SIZE = int(os.getenv("JWT_CLAIMS_CACHE_SIZE", "4096"))
+
+token_verifications = project.metrics.counter(
+    "tts_auth_token_verifications",
+    "Bearer tokens checked, by whether the verified claims were cached.",
+    ["result"],
+)
+
+
+class AuthenticatedUser(BaseModel):
+    """
+    The caller of a request, as asserted by a verified access token.
+    """
+
+    id: str
+    email: str
+    role: str
+
+
+class InvalidCredentials(Exception):
+    """
+    Raised when a bearer token is missing, malformed, expired or wrongly signed.
+    """
+
+
+def create_access_token(user_id: str, email: str, role: str) -> str:
+    """
+    Issue a signed access token for a user, valid for ACCESS_TOKEN_EXPIRE_MINUTES.
+    """
+    now = datetime.now(timezone.utc)
+    claims = {
+        "sub": user_id,
+        "email": email,
+        "role": role,
+        "iat": now,
+        "exp": now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+    }
+    return jwt.encode(claims, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+
+def decode_token(token: str) -> Tuple[AuthenticatedUser, float]:
+    """
+    Verify a token's signature and expiry and return its user and expiry time.
+
+    Raises:
+        InvalidCredentials: If the token is not a valid, unexpired access token.
+    """
+    try:
+        claims = jwt.decode(
+            token,
+            JWT_SECRET_KEY,
+            algorithms=[JWT_ALGORITHM],
+            options={"require": ["exp", "sub"]},
+        )
+    except jwt.ExpiredSignatureError:
+        raise InvalidCredentials("The provided token has expired. Please login again.")
+    except jwt.InvalidTokenError:
+        raise InvalidCredentials("Invalid token. Please check the token and try again.")
+    user = AuthenticatedUser(
+        id=claims["sub"], email=claims.get("email", ""), role=claims.get("role", "USER")
+    )
+    return user, float(claims["exp"])
+
+
+class ClaimsCache:
+    """
+    LRU of verified tokens, keyed by the token's SHA-256 digest.
+
+    A hit skips signature verification; entries are never served past the token's ``exp``.
+    Only tokens that verified are cached, so a forged token is checked every time.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._entries: "OrderedDict[bytes, Tuple[float, AuthenticatedUser]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def verify(self, token: str) -> AuthenticatedUser:
+        """
+        Return the user a token was issued to, verifying it only when it is not cached.
+
+        Raises:
+            InvalidCredentials: If the token is not a valid, unexpired access token.
+        """
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        now = time.time()
+        with self._lock:
+            cached = self._entries.get(digest)
+            if cached is not None:
+                expires_at, user = cached
+                if expires_at > now:
+                    self._entries.move_to_end(digest)
+                    token_verifications.inc(result="cached")
+                    return user
+                del self._entries[digest]
+        token_verifications.inc(result="verified")
+        user, expires_at = decode_token(token)
+        with self._lock:
+            self._entries[digest] = (expires_at, user)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return user
+
+
+claims_cache = ClaimsCache(JWT_CLAIMS_CACHE_SIZE)
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+async def current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+) -> AuthenticatedUser:
+    """
+    FastAPI dependency resolving the caller from the ``Authorization: Bearer`` header.
+
+    Raises:
+        HTTPException: 401 if the header is missing or its token is invalid.
+    """
+    if credentials is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Not authenticated.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    try:
+        return claims_cache.verify(credentials.credentials)
+    except InvalidCredentials as e:
+        raise HTTPException(
+            status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"}
+        )
+
+
+def websocket_user(websocket: WebSocket) -> Optional[AuthenticatedUser]:
+    """
+    Resolve the caller of a WebSocket from its bearer header or ``token`` query parameter.
+
+    Browsers cannot set headers on a WebSocket handshake, hence the query parameter.
+
+    Returns:
+        Optional[AuthenticatedUser]: The caller, or None if no valid token was presented.
+    """
+    authorization = websocket.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer":
+        token = websocket.query_params.get("token", "")
+    if not token:
+        return None
+    try:
+        return claims_cache.verify(token)
+    except InvalidCredentials:
+        return None
@@ -1,11 +1,13 @@
-from datetime import datetime, timedelta
+import logging
 
-import jwt
 import prisma
 import prisma.models
-from passlib.context import CryptContext
+import project.auth
+import project.password_hashing
 from pydantic import BaseModel
 
+logger = logging.getLogger(__name__)
+
 
 class AuthenticateUserResponse(BaseModel):
     """
@@ -15,29 +17,6 @@ class AuthenticateUserResponse(BaseModel):
     token: str
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-SECRET_KEY = "YOUR_SECRET_KEY"
-
-ALGORITHM = "HS256"
-
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
-
-async def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """
-    Verify a plain password against its hashed version.
-
-    Args:
-        plain_password (str): The plaintext password entered by the user.
-        hashed_password (str): The hashed password stored in the database.
-
-    Returns:
-        bool: True if the password matches, False otherwise.
-    """
-    return pwd_context.verify(plain_password, hashed_password)
-
-
 async def get_user_by_email(email: str):
     """
     Retrieve a user from the database by their email address.
@@ -61,14 +40,25 @@ async def authenticate_user(email: str, password: str) -> AuthenticateUserRespon
 
     Returns:
         AuthenticateUserResponse: Response model for a successful user authentication, including the JWT token for session management.
+
+    Raises:
+        PasswordHashingSaturated: If the hashing pool cannot accept more work right now.
     """
     user = await get_user_by_email(email)
-    if not user or not await verify_password(password, user.password):
+    if not user:
         raise Exception("Invalid login credentials")
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    token = jwt.encode(
-        {"sub": user.email, "exp": datetime.utcnow() + access_token_expires},
-        SECRET_KEY,
-        algorithm=ALGORITHM,
+    valid, new_hash = await project.password_hashing.password_hasher.verify_and_update(
+        password, user.password
     )
+    if not valid:
+        raise Exception("Invalid login credentials")
+    if new_hash is not None:
+        # The stored hash uses an outdated cost; upgrading it must not fail the login.
+        try:
+            await prisma.models.User.prisma().update(
+                where={"id": user.id}, data={"password": new_hash}
+            )
+        except Exception:
+            logger.exception("Could not store the rehashed password of user %s", user.id)
+    token = project.auth.create_access_token(user.id, user.email, user.role)
     return AuthenticateUserResponse(token=token)
@@ -0,0 +1,334 @@
+"""
+Pre-warm the speech cache with the prompts most often converted recently.
+
+Run ``python -m project.cache_prewarm`` after a deploy or a cache flush to synthesize them into
+the shared audio store ahead of traffic, or set CACHE_PREWARM_ON_STARTUP to have a worker do it
+in the background when it starts. A database advisory lock makes sure only one pre-warm runs at
+a time; workers that start while another one holds it skip theirs.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import timedelta
+from typing import List, NamedTuple, Optional, Tuple
+
+import prisma
+import project.convert_text_to_speech_service
+import project.metrics
+import project.synthesis_pool
+import project.synthesis_scheduler
+import project.upstream_http
+import project.upstream_resilience
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREWARM_ON_STARTUP = os.getenv("CACHE_PREWARM_ON_STARTUP", "false").lower() == "true"
+
+CACHE_PREWARM_TOP_N = int(os.getenv("CACHE_PREWARM_TOP_N", "200"))
+
+CACHE_PREWARM_WINDOW_HOURS = float(os.getenv("CACHE_PREWARM_WINDOW_HOURS", "24"))
+
+# Prompts synthesized per second, so pre-warming never crowds out live conversions (0: no limit).
+CACHE_PREWARM_RATE = float(os.getenv("CACHE_PREWARM_RATE", "2"))
+
+CACHE_PREWARM_CONCURRENCY = int(os.getenv("CACHE_PREWARM_CONCURRENCY", "2"))
+
+CACHE_PREWARM_SATURATION_RETRIES = int(os.getenv("CACHE_PREWARM_SATURATION_RETRIES", "5"))
+
+# Longest a pre-warm may run; its advisory lock keeps a database transaction open until then.
+CACHE_PREWARM_MAX_SECONDS = float(os.getenv("CACHE_PREWARM_MAX_SECONDS", "3600"))
+
+# Taken for the length of the transaction, so it is released even if the worker dies.
+PREWARM_LOCK_SQL = """
+SELECT pg_try_advisory_xact_lock(hashtext('tts_cache_prewarm')) AS locked
+"""
+
+TOP_PROMPTS_SQL = """
+SELECT "inputText" AS text, "inputFormat"::text AS "inputFormat",
+       "outputFormat"::text AS "outputFormat", language, "voicePreference", speed, pitch,
+       COUNT(*)::int AS requests
+FROM speech_requests
+WHERE status = 'COMPLETED'::"ProcessStatus"
+  AND "createdAt" >= now() - make_interval(secs => $1)
+GROUP BY 1, 2, 3, 4, 5, 6, 7
+ORDER BY requests DESC
+LIMIT $2
+"""
+
+RECENT_REQUESTS_SQL = """
+SELECT COUNT(*)::int AS requests
+FROM speech_requests
+WHERE status = 'COMPLETED'::"ProcessStatus"
+  AND "createdAt" >= now() - make_interval(secs => $1)
+"""
+
+prewarm_prompts = project.metrics.gauge(
+    "tts_cache_prewarm_prompts",
+    "Prompts of the latest cache pre-warm, by state: planned, warmed or failed.",
+    ["state"],
+)
+
+prewarm_coverage = project.metrics.gauge(
+    "tts_cache_prewarm_coverage_ratio",
+    "Share of recent completed conversions whose prompt the latest pre-warm has warmed.",
+)
+
+
+class PrewarmPrompt(NamedTuple):
+    """
+    A distinct conversion, and how many times it was completed within the window.
+    """
+
+    text: str
+    input_format: str
+    output_format: str
+    language: str
+    voice_preference: str
+    speed: Optional[float]
+    pitch: Optional[float]
+    requests: int
+
+
+class PrewarmReport(NamedTuple):
+    """
+    Progress of a pre-warm, and how much of the window's traffic it covers.
+    """
+
+    planned: int
+    warmed: int
+    failed: int
+    recent_requests: int
+    covered_requests: int
+    elapsed_seconds: float
+
+    @property
+    def coverage(self) -> float:
+        return self.covered_requests / self.recent_requests if self.recent_requests else 0.0
+
+    def describe(self) -> str:
+        return (
+            f"{self.warmed}/{self.planned} prompts warmed, {self.failed} failed, covering "
+            f"{self.coverage:.1%} of {self.recent_requests} recent conversions "
+            f"in {self.elapsed_seconds:.1f}s"
+        )
+
+
+async def top_prompts(limit: int, window_seconds: float) -> Tuple[List[PrewarmPrompt], int]:
+    """
+    Find the conversions completed most often within the last ``window_seconds``.
+
+    Returns:
+        Tuple[List[PrewarmPrompt], int]: Up to ``limit`` prompts, most frequent first, and how
+        many conversions were completed within the window in total.
+    """
+    client = prisma.get_client()
+    rows = await client.query_raw(TOP_PROMPTS_SQL, window_seconds, limit)
+    total = await client.query_raw(RECENT_REQUESTS_SQL, window_seconds)
+    prompts = [
+        PrewarmPrompt(
+            text=row["text"],
+            input_format=row["inputFormat"],
+            output_format=row["outputFormat"],
+            language=row["language"],
+            voice_preference=row["voicePreference"],
+            speed=row["speed"],
+            pitch=row["pitch"],
+            requests=row["requests"],
+        )
+        for row in rows
+    ]
+    return prompts, total[0]["requests"] if total else 0
+
+
+class CachePrewarmer:
+    """
+    Synthesizes the most frequent recent prompts into the speech cache, under a rate limit.
+
+    Prompts are warmed most frequent first by ``concurrency`` workers that together start at
+    most ``rate`` syntheses per second, or as many as they can with a rate of 0. Results are
+    persisted to the audio store, so workers that did not warm them adopt them on their first
+    miss. A saturated synthesis pool or an open circuit breaker is waited out; prompts that
+    still fail are counted and skipped. Progress is logged and exported as metrics as it runs.
+    Only one pre-warm runs at a time across all workers, for at most ``max_seconds``.
+    """
+
+    def __init__(
+        self,
+        top_n: int,
+        window_seconds: float,
+        rate: float,
+        concurrency: int,
+        max_seconds: float = CACHE_PREWARM_MAX_SECONDS,
+    ):
+        self.top_n = top_n
+        self.window_seconds = window_seconds
+        self.rate = rate
+        self.concurrency = concurrency
+        self.max_seconds = max_seconds
+        self._task: Optional["asyncio.Task[Optional[PrewarmReport]]"] = None
+
+    async def _warm(
+        self,
+        prompt: PrewarmPrompt,
+        bucket: Optional[project.synthesis_scheduler.TokenBucket],
+    ) -> bool:
+        service = project.convert_text_to_speech_service
+        attempts = 0
+        while True:
+            wait = bucket.take() if bucket is not None else 0.0
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = bucket.take()
+            try:
+                entry = await service.synthesize_chunked(
+                    prompt.text,
+                    prompt.language,
+                    prompt.voice_preference,
+                    prompt.input_format,
+                    prompt.speed,
+                    prompt.pitch,
+                    prompt.output_format,
+                )
+                await service.persist_entry(entry)
+                return True
+            except (
+                project.synthesis_pool.SynthesisPoolSaturated,
+                project.upstream_resilience.UpstreamUnavailable,
+            ) as e:
+                attempts += 1
+                if attempts > CACHE_PREWARM_SATURATION_RETRIES:
+                    logger.warning("Giving up pre-warming a prompt: %s", e)
+                    return False
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                logger.warning("Pre-warming a prompt failed: %s", e)
+                return False
+
+    async def run(self) -> Optional[PrewarmReport]:
+        """
+        Warm the top prompts of the window once, unless another pre-warm is already running.
+
+        Returns:
+            Optional[PrewarmReport]: How many prompts were warmed and the share of traffic they
+            cover, or None if another worker holds the pre-warm lock.
+
+        Raises:
+            asyncio.TimeoutError: If the pre-warm did not finish within ``max_seconds``.
+        """
+        # The margin lets a timed-out pre-warm unwind before the transaction is rolled back.
+        timeout = timedelta(seconds=self.max_seconds + 30)
+        async with prisma.get_client().tx(timeout=timeout) as transaction:
+            rows = await transaction.query_raw(PREWARM_LOCK_SQL)
+            if not rows or not rows[0]["locked"]:
+                logger.info("Skipping the cache pre-warm: another worker is running one")
+                return None
+            return await asyncio.wait_for(self._prewarm(), self.max_seconds)
+
+    async def _prewarm(self) -> PrewarmReport:
+        started_at = time.perf_counter()
+        prompts, recent = await top_prompts(self.top_n, self.window_seconds)
+        pending = iter(prompts)
+        bucket = project.synthesis_scheduler.TokenBucket(self.rate, 1) if self.rate > 0 else None
+        warmed = failed = covered = 0
+        step = max(1, len(prompts) // 10)
+
+        def report() -> PrewarmReport:
+            return PrewarmReport(
+                len(prompts), warmed, failed, recent, covered, time.perf_counter() - started_at
+            )
+
+        prewarm_prompts.set(len(prompts), state="planned")
+        prewarm_prompts.set(0, state="warmed")
+        prewarm_prompts.set(0, state="failed")
+        prewarm_coverage.set(0)
+        logger.info(
+            "Pre-warming the speech cache with %d prompts from %d recent conversions",
+            len(prompts),
+            recent,
+        )
+
+        async def worker() -> None:
+            nonlocal warmed, failed, covered
+            for prompt in pending:
+                if await self._warm(prompt, bucket):
+                    warmed += 1
+                    covered += prompt.requests
+                    prewarm_prompts.set(warmed, state="warmed")
+                    prewarm_coverage.set(report().coverage)
+                else:
+                    failed += 1
+                    prewarm_prompts.set(failed, state="failed")
+                if (warmed + failed) % step == 0:
+                    logger.info("Cache pre-warm: %s", report().describe())
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        logger.info("Cache pre-warm finished: %s", report().describe())
+        return report()
+
+    async def _run_in_background(self) -> Optional[PrewarmReport]:
+        try:
+            return await self.run()
+        except Exception:
+            logger.exception("Cache pre-warm failed")
+            raise
+
+    def start(self) -> None:
+        """
+        Start warming in the background; the caller does not wait for it.
+        """
+        self._task = asyncio.ensure_future(self._run_in_background())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+cache_prewarmer = CachePrewarmer(
+    CACHE_PREWARM_TOP_N,
+    CACHE_PREWARM_WINDOW_HOURS * 3600,
+    CACHE_PREWARM_RATE,
+    CACHE_PREWARM_CONCURRENCY,
+)
+
+
+async def _main(args: argparse.Namespace) -> Optional[PrewarmReport]:
+    client = prisma.Prisma(auto_register=True)
+    await client.connect()
+    try:
+        prewarmer = CachePrewarmer(
+            args.top, args.window_hours * 3600, args.rate, args.concurrency
+        )
+        return await prewarmer.run()
+    finally:
+        project.synthesis_pool.synthesis_pool.shutdown()
+        project.upstream_http.upstream_session.close()
+        await client.disconnect()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--top", type=int, default=CACHE_PREWARM_TOP_N, help="prompts to warm")
+    parser.add_argument(
+        "--window-hours",
+        type=float,
+        default=CACHE_PREWARM_WINDOW_HOURS,
+        help="how far back to count conversions",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=CACHE_PREWARM_RATE, help="syntheses per second"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=CACHE_PREWARM_CONCURRENCY, help="parallel syntheses"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    report = asyncio.run(_main(args))
+    print(report.describe() if report is not None else "Another pre-warm is already running.")
+
+
+if __name__ == "__main__":
+    main()
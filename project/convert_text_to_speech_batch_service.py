@@ -0,0 +1,219 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import prisma
+import prisma.enums
+import prisma.models
+import project.convert_text_to_speech_service
+import project.speech_cache
+import project.stage_timing
+import project.synthesis_engines
+import project.synthesis_pool
+import project.synthesis_scheduler
+import project.upstream_resilience
+from pydantic import BaseModel
+
+SPEECH_BATCH_MAX_ITEMS = int(os.getenv("SPEECH_BATCH_MAX_ITEMS", "1000"))
+
+SPEECH_BATCH_CONCURRENCY = int(os.getenv("SPEECH_BATCH_CONCURRENCY", "8"))
+
+SPEECH_BATCH_SATURATION_RETRIES = int(os.getenv("SPEECH_BATCH_SATURATION_RETRIES", "5"))
+
+
+class BatchSpeechItem(BaseModel):
+    """
+    One text to convert as part of a batch.
+    """
+
+    text: str
+    language: str
+    voice_preference: str
+    input_format: str = "TEXT"
+    speed: Optional[float] = None
+    pitch: Optional[float] = None
+    engine: Optional[str] = None
+
+
+class BatchSpeechRequest(BaseModel):
+    """
+    A batch of texts converted on behalf of the authenticated user.
+    """
+
+    items: List[BatchSpeechItem]
+
+
+class BatchSpeechItemResult(BaseModel):
+    """
+    The outcome of one batch item, in the same position as the item in the request.
+    """
+
+    index: int
+    status: str
+    speech_request_id: Optional[str] = None
+    speech_file_path: Optional[str] = None
+    size: Optional[int] = None
+    duration: Optional[float] = None
+    error: Optional[str] = None
+
+
+class BatchSpeechResponse(BaseModel):
+    """
+    Per-item outcomes of a batch conversion, plus how many distinct texts had to be synthesized.
+    """
+
+    results: List[BatchSpeechItemResult]
+    unique_items: int
+
+
+async def _synthesize_item(
+    item: BatchSpeechItem, engine: str, user_id: str, limit: asyncio.Semaphore
+) -> project.speech_cache.CacheEntry:
+    attempts = 0
+    scheduler = project.synthesis_scheduler.synthesis_scheduler
+    async with limit:
+        while True:
+            try:
+                async with scheduler.admit(user_id, charge=False):
+                    entry = await project.convert_text_to_speech_service.synthesize_chunked(
+                        item.text,
+                        item.language,
+                        item.voice_preference,
+                        item.input_format,
+                        item.speed,
+                        item.pitch,
+                        engine=engine,
+                    )
+                await project.convert_text_to_speech_service.persist_entry(entry)
+                return entry
+            except (
+                project.synthesis_pool.SynthesisPoolSaturated,
+                project.synthesis_scheduler.SynthesisQueueFull,
+                project.upstream_resilience.UpstreamUnavailable,
+            ) as e:
+                attempts += 1
+                if attempts > SPEECH_BATCH_SATURATION_RETRIES:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+
+async def convert_text_to_speech_batch(
+    request: BatchSpeechRequest, user_id: str
+) -> BatchSpeechResponse:
+    """
+    Convert many texts to speech in one call
+
+    Identical items (by speech cache key) are synthesized once. Distinct items are synthesized
+    concurrently, at most SPEECH_BATCH_CONCURRENCY at a time, each admitted by the synthesis
+    scheduler under the user's plan. The batch counts once against the plan's rate limit, however
+    many items it has. Pool saturation, full plan queues and open circuit breakers are waited out
+    rather than failing. All SpeechRequest and SpeechResult rows are then
+    written with two create_many calls in a single transaction. Items that fail are recorded as
+    FAILED and reported individually without failing the batch.
+
+    Args:
+        request (BatchSpeechRequest): A batch of texts converted on behalf of the authenticated user.
+        user_id (str): Unique identifier for the user making the request.
+
+    Returns:
+        BatchSpeechResponse: Per-item outcomes of a batch conversion, plus how many distinct texts had to be synthesized.
+
+    Raises:
+        ValueError: If the batch is empty or larger than SPEECH_BATCH_MAX_ITEMS, or an item
+            names an engine that does not exist.
+        SynthesisRateLimited: If the user's plan allows no more conversions right now.
+    """
+    if not request.items or len(request.items) > SPEECH_BATCH_MAX_ITEMS:
+        raise ValueError(
+            f"A batch must contain between 1 and {SPEECH_BATCH_MAX_ITEMS} items."
+        )
+    positions: Dict[str, List[int]] = {}
+    engines: Dict[str, str] = {}
+    for index, item in enumerate(request.items):
+        engine = project.synthesis_engines.select_engine(item.engine)
+        key = project.speech_cache.cache_key(
+            item.text,
+            item.language,
+            item.voice_preference,
+            item.input_format,
+            "MP3",
+            item.speed,
+            item.pitch,
+            engine,
+        )
+        positions.setdefault(key, []).append(index)
+        engines[key] = engine
+    await project.synthesis_scheduler.synthesis_scheduler.charge(user_id)
+    limit = asyncio.Semaphore(SPEECH_BATCH_CONCURRENCY)
+    outcomes = await asyncio.gather(
+        *(
+            _synthesize_item(request.items[indices[0]], engines[key], user_id, limit)
+            for key, indices in positions.items()
+        ),
+        return_exceptions=True,
+    )
+    now = datetime.now(timezone.utc)
+    request_rows = []
+    result_rows = []
+    results: List[Optional[BatchSpeechItemResult]] = [None] * len(request.items)
+    for indices, outcome in zip(positions.values(), outcomes):
+        if isinstance(outcome, BaseException) and not isinstance(outcome, Exception):
+            raise outcome
+        for index in indices:
+            item = request.items[index]
+            failed = isinstance(outcome, Exception)
+            row = project.convert_text_to_speech_service.speech_request_data(
+                user_id,
+                item.text,
+                item.language,
+                item.voice_preference,
+                item.input_format,
+                item.speed,
+                item.pitch,
+                prisma.enums.ProcessStatus.FAILED
+                if failed
+                else prisma.enums.ProcessStatus.COMPLETED,
+            )
+            row["id"] = str(uuid.uuid4())
+            row["processedAt"] = now
+            if failed:
+                row["lastError"] = str(outcome)[:1000]
+                results[index] = BatchSpeechItemResult(
+                    index=index,
+                    status="FAILED",
+                    speech_request_id=row["id"],
+                    error=str(outcome),
+                )
+            else:
+                result_rows.append(
+                    {
+                        **project.convert_text_to_speech_service.speech_result_data(
+                            outcome
+                        ),
+                        "speechRequestId": row["id"],
+                    }
+                )
+                results[index] = BatchSpeechItemResult(
+                    index=index,
+                    status="COMPLETED",
+                    speech_request_id=row["id"],
+                    speech_file_path=outcome.path,
+                    size=outcome.size,
+                    duration=outcome.metadata.duration,
+                )
+            request_rows.append(row)
+    with project.stage_timing.span(project.stage_timing.DB):
+        async with prisma.get_client().tx() as transaction:
+            await prisma.models.SpeechRequest.prisma(transaction).create_many(
+                data=request_rows
+            )
+            if result_rows:
+                await prisma.models.SpeechResult.prisma(transaction).create_many(
+                    data=result_rows
+                )
+    return BatchSpeechResponse(
+        results=[result for result in results if result is not None],
+        unique_items=len(positions),
+    )
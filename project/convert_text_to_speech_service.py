@@ -1,13 +1,42 @@
+import asyncio
 import os
-import tempfile
-from typing import Optional
+import time
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
 
 import prisma
 import prisma.enums
 import prisma.models
-from gtts import gTTS
+import project.audio_dsp
+import project.audio_store
+import project.metrics
+import project.mp3
+import project.single_flight
+import project.speech_cache
+import project.ssml
+import project.stage_timing
+import project.synthesis_engines
+import project.synthesis_pool
+import project.synthesis_scheduler
+import project.text_chunking
 from pydantic import BaseModel
 
+SPEECH_CHUNK_MAX_CHARS = int(os.getenv("SPEECH_CHUNK_MAX_CHARS", "100"))
+
+SPEECH_CHUNK_FANOUT = int(os.getenv("SPEECH_CHUNK_FANOUT", "4"))
+
+time_to_first_byte = project.metrics.histogram(
+    "tts_speech_time_to_first_byte_seconds",
+    "Time from accepting a streamed conversion until its first audio bytes are ready.",
+    ["mode"],
+)
+
+total_time = project.metrics.histogram(
+    "tts_speech_total_seconds",
+    "Time from accepting a conversion until all of its audio is ready.",
+    ["mode"],
+)
+
 
 class SpeechSynthesisResponse(BaseModel):
     """
@@ -20,6 +49,366 @@ class SpeechSynthesisResponse(BaseModel):
     size: int
 
 
+async def entry_audio(entry: project.speech_cache.CacheEntry) -> bytes:
+    """
+    Return the audio of a cache entry, without leaving the event loop if it is in memory.
+    """
+    audio = entry.audio
+    if audio is not None:
+        return audio
+    with project.stage_timing.span(project.stage_timing.STORAGE):
+        return await asyncio.to_thread(project.speech_cache.speech_cache.read, entry)
+
+
+async def cache_audio(
+    key: str, audio: bytes, extension: str = ".mp3"
+) -> project.speech_cache.CacheEntry:
+    """
+    Put audio in the speech cache, off the event loop only when it is large enough to spill.
+    """
+    cache = project.speech_cache.speech_cache
+    if len(audio) > cache.spill_threshold:
+        with project.stage_timing.span(project.stage_timing.STORAGE):
+            return await asyncio.to_thread(cache.put, key, audio, extension)
+    return cache.put(key, audio, extension)
+
+
+async def persist_entry(entry: project.speech_cache.CacheEntry) -> None:
+    """
+    Write an in-memory entry to the audio store so a SpeechResult row can reference it.
+    """
+    if not entry.on_disk:
+        with project.stage_timing.span(project.stage_timing.STORAGE):
+            await asyncio.to_thread(project.speech_cache.speech_cache.persist, entry)
+
+
+async def discard_entry(entry: project.speech_cache.CacheEntry) -> None:
+    if entry.on_disk and not project.speech_cache.speech_cache.enabled:
+        await asyncio.to_thread(project.speech_cache.speech_cache.discard, entry)
+
+
+async def synthesize_segment(
+    text: str,
+    language: str,
+    voice_preference: str,
+    input_format: str,
+    speed: Optional[float] = None,
+    pitch: Optional[float] = None,
+    engine: Optional[str] = None,
+) -> project.speech_cache.CacheEntry:
+    """
+    Synthesize one piece of text through the speech cache.
+
+    Cache hits skip the engine entirely; identical concurrent misses share a single call.
+    Speed and pitch changes are applied to the synthesized audio by the DSP stage before it is
+    cached. Short results stay in memory; only those above the spill threshold are written, or
+    those another worker is waiting for.
+
+    Args:
+        text (str): The text content to be converted into speech.
+        language (str): The language and accent desired for the speech output.
+        voice_preference (str): The user's preferred voice setting for the speech.
+        input_format (str): The format of the input text, plain text or SSML.
+        speed (Optional[float]): The rate of speech to apply to the output.
+        pitch (Optional[float]): The pitch adjustment for the speech output.
+        engine (Optional[str]): The synthesis engine to use; chosen by select_engine if None.
+
+    Returns:
+        CacheEntry: The synthesized MP3, in memory or on disk, and how large it is.
+    """
+    engine = project.synthesis_engines.select_engine(engine)
+    cache_key = project.speech_cache.cache_key(
+        text, language, voice_preference, input_format, "MP3", speed, pitch, engine
+    )
+    cached = await project.speech_cache.speech_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    async def synthesize_and_cache() -> project.speech_cache.CacheEntry:
+        with project.stage_timing.span(project.stage_timing.SYNTHESIS):
+            audio = await project.synthesis_engines.synthesize(
+                engine, text, language, voice_preference
+            )
+        if project.audio_dsp.has_effects(speed, pitch):
+            with project.stage_timing.span(project.stage_timing.POST_PROCESSING):
+                audio = await project.synthesis_pool.synthesis_pool.run(
+                    project.audio_dsp.process, audio, speed, pitch, "MP3"
+                )
+        return await cache_audio(cache_key, audio)
+
+    return await project.single_flight.single_flight.do(
+        cache_key,
+        synthesize_and_cache,
+        lambda: project.speech_cache.speech_cache.get(cache_key),
+        persist_entry,
+    )
+
+
+def split_into_chunks(text: str, input_format: str) -> List[project.ssml.Segment]:
+    """
+    Split a document into the pieces that are synthesized or rendered independently.
+
+    Plain text is split into sentences. SSML is parsed into plain-text runs, each spoken with
+    the prosody around it, and pauses for its breaks, so no markup ever reaches the engine.
+
+    Raises:
+        ValueError: If the document is SSML but not valid, or has neither text nor breaks.
+    """
+    if input_format.upper() == "SSML":
+        segments = project.ssml.segment(text, SPEECH_CHUNK_MAX_CHARS)
+        if not segments:
+            raise ValueError("The SSML document has nothing to speak.")
+        return segments
+    chunks = project.text_chunking.split_sentences(text, SPEECH_CHUNK_MAX_CHARS)
+    if len(chunks) <= 1:
+        return [project.ssml.Speech(text)]
+    return [project.ssml.Speech(chunk) for chunk in chunks]
+
+
+def start_chunk_tasks(
+    chunks: List[project.ssml.Segment],
+    language: str,
+    voice_preference: str,
+    speed: Optional[float] = None,
+    pitch: Optional[float] = None,
+    engine: Optional[str] = None,
+) -> List["asyncio.Task[bytes]"]:
+    """
+    Start synthesizing every speech chunk, at most SPEECH_CHUNK_FANOUT at a time.
+
+    Speech chunks are synthesized as plain text with their prosody applied on top of ``speed``
+    and ``pitch``. Pauses cost no synthesis: they are silent frames in the format of the first
+    speech chunk, so they can be spliced between the synthesized ones.
+
+    Returns:
+        List[asyncio.Task[bytes]]: One task per chunk, in reading order, resolving to its MP3.
+    """
+    fanout = asyncio.Semaphore(SPEECH_CHUNK_FANOUT)
+
+    async def synthesize_chunk(chunk: project.ssml.Speech) -> bytes:
+        async with fanout:
+            entry = await synthesize_segment(
+                chunk.text, language, voice_preference, "TEXT", *chunk.effects(speed, pitch), engine
+            )
+        audio = await entry_audio(entry)
+        await discard_entry(entry)
+        return audio
+
+    async def render_pause(
+        pause: project.ssml.Pause, reference: Optional["asyncio.Task[bytes]"]
+    ) -> bytes:
+        audio = await reference if reference is not None else None
+        return project.mp3.silence(pause.seconds, audio)
+
+    tasks: List["asyncio.Task[bytes]"] = []
+    reference = None
+    for chunk in chunks:
+        if isinstance(chunk, project.ssml.Speech):
+            tasks.append(asyncio.ensure_future(synthesize_chunk(chunk)))
+            reference = reference or tasks[-1]
+    speech = iter(tasks)
+    return [
+        asyncio.ensure_future(render_pause(chunk, reference))
+        if isinstance(chunk, project.ssml.Pause)
+        else next(speech)
+        for chunk in chunks
+    ]
+
+
+async def transcode_to_wav(
+    entry: project.speech_cache.CacheEntry, wav_key: str
+) -> project.speech_cache.CacheEntry:
+    """
+    Decode a synthesized MP3 into a cached WAV file.
+
+    Args:
+        entry (CacheEntry): The MP3 to transcode.
+        wav_key (str): The cache key of the WAV output.
+
+    Returns:
+        CacheEntry: Where the WAV file lives and how large it is.
+    """
+    cache = project.speech_cache.speech_cache
+    cached = await cache.get(wav_key, ".wav")
+    if cached is not None:
+        return cached
+
+    async def transcode_and_cache() -> project.speech_cache.CacheEntry:
+        audio = await entry_audio(entry)
+        with project.stage_timing.span(project.stage_timing.POST_PROCESSING):
+            wav = await project.synthesis_pool.synthesis_pool.run(
+                project.audio_dsp.process, audio, None, None, "WAV"
+            )
+        return await cache_audio(wav_key, wav, ".wav")
+
+    wav_entry = await project.single_flight.single_flight.do(
+        wav_key, transcode_and_cache, lambda: cache.get(wav_key, ".wav"), persist_entry
+    )
+    await discard_entry(entry)
+    return wav_entry
+
+
+async def synthesize_chunked(
+    text: str,
+    language: str,
+    voice_preference: str,
+    input_format: str,
+    speed: Optional[float] = None,
+    pitch: Optional[float] = None,
+    output_format: str = "MP3",
+    engine: Optional[str] = None,
+) -> project.speech_cache.CacheEntry:
+    """
+    Synthesize a document sentence by sentence and join the audio frames.
+
+    Chunks are synthesized concurrently, at most SPEECH_CHUNK_FANOUT at a time, and each chunk
+    is cached on its own so an edited document only re-synthesizes the sentences that changed.
+    SSML is split into its text runs the same way, while its breaks are spliced in as silence
+    without calling the engine. The joined document is cached as well, and so is its WAV
+    transcoding when one is asked for.
+
+    Args:
+        text (str): The text content to be converted into speech.
+        language (str): The language and accent desired for the speech output.
+        voice_preference (str): The user's preferred voice setting for the speech.
+        input_format (str): The format of the input text, plain text or SSML.
+        speed (Optional[float]): The rate of speech to apply to the output.
+        pitch (Optional[float]): The pitch shift to apply to the output, in semitones.
+        output_format (str): The audio format of the output, MP3 or WAV.
+        engine (Optional[str]): The synthesis engine to use; chosen by select_engine if None.
+
+    Returns:
+        CacheEntry: Where the synthesized audio lives and how large it is.
+    """
+    engine = project.synthesis_engines.select_engine(engine)
+    if output_format.upper() == "WAV":
+        entry = await synthesize_chunked(
+            text, language, voice_preference, input_format, speed, pitch, "MP3", engine
+        )
+        wav_key = project.speech_cache.cache_key(
+            text, language, voice_preference, input_format, "WAV", speed, pitch, engine
+        )
+        return await transcode_to_wav(entry, wav_key)
+    chunks = split_into_chunks(text, input_format)
+    if len(chunks) == 1 and isinstance(chunks[0], project.ssml.Speech):
+        speech = chunks[0]
+        return await synthesize_segment(
+            speech.text, language, voice_preference, "TEXT", *speech.effects(speed, pitch), engine
+        )
+    document_key = project.speech_cache.cache_key(
+        text, language, voice_preference, input_format, "MP3", speed, pitch, engine
+    )
+    cached = await project.speech_cache.speech_cache.get(document_key)
+    if cached is not None:
+        return cached
+    tasks = start_chunk_tasks(chunks, language, voice_preference, speed, pitch, engine)
+    try:
+        segments = await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    with project.stage_timing.span(project.stage_timing.POST_PROCESSING):
+        audio = await asyncio.to_thread(project.mp3.concatenate, segments)
+    return await cache_audio(document_key, audio)
+
+
+def input_format_enum(input_format: str) -> prisma.enums.InputFormat:
+    if input_format.upper() == "SSML":
+        return prisma.enums.InputFormat.SSML
+    return prisma.enums.InputFormat.TEXT
+
+
+def output_format_enum(output_format: str) -> prisma.enums.OutputFormat:
+    """
+    Map a requested output format onto the schema enum.
+
+    Raises:
+        ValueError: If the format is neither MP3 nor WAV.
+    """
+    try:
+        return prisma.enums.OutputFormat[output_format.upper()]
+    except KeyError:
+        raise ValueError(f"Unsupported output format: {output_format}")
+
+
+def speech_request_data(
+    user_id: str,
+    text: str,
+    language: str,
+    voice_preference: str,
+    input_format: str,
+    speed: Optional[float],
+    pitch: Optional[float],
+    status: prisma.enums.ProcessStatus,
+    output_format: str = "MP3",
+) -> Dict[str, Any]:
+    """
+    Build the scalar columns of a SpeechRequest row.
+    """
+    return {
+        "userId": user_id,
+        "inputText": text,
+        "inputFormat": input_format_enum(input_format),
+        "outputFormat": output_format_enum(output_format),
+        "language": language,
+        "voicePreference": voice_preference,
+        "speed": speed,
+        "pitch": pitch,
+        "status": status,
+    }
+
+
+def speech_result_data(entry: project.speech_cache.CacheEntry) -> Dict[str, Any]:
+    """
+    Build the columns of a SpeechResult row, including the audio's probed metadata.
+    """
+    return {
+        "audioFilePath": project.audio_store.audio_store.stored_path(entry.path),
+        "audioFileSize": entry.size,
+        "durationSeconds": entry.metadata.duration,
+        "bitrate": entry.metadata.bitrate,
+        "frameCount": entry.metadata.frame_count,
+        "sampleRate": entry.metadata.sample_rate,
+    }
+
+
+async def record_speech_request(
+    user_id: str,
+    text: str,
+    language: str,
+    voice_preference: str,
+    input_format: str,
+    speed: Optional[float],
+    pitch: Optional[float],
+    entry: project.speech_cache.CacheEntry,
+    output_format: str = "MP3",
+) -> prisma.models.SpeechRequest:
+    """
+    Record a completed conversion and the audio it produced, persisting it if needed.
+    """
+    await persist_entry(entry)
+    data = speech_request_data(
+        user_id,
+        text,
+        language,
+        voice_preference,
+        input_format,
+        speed,
+        pitch,
+        prisma.enums.ProcessStatus.COMPLETED,
+        output_format,
+    )
+    with project.stage_timing.span(project.stage_timing.DB):
+        return await prisma.models.SpeechRequest.prisma().create(
+            data={
+                **data,
+                "processedAt": datetime.now(timezone.utc),
+                "user": {"connect": {"id": user_id}},
+                "speechResult": {"create": speech_result_data(entry)},
+            }
+        )
+
+
 async def convert_text_to_speech(
     user_id: str,
     text: str,
@@ -28,6 +417,8 @@ async def convert_text_to_speech(
     input_format: str,
     speed: Optional[float] = None,
     pitch: Optional[float] = None,
+    output_format: str = "MP3",
+    engine: Optional[str] = None,
 ) -> SpeechSynthesisResponse:
     """
     Convert provided text to speech and return audio file
@@ -38,36 +429,152 @@ async def convert_text_to_speech(
     language (str): The language and accent desired for the speech output.
     voice_preference (str): The user's preferred voice setting for the speech.
     input_format (str): The format of the input text, plain text or SSML.
-    speed (Optional[float]): The rate of speech to apply to the output.
-    pitch (Optional[float]): The pitch adjustment for the speech output.
+    speed (Optional[float]): The rate of speech to apply to the output, between 0.25 and 4.
+    pitch (Optional[float]): The pitch shift to apply to the output, in semitones between -12 and 12.
+    output_format (str): The audio format of the output, MP3 or WAV.
+    engine (Optional[str]): The synthesis engine to use, e.g. gtts, local or fake; the configured default if None.
 
     Returns:
     SpeechSynthesisResponse: Contains details about the synthesized speech including its accessible path and any metadata.
+
+    Raises:
+    ValueError: If speed, pitch, output_format or engine are not supported.
+    SynthesisPoolSaturated: If the synthesis pool cannot accept more work right now.
+    SynthesisRateLimited: If the user's plan allows no more conversions right now.
+    SynthesisQueueFull: If the user's plan already has too many conversions waiting.
     """
-    tts = gTTS(text=text, lang=language, slow=speed is not None and speed < 0.5)
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmpfile:
-        tts.save(tmpfile.name)
-        tmpfile_path = tmpfile.name
-    file_size = os.path.getsize(tmpfile_path)
-    duration = 0
-    speech_request = await prisma.models.SpeechRequest.prisma().create(
-        data={
-            "userId": user_id,
-            "inputText": text,
-            "inputFormat": prisma.enums.InputFormat.SSML
-            if input_format.upper() == "SSML"
-            else prisma.enums.InputFormat.TEXT,
-            "outputFormat": prisma.enums.OutputFormat.MP3,
-            "status": prisma.enums.ProcessStatus.COMPLETED,
-            "user": {"connect": {"id": user_id}},
-            "speechResult": {
-                "create": {"audioFilePath": tmpfile_path, "audioFileSize": file_size}
-            },
-        }
+    started_at = time.perf_counter()
+    project.audio_dsp.validate_effects(speed, pitch)
+    file_format = output_format_enum(output_format).value
+    engine = project.synthesis_engines.select_engine(engine)
+    async with project.synthesis_scheduler.synthesis_scheduler.admit(user_id):
+        entry = await synthesize_chunked(
+            text, language, voice_preference, input_format, speed, pitch, file_format, engine
+        )
+    audio_path, file_size = entry.path, entry.size
+    duration = entry.metadata.duration
+    await record_speech_request(
+        user_id,
+        text,
+        language,
+        voice_preference,
+        input_format,
+        speed,
+        pitch,
+        entry,
+        file_format,
     )
+    # A buffered response has no first byte before its last one; only total_time applies.
+    total_time.observe(time.perf_counter() - started_at, mode="buffered")
     return SpeechSynthesisResponse(
-        speech_file_path=tmpfile_path,
-        file_format="MP3",
+        speech_file_path=audio_path,
+        file_format=file_format,
         duration=duration,
         size=file_size,
     )
+
+
+async def _stream_segments(
+    tasks: List["asyncio.Task[bytes]"],
+    started_at: float,
+    finish: Callable[[List[bytes]], Awaitable[None]],
+) -> AsyncIterator[bytes]:
+    segments: List[bytes] = []
+    try:
+        for index, task in enumerate(tasks):
+            audio = await task
+            segments.append(audio)
+            frames = project.mp3.strip_to_frames(audio)
+            if index == 0:
+                time_to_first_byte.observe(time.perf_counter() - started_at, mode="stream")
+            yield frames
+        await finish(segments)
+        total_time.observe(time.perf_counter() - started_at, mode="stream")
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def stream_text_to_speech(
+    user_id: str,
+    text: str,
+    language: str,
+    voice_preference: str,
+    input_format: str,
+    speed: Optional[float] = None,
+    pitch: Optional[float] = None,
+    engine: Optional[str] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Convert provided text to speech and stream the MP3 frames as they become ready
+
+    All chunks are started up front, but frames are emitted strictly in reading order: the
+    first sentence is sent as soon as it is synthesized while later ones are still in flight.
+    This waits for the first chunk before returning, so admission errors surface before any
+    response has been started. The user's synthesis slot is held until every chunk is ready,
+    not until the client has read them.
+
+    Args:
+    user_id (str): Unique identifier for the user making the request.
+    text (str): The text content to be converted into speech.
+    language (str): The language and accent desired for the speech output.
+    voice_preference (str): The user's preferred voice setting for the speech.
+    input_format (str): The format of the input text, plain text or SSML.
+    speed (Optional[float]): The rate of speech to apply to the output.
+    pitch (Optional[float]): The pitch adjustment for the speech output.
+    engine (Optional[str]): The synthesis engine to use; the configured default if None.
+
+    Returns:
+    AsyncIterator[bytes]: MP3 frames, in order, forming a single playable stream.
+
+    Raises:
+    ValueError: If speed or pitch are out of range, or the engine does not exist.
+    SynthesisPoolSaturated: If the synthesis pool cannot accept more work right now.
+    SynthesisRateLimited: If the user's plan allows no more conversions right now.
+    SynthesisQueueFull: If the user's plan already has too many conversions waiting.
+    """
+    started_at = time.perf_counter()
+    project.audio_dsp.validate_effects(speed, pitch)
+    engine = project.synthesis_engines.select_engine(engine)
+    # Invalid input is rejected before admission, so it never holds a synthesis slot.
+    chunks = split_into_chunks(text, input_format)
+    scheduler = project.synthesis_scheduler.synthesis_scheduler
+    admission = await scheduler.acquire(user_id)
+    try:
+        document_key = project.speech_cache.cache_key(
+            text, language, voice_preference, input_format, "MP3", speed, pitch, engine
+        )
+        cached = (
+            await project.speech_cache.speech_cache.get(document_key) if len(chunks) > 1 else None
+        )
+        if cached is not None:
+            tasks = [asyncio.ensure_future(entry_audio(cached))]
+        else:
+            tasks = start_chunk_tasks(chunks, language, voice_preference, speed, pitch, engine)
+        synthesized = asyncio.gather(*tasks, return_exceptions=True)
+    except BaseException:
+        scheduler.release(admission)
+        raise
+    synthesized.add_done_callback(lambda _: scheduler.release(admission))
+
+    async def finish(segments: List[bytes]) -> None:
+        entry = cached
+        if entry is None and len(segments) > 1:
+            with project.stage_timing.span(project.stage_timing.POST_PROCESSING):
+                audio = await asyncio.to_thread(project.mp3.concatenate, segments)
+            entry = await cache_audio(document_key, audio)
+        if entry is None:
+            entry = await project.speech_cache.speech_cache.get(
+                document_key
+            ) or await cache_audio(document_key, segments[0])
+        await record_speech_request(
+            user_id, text, language, voice_preference, input_format, speed, pitch, entry
+        )
+
+    try:
+        await tasks[0]
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return _stream_segments(tasks, started_at, finish)
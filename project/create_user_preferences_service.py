@@ -1,5 +1,6 @@
 import prisma
 import prisma.models
+import project.user_preferences_cache
 from pydantic import BaseModel
 
 
@@ -37,6 +38,7 @@ async def create_user_preferences(
             "language": language,
         }
     )
+    await project.user_preferences_cache.user_preferences_cache.invalidate(userId)
     response = CreateUserPreferencesResponse(
         preferenceId=new_preference.id, message="User preference created successfully."
     )
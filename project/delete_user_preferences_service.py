@@ -1,5 +1,6 @@
 import prisma
 import prisma.models
+import project.user_preferences_cache
 from pydantic import BaseModel
 
 
@@ -26,6 +27,7 @@ async def delete_user_preferences(user_id: str) -> DeleteUserPreferencesResponse
         deleted_count = await prisma.models.UserPreference.prisma().delete_many(
             where={"userId": user_id}
         )
+        await project.user_preferences_cache.user_preferences_cache.invalidate(user_id)
         if deleted_count == 0:
             return DeleteUserPreferencesResponse(
                 status="error", message="No preferences found for user."
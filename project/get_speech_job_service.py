@@ -0,0 +1,87 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Optional
+
+import prisma
+import prisma.models
+import project.audio_store
+import project.speech_job_queue
+import project.stage_timing
+from pydantic import BaseModel
+
+MAX_WAIT_SECONDS = 30.0
+
+
+class SpeechJobStatusResponse(BaseModel):
+    """
+    The current state of an asynchronous conversion, including its audio once it has completed.
+    """
+
+    job_id: str
+    status: str
+    attempts: int
+    created_at: datetime
+    processed_at: Optional[datetime] = None
+    speech_file_path: Optional[str] = None
+    size: Optional[int] = None
+    duration: Optional[float] = None
+    error: Optional[str] = None
+
+
+async def _find_job(job_id: str) -> Optional[prisma.models.SpeechRequest]:
+    with project.stage_timing.span(project.stage_timing.DB):
+        return await prisma.models.SpeechRequest.prisma().find_unique(
+            where={"id": job_id}, include={"speechResult": True}
+        )
+
+
+async def get_speech_job(
+    job_id: str, user_id: str, wait: float = 0.0
+) -> SpeechJobStatusResponse:
+    """
+    Retrieve the status of an asynchronous conversion, optionally long-polling for completion
+
+    Args:
+        job_id (str): The id returned when the job was submitted.
+        user_id (str): The caller; jobs submitted by other users are reported as missing.
+        wait (float): Seconds to wait for the job to complete or fail before answering, capped at 30.
+
+    Returns:
+        SpeechJobStatusResponse: The current state of an asynchronous conversion, including its audio once it has completed.
+
+    Raises:
+        LookupError: If no job with this id exists for this user.
+    """
+    deadline = time.monotonic() + min(max(wait, 0.0), MAX_WAIT_SECONDS)
+    workers = project.speech_job_queue.speech_job_workers
+    while True:
+        event = workers.finished_event(job_id)
+        job = await _find_job(job_id)
+        if job is None or job.userId != user_id:
+            raise LookupError(f"No speech job with id {job_id}.")
+        remaining = deadline - time.monotonic()
+        if job.status in project.speech_job_queue.TERMINAL_STATUSES or remaining <= 0:
+            break
+        # Local workers wake us up directly; jobs finished by other processes are seen on the
+        # next poll.
+        try:
+            await asyncio.wait_for(
+                event.wait(), min(remaining, project.speech_job_queue.SPEECH_JOB_POLL_SECONDS)
+            )
+        except asyncio.TimeoutError:
+            pass
+    result = job.speechResult
+    return SpeechJobStatusResponse(
+        job_id=job.id,
+        status=job.status,
+        attempts=job.attempts,
+        created_at=job.createdAt,
+        processed_at=job.processedAt,
+        speech_file_path=(
+            project.audio_store.audio_store.resolve(result.audioFilePath) if result else None
+        ),
+        size=result.audioFileSize if result else None,
+        duration=result.durationSeconds if result else None,
+        error=job.lastError,
+    )
@@ -1,5 +1,4 @@
-import prisma
-import prisma.models
+import project.user_preferences_cache
 from pydantic import BaseModel
 
 
@@ -15,28 +14,28 @@ class UserPreferencesResponse(BaseModel):
     language: str
 
 
-async def get_user_preferences() -> UserPreferencesResponse:
+async def get_user_preferences(user_id: str) -> UserPreferencesResponse:
     """
     Retrieve user's saved preferences
 
     This function asynchronously fetches the user preferences from the 'user_preferences' database table,
-    assuming the existence of a mechanism to identify the current user, such as through session authentication.
+    through the read-through preference cache, for the user identified by the request's access token.
     It then constructs and returns a UserPreferencesResponse object containing these preferences.
 
+    Args:
+        user_id (str): The authenticated user whose preferences are retrieved.
+
     Returns:
         UserPreferencesResponse: This response model represents the structured
         information of user preferences including voice, speed, pitch, language,
         which are essential for providing a personalized text-to-speech experience.
 
     Example:
-        preferences = await get_user_preferences()
+        preferences = await get_user_preferences("1234")
         print(preferences)
         > UserPreferencesResponse(userId='1234', voice='en-US-Wavenet-F', speed=1.0, pitch=0.0, language='en-US')
     """
-    current_user_id = "example_user_id"
-    preferences = await prisma.models.UserPreference.prisma().find_unique(
-        where={"userId": current_user_id}
-    )
+    preferences = await project.user_preferences_cache.user_preferences_cache.get(user_id)
     if preferences:
         response = UserPreferencesResponse(
             userId=preferences.userId,
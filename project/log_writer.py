@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional, Union
+
+import prisma.enums
+import prisma.models
+import project.metrics
+
+logger = logging.getLogger(__name__)
+
+# Records at or above this level are written to the Log table; empty disables the writer.
+LOG_TABLE_LEVEL = os.getenv("LOG_TABLE_LEVEL", "WARNING")
+
+LOG_TABLE_MAX_QUEUE = int(os.getenv("LOG_TABLE_MAX_QUEUE", "10000"))
+
+LOG_TABLE_BATCH_SIZE = int(os.getenv("LOG_TABLE_BATCH_SIZE", "500"))
+
+LOG_TABLE_FLUSH_INTERVAL_SECONDS = float(os.getenv("LOG_TABLE_FLUSH_INTERVAL_SECONDS", "1"))
+
+# How long shutdown waits for queued records to be written before dropping them.
+LOG_TABLE_DRAIN_TIMEOUT_SECONDS = float(os.getenv("LOG_TABLE_DRAIN_TIMEOUT_SECONDS", "5"))
+
+LOG_TABLE_MAX_MESSAGE_CHARS = int(os.getenv("LOG_TABLE_MAX_MESSAGE_CHARS", "8000"))
+
+LOG_LEVELS = {
+    logging.DEBUG: prisma.enums.LogLevel.INFO,
+    logging.INFO: prisma.enums.LogLevel.INFO,
+    logging.WARNING: prisma.enums.LogLevel.WARNING,
+    logging.ERROR: prisma.enums.LogLevel.ERROR,
+    logging.CRITICAL: prisma.enums.LogLevel.ERROR,
+}
+
+records_written = project.metrics.counter(
+    "tts_log_records_written", "Log records written to the Log table."
+)
+
+records_dropped = project.metrics.counter(
+    "tts_log_records_dropped",
+    "Log records dropped instead of written, by reason.",
+    ["reason"],
+)
+
+log_queue_depth = project.metrics.gauge(
+    "tts_log_queue_depth", "Log records waiting to be written to the Log table."
+)
+
+flush_time = project.metrics.histogram(
+    "tts_log_flush_seconds", "Time taken by one create_many of queued log records."
+)
+
+
+def log_level(levelno: int) -> prisma.enums.LogLevel:
+    """
+    Map a logging level onto the schema's LogLevel, rounding custom levels down.
+    """
+    for threshold in sorted(LOG_LEVELS, reverse=True):
+        if levelno >= threshold:
+            return LOG_LEVELS[threshold]
+    return prisma.enums.LogLevel.INFO
+
+
+class LogTableHandler(logging.Handler):
+    """
+    Logging handler that writes records to the Log table in batches, off the request path.
+
+    ``emit`` only formats the record and appends it to a bounded in-memory queue, so logging
+    from a request, or from a pool thread, never waits on the database. A background task
+    writes the queue with ``create_many`` whenever ``batch_size`` records are waiting or every
+    ``flush_interval_seconds``, whichever comes first. When the queue is full, new records are
+    dropped and counted rather than blocking the caller; so are batches the database rejects,
+    which are not retried. Records logged by this module are never queued, so that a failing
+    database cannot feed its own errors back into the queue.
+    """
+
+    def __init__(
+        self,
+        level: Union[int, str],
+        max_queue: int,
+        batch_size: int,
+        flush_interval_seconds: float,
+        max_message_chars: int,
+    ):
+        super().__init__(level)
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_message_chars = max_message_chars
+        self.setFormatter(logging.Formatter("%(name)s: %(message)s"))
+        self._queue: Deque[Dict[str, object]] = deque()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._closing = False
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.name == __name__ or self._loop is None:
+            return
+        if len(self._queue) >= self.max_queue:
+            records_dropped.inc(reason="queue_full")
+            return
+        try:
+            message = self.format(record)[: self.max_message_chars]
+        except Exception:
+            self.handleError(record)
+            return
+        self._queue.append(
+            {
+                "loggedAt": datetime.fromtimestamp(record.created, timezone.utc),
+                "level": log_level(record.levelno),
+                "message": message,
+            }
+        )
+        log_queue_depth.inc()
+        if len(self._queue) == self.batch_size:
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:
+                # The loop is closed; the records go with it.
+                pass
+
+    def _take_batch(self) -> List[Dict[str, object]]:
+        batch = []
+        while self._queue and len(batch) < self.batch_size:
+            batch.append(self._queue.popleft())
+        log_queue_depth.dec(len(batch))
+        return batch
+
+    async def flush_queued(self) -> None:
+        """
+        Write every queued record, one batch at a time.
+        """
+        while self._queue:
+            batch = self._take_batch()
+            started_at = time.perf_counter()
+            try:
+                await prisma.models.Log.prisma().create_many(data=batch)
+            except asyncio.CancelledError:
+                records_dropped.inc(len(batch), reason="shutdown")
+                raise
+            except Exception:
+                records_dropped.inc(len(batch), reason="write_failed")
+                logger.exception("Writing %d log records failed", len(batch))
+                return
+            finally:
+                flush_time.observe(time.perf_counter() - started_at)
+            records_written.inc(len(batch))
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush_queued()
+
+    def start(self) -> None:
+        """
+        Start the writer and attach the handler to the root logger.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._closing = False
+        self._task = asyncio.ensure_future(self._run())
+        logging.getLogger().addHandler(self)
+
+    async def stop(self, drain_timeout_seconds: float) -> None:
+        """
+        Detach the handler and write what is still queued within ``drain_timeout_seconds``.
+
+        Records that could not be written in time are dropped and counted.
+        """
+        logging.getLogger().removeHandler(self)
+        self._loop = None
+        if self._task is None:
+            return
+        self._closing = True
+        self._wake.set()
+        try:
+            await asyncio.wait_for(self._task, drain_timeout_seconds)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %d log records not written at shutdown", len(self._queue))
+        self._task = None
+        if self._queue:
+            records_dropped.inc(len(self._queue), reason="shutdown")
+            log_queue_depth.dec(len(self._queue))
+            self._queue.clear()
+
+
+log_table_handler = (
+    LogTableHandler(
+        LOG_TABLE_LEVEL.upper(),
+        LOG_TABLE_MAX_QUEUE,
+        LOG_TABLE_BATCH_SIZE,
+        LOG_TABLE_FLUSH_INTERVAL_SECONDS,
+        LOG_TABLE_MAX_MESSAGE_CHARS,
+    )
+    if LOG_TABLE_LEVEL
+    else None
+)
@@ -0,0 +1,430 @@
+import functools
+import mmap
+import os
+from typing import Iterable, Iterator, NamedTuple, Optional, Tuple
+
+_BITRATES_KBPS = {
+    # (MPEG-1, layer) and (MPEG-2/2.5, layer), indexed by the 4-bit bitrate index.
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+_SAMPLE_RATES = {
+    1.0: (44100, 48000, 32000),
+    2.0: (22050, 24000, 16000),
+    2.5: (11025, 12000, 8000),
+}
+
+_VERSIONS = {0: 2.5, 2: 2.0, 3: 1.0}
+
+_LAYERS = {1: 3, 2: 2, 3: 1}
+
+
+class FrameHeader(NamedTuple):
+    """
+    The decoded 4-byte header of an MPEG audio frame.
+    """
+
+    version: float
+    layer: int
+    protected: bool
+    bitrate: int
+    sample_rate: int
+    padding: int
+    channel_mode: int
+    frame_length: int
+    samples: int
+
+    @property
+    def channels(self) -> int:
+        return 1 if self.channel_mode == 3 else 2
+
+    @property
+    def side_info_size(self) -> int:
+        if self.layer != 3:
+            return 0
+        if self.version == 1.0:
+            return 17 if self.channel_mode == 3 else 32
+        return 9 if self.channel_mode == 3 else 17
+
+
+def parse_frame_header(data: bytes, offset: int = 0) -> Optional[FrameHeader]:
+    """
+    Decode the MPEG audio frame header starting at ``offset``.
+
+    Args:
+        data (bytes): The buffer holding the MP3 stream.
+        offset (int): Position of the candidate frame sync.
+
+    Returns:
+        Optional[FrameHeader]: The decoded header, or None if the bytes are not a valid header.
+    """
+    if offset + 4 > len(data):
+        return None
+    b0, b1, b2, b3 = data[offset], data[offset + 1], data[offset + 2], data[offset + 3]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = _VERSIONS.get((b1 >> 3) & 0x03)
+    layer = _LAYERS.get((b1 >> 1) & 0x03)
+    bitrate_index = (b2 >> 4) & 0x0F
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    family = 1 if version == 1.0 else 2
+    bitrate = _BITRATES_KBPS[(family, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+    if layer == 1:
+        samples = 384
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 3 and version != 1.0:
+        samples = 576
+        frame_length = 72 * bitrate // sample_rate + padding
+    else:
+        samples = 1152
+        frame_length = 144 * bitrate // sample_rate + padding
+    return FrameHeader(
+        version=version,
+        layer=layer,
+        protected=not (b1 & 0x01),
+        bitrate=bitrate,
+        sample_rate=sample_rate,
+        padding=padding,
+        channel_mode=(b3 >> 6) & 0x03,
+        frame_length=frame_length,
+        samples=samples,
+    )
+
+
+def id3v2_size(data: bytes) -> int:
+    """
+    Return the total size of a leading ID3v2 tag, or 0 if the stream does not start with one.
+    """
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _audio_end(data: bytes) -> int:
+    end = len(data)
+    if end >= 128 and data[end - 128 : end - 125] == b"TAG":
+        end -= 128
+    return end
+
+
+def _find_sync(data: bytes, start: int, end: int) -> int:
+    position = start
+    while position < end - 3:
+        position = data.find(b"\xff", position, end - 3)
+        if position < 0:
+            return -1
+        header = parse_frame_header(data, position)
+        if header is not None and header.frame_length > 4:
+            following = position + header.frame_length
+            if following >= end or parse_frame_header(data, following) is not None:
+                return position
+        position += 1
+    return -1
+
+
+def iter_frames(data: bytes) -> Iterator[Tuple[int, FrameHeader]]:
+    """
+    Walk the audio frames of an MP3 stream without decoding them.
+
+    Leading ID3v2 and trailing ID3v1 tags are skipped, and the walker resynchronises on the
+    next valid frame if it meets garbage between frames.
+
+    Args:
+        data (bytes): The MP3 stream.
+
+    Yields:
+        Tuple[int, FrameHeader]: The offset and header of each frame.
+    """
+    end = _audio_end(data)
+    position = _find_sync(data, id3v2_size(data), end)
+    while 0 <= position < end:
+        header = parse_frame_header(data, position)
+        if header is None or header.frame_length <= 4:
+            position = _find_sync(data, position + 1, end)
+            continue
+        if position + header.frame_length > end:
+            return
+        yield position, header
+        position += header.frame_length
+
+
+def info_tag_offset(data: bytes, offset: int, header: FrameHeader) -> Optional[int]:
+    """
+    Locate a Xing/Info or VBRI tag inside the frame at ``offset``.
+
+    Encoders put these tags in an otherwise silent first frame to describe the whole file.
+
+    Returns:
+        Optional[int]: The offset of the tag identifier, or None if the frame carries no tag.
+    """
+    xing = offset + 4 + (2 if header.protected else 0) + header.side_info_size
+    if data[xing : xing + 4] in (b"Xing", b"Info"):
+        return xing
+    vbri = offset + 36
+    if data[vbri : vbri + 4] == b"VBRI":
+        return vbri
+    return None
+
+
+def strip_to_frames(data: bytes) -> bytes:
+    """
+    Return only the audio frames of an MP3 stream.
+
+    Tags and any Xing/Info/VBRI header frame are dropped, since they describe a single file
+    and would be wrong (or audible as a glitch) in the middle of a concatenated stream.
+
+    Args:
+        data (bytes): The MP3 stream.
+
+    Returns:
+        bytes: The contiguous audio frames.
+    """
+    view = memoryview(data)
+    pieces = []
+    run_start = run_stop = -1
+    for index, (offset, header) in enumerate(iter_frames(data)):
+        if index == 0 and info_tag_offset(data, offset, header) is not None:
+            continue
+        if offset == run_stop:
+            run_stop += header.frame_length
+            continue
+        if run_start >= 0:
+            pieces.append(view[run_start:run_stop])
+        run_start, run_stop = offset, offset + header.frame_length
+    if run_start >= 0:
+        if run_start == 0 and run_stop == len(data) and not pieces:
+            return data
+        pieces.append(view[run_start:run_stop])
+    return b"".join(pieces)
+
+
+def concatenate(segments: Iterable[bytes]) -> bytes:
+    """
+    Join MP3 segments frame by frame, without re-encoding.
+
+    Args:
+        segments (Iterable[bytes]): MP3 streams sharing the same sample rate and channel layout.
+
+    Returns:
+        bytes: A single MP3 stream made of every segment's audio frames, in order.
+    """
+    return b"".join(strip_to_frames(segment) for segment in segments)
+
+
+# MPEG-2 layer III, 32 kbit/s, 24 kHz, mono: the format gTTS produces.
+DEFAULT_SILENCE_HEADER = bytes([0xFF, 0xF3, 0x44, 0xC4])
+
+
+@functools.lru_cache(maxsize=64)
+def silent_frame(header: bytes) -> bytes:
+    """
+    Build one silent frame in the format of a frame header.
+
+    The frame is unpadded and unprotected, and its zeroed side info, with no main data,
+    decodes as silence.
+
+    Raises:
+        ValueError: If ``header`` is not a valid frame header.
+    """
+    header = bytes([header[0], header[1] | 0x01, header[2] & 0xFD, header[3]])
+    parsed = parse_frame_header(header)
+    if parsed is None:
+        raise ValueError("Not an MPEG audio frame header.")
+    return header + bytes(parsed.frame_length - 4)
+
+
+def silence(seconds: float, reference: Optional[bytes] = None) -> bytes:
+    """
+    Return about ``seconds`` of silent frames that can be concatenated with ``reference``.
+
+    The frames copy the version, sample rate, bitrate and channel mode of the first frame of
+    ``reference``, or of DEFAULT_SILENCE_HEADER without one, and are built once per format.
+
+    Args:
+        seconds (float): How long the silence lasts, rounded to whole frames; at least one.
+        reference (Optional[bytes]): MP3 audio the silence will be spliced into.
+
+    Returns:
+        bytes: The silent frames.
+    """
+    header = DEFAULT_SILENCE_HEADER
+    for offset, _ in iter_frames(reference or b""):
+        header = bytes(reference[offset : offset + 4])
+        break
+    frame = silent_frame(header)
+    parsed = parse_frame_header(frame)
+    return frame * max(1, round(seconds * parsed.sample_rate / parsed.samples))
+
+
+class AudioMetadata(NamedTuple):
+    """
+    Duration and format of an MP3 stream, derived from its frame headers.
+    """
+
+    duration: float
+    bitrate: int
+    frame_count: int
+    sample_rate: int
+    channels: int
+
+
+EMPTY_METADATA = AudioMetadata(duration=0.0, bitrate=0, frame_count=0, sample_rate=0, channels=0)
+
+_XING_FRAMES_FLAG = 0x01
+
+_XING_BYTES_FLAG = 0x02
+
+_XING_TOC_FLAG = 0x04
+
+_XING_QUALITY_FLAG = 0x08
+
+
+def _read_info_tag(data: bytes, tag: int) -> Tuple[Optional[int], int]:
+    """
+    Read the frame count and the LAME encoder delay + padding (in samples) from an info tag.
+    """
+    if data[tag : tag + 4] == b"VBRI":
+        return int.from_bytes(data[tag + 14 : tag + 18], "big"), 0
+    flags = int.from_bytes(data[tag + 4 : tag + 8], "big")
+    position = tag + 8
+    frames = None
+    if flags & _XING_FRAMES_FLAG:
+        frames = int.from_bytes(data[position : position + 4], "big")
+        position += 4
+    if flags & _XING_BYTES_FLAG:
+        position += 4
+    if flags & _XING_TOC_FLAG:
+        position += 100
+    if flags & _XING_QUALITY_FLAG:
+        position += 4
+    gap = 0
+    if data[position : position + 4] == b"LAME":
+        delay_padding = int.from_bytes(data[position + 21 : position + 24], "big")
+        gap = (delay_padding >> 12) + (delay_padding & 0xFFF)
+    return frames, gap
+
+
+def _count_constant_frames(data: bytes, start: int, end: int, header: FrameHeader) -> Optional[int]:
+    """
+    Count frames with strided slices when every frame repeats the first header byte for byte.
+
+    Returns:
+        Optional[int]: The frame count, or None if the stream is not strictly constant-length.
+    """
+    length = header.frame_length
+    count = (end - start) // length
+    if count == 0:
+        return None
+    stop = start + count * length
+    for index in range(4):
+        column = data[start + index : stop : length]
+        if column.count(data[start + index]) != count:
+            return None
+    return count
+
+
+def _count_padded_frames(data: bytes, start: int, end: int, header: FrameHeader) -> Optional[int]:
+    """
+    Count frames of a constant-bitrate stream whose frames differ only in the padding bit.
+
+    Returns:
+        Optional[int]: The frame count, or None if any frame header differs in another way.
+    """
+    b0, b1, b2, b3 = data[start], data[start + 1], data[start + 2] & 0xFD, data[start + 3]
+    base = header.frame_length - header.padding
+    position, count = start, 0
+    while position + 4 <= end:
+        padding = data[position + 2] & 0x02
+        if (
+            data[position] != b0
+            or data[position + 1] != b1
+            or data[position + 2] & 0xFD != b2
+            or data[position + 3] != b3
+        ):
+            return None
+        length = base + (padding >> 1)
+        if position + length > end:
+            break
+        position += length
+        count += 1
+    return count
+
+
+def probe(data: bytes) -> AudioMetadata:
+    """
+    Compute the exact duration, average bitrate and frame count of an MP3 without decoding it.
+
+    A Xing/Info or VBRI tag supplies the frame count directly (and LAME gapless delay/padding
+    when present). Otherwise constant-bitrate streams are validated with strided slices, which
+    run at C speed; padded constant-bitrate streams use a header-compare loop, and only
+    variable-bitrate streams fall back to fully parsing every frame header.
+
+    Args:
+        data (bytes): The MP3 stream, e.g. a bytes object or a read-only mmap.
+
+    Returns:
+        AudioMetadata: Duration and format of the stream, or EMPTY_METADATA if it has no frames.
+    """
+    end = _audio_end(data)
+    start = _find_sync(data, id3v2_size(data), end)
+    if start < 0:
+        return EMPTY_METADATA
+    first = parse_frame_header(data, start)
+    if first is None:
+        return EMPTY_METADATA
+    frame_count: Optional[int] = None
+    gap = 0
+    audio_start = start
+    tag = info_tag_offset(data, start, first)
+    if tag is not None:
+        frame_count, gap = _read_info_tag(data, tag)
+        audio_start = start + first.frame_length
+    if frame_count is None and audio_start < end:
+        header = parse_frame_header(data, audio_start)
+        if header is not None:
+            frame_count = _count_constant_frames(data, audio_start, end, header)
+            if frame_count is None:
+                frame_count = _count_padded_frames(data, audio_start, end, header)
+    if frame_count is None:
+        frame_count = sum(1 for offset, _ in iter_frames(data) if offset >= audio_start)
+    samples = max(frame_count * first.samples - gap, 0)
+    duration = samples / first.sample_rate
+    audio_bytes = end - audio_start
+    bitrate = int(round(audio_bytes * 8 / duration)) if duration > 0 else first.bitrate
+    return AudioMetadata(
+        duration=duration,
+        bitrate=bitrate,
+        frame_count=frame_count,
+        sample_rate=first.sample_rate,
+        channels=first.channels,
+    )
+
+
+def probe_file(path: str) -> AudioMetadata:
+    """
+    Probe an MP3 file through a read-only memory map, touching only the pages it needs.
+
+    Args:
+        path (str): The MP3 file.
+
+    Returns:
+        AudioMetadata: Duration and format of the file.
+    """
+    with open(path, "rb") as audio_file:
+        if os.fstat(audio_file.fileno()).st_size == 0:
+            return EMPTY_METADATA
+        with mmap.mmap(audio_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return probe(mapped)
@@ -0,0 +1,142 @@
+import asyncio
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+import project.metrics
+from passlib.context import CryptContext
+
+# Changing this rehashes each user's password at their next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+PASSWORD_HASH_MAX_WORKERS = int(os.getenv("PASSWORD_HASH_MAX_WORKERS", "2"))
+
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0, 5.0)
+
+hash_run_time = project.metrics.histogram(
+    "tts_password_hash_seconds",
+    "Time a bcrypt operation spent running on a hashing worker.",
+    ["operation"],
+    buckets=HASH_BUCKETS,
+)
+
+hash_queue_wait = project.metrics.histogram(
+    "tts_password_hash_queue_wait_seconds",
+    "Time a bcrypt operation waited for a free hashing worker.",
+    buckets=HASH_BUCKETS,
+)
+
+hash_queued = project.metrics.gauge(
+    "tts_password_hash_queued", "Bcrypt operations waiting for a free hashing worker."
+)
+
+hash_rejected = project.metrics.counter(
+    "tts_password_hash_rejected", "Bcrypt operations rejected because the wait queue was full."
+)
+
+rehashes = project.metrics.counter(
+    "tts_password_rehashes", "Password hashes upgraded to the configured cost at login."
+)
+
+# Hashes of any other cost need an update, so that logins move them to BCRYPT_ROUNDS.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+class PasswordHashingSaturated(Exception):
+    """
+    Raised when every hashing worker is busy and the wait queue is full.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many logins in progress, retry in {retry_after} seconds.")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a small dedicated thread pool, so logins never block the event loop.
+
+    bcrypt releases the GIL while hashing, so threads give real parallelism. The pool is kept
+    apart from the synthesis pool so a login burst cannot starve synthesis or the other way
+    round: at most ``max_workers`` operations run at once, at most ``max_queue`` wait, and
+    anything beyond that is rejected with PasswordHashingSaturated.
+    """
+
+    def __init__(self, context: CryptContext, max_workers: int, max_queue: int):
+        self.context = context
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="password-hash"
+        )
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._queued = 0
+        self._avg_run_time = 0.0
+
+    async def _run(self, operation: str, fn: Callable[..., Any], *args: Any) -> Any:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        if self._slots.locked() and self._queued >= self.max_queue:
+            hash_rejected.inc()
+            backlog = self._queued + self.max_workers
+            raise PasswordHashingSaturated(
+                max(1, math.ceil(backlog * self._avg_run_time / self.max_workers))
+            )
+        self._queued += 1
+        hash_queued.set(self._queued)
+        enqueued_at = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self._queued -= 1
+            hash_queued.set(self._queued)
+        started_at = time.perf_counter()
+        hash_queue_wait.observe(started_at - enqueued_at)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            run_time = time.perf_counter() - started_at
+            hash_run_time.observe(run_time, operation=operation)
+            self._avg_run_time = 0.8 * self._avg_run_time + 0.2 * run_time
+            self._slots.release()
+
+    async def verify_and_update(
+        self, plain_password: str, hashed_password: str
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Verify a password and, if its hash uses an outdated cost, hash it again.
+
+        Args:
+            plain_password (str): The plaintext password entered by the user.
+            hashed_password (str): The hashed password stored in the database.
+
+        Returns:
+            Tuple[bool, Optional[str]]: Whether the password matches, and the replacement hash
+            to store when the stored one should be upgraded.
+
+        Raises:
+            PasswordHashingSaturated: If the hashing pool cannot accept more work right now.
+        """
+        valid, new_hash = await self._run(
+            "verify", self.context.verify_and_update, plain_password, hashed_password
+        )
+        if new_hash is not None:
+            rehashes.inc()
+        return valid, new_hash
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+password_hasher = PasswordHasher(pwd_context, PASSWORD_HASH_MAX_WORKERS, PASSWORD_HASH_MAX_QUEUE)
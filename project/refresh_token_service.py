@@ -1,7 +1,4 @@
-import os
-from datetime import datetime, timedelta
-
-import jwt
+import project.auth
 from pydantic import BaseModel
 
 
@@ -13,17 +10,12 @@ class RefreshTokenResponse(BaseModel):
     new_token: str
 
 
-SECRET_KEY = os.getenv("JWT_SECRET_KEY")
-
-ALGORITHM = os.getenv("JWT_ALGORITHM")
-
-
 async def refresh_token(existing_token: str) -> RefreshTokenResponse:
     """
     Refresh user's JWT token
 
-    Validates the provided JWT token and issues a new JWT token. This function assumes the presence of
-    a JWT_SECRET_KEY and JWT_ALGORITHM in the environment variables for signing the token.
+    Validates the provided JWT token and issues a new JWT token for the same user, signed with the
+    shared JWT_SECRET_KEY and JWT_ALGORITHM settings of project.auth.
 
     Args:
         existing_token (str): The current valid JWT token provided by the user for validation.
@@ -33,17 +25,8 @@ async def refresh_token(existing_token: str) -> RefreshTokenResponse:
         refreshing the user's authentication token. A new JWT token is provided.
 
     Raises:
-        jwt.ExpiredSignatureError: If the existing token is expired.
-        jwt.InvalidTokenError: If the existing token is invalid for any other reason.
+        InvalidCredentials: If the existing token is expired or invalid for any other reason.
     """
-    try:
-        payload = jwt.decode(existing_token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        exp = datetime.utcnow() + timedelta(days=1)
-        new_payload = {"sub": user_id, "exp": exp}
-        new_token = jwt.encode(new_payload, SECRET_KEY, algorithm=ALGORITHM)
-        return RefreshTokenResponse(new_token=new_token)
-    except jwt.ExpiredSignatureError:
-        raise Exception("The provided token has expired. Please login again.")
-    except jwt.InvalidTokenError:
-        raise Exception("Invalid token. Please check the token and try again.")
+    user, _ = project.auth.decode_token(existing_token)
+    new_token = project.auth.create_access_token(user.id, user.email, user.role)
+    return RefreshTokenResponse(new_token=new_token)
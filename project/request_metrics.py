@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, MutableMapping
+
+import project.metrics
+import project.request_profiling
+import project.stage_timing
+
+logger = logging.getLogger(__name__)
+
+# Requests slower than this are logged with their per-stage breakdown.
+REQUEST_SLOW_LOG_SECONDS = float(os.getenv("REQUEST_SLOW_LOG_SECONDS", "2"))
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+ASGIApp = Callable[..., Awaitable[None]]
+
+request_time = project.metrics.histogram(
+    "tts_http_request_seconds",
+    "Time from receiving a request until its response was fully sent.",
+    ["method", "route"],
+)
+
+requests_handled = project.metrics.counter(
+    "tts_http_requests",
+    "HTTP requests handled, by route and response status.",
+    ["method", "route", "status"],
+)
+
+requests_in_progress = project.metrics.gauge(
+    "tts_http_requests_in_progress", "HTTP requests currently being handled."
+)
+
+
+def route_label(scope: Scope) -> str:
+    """
+    Label a request by its route template, so path parameters do not multiply series.
+    """
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path", "unmatched")
+    endpoint = scope.get("endpoint")
+    return getattr(endpoint, "__name__", "unmatched")
+
+
+def stage_breakdown(totals: Dict[str, float]) -> str:
+    return " ".join(f"{stage}={seconds:.3f}s" for stage, seconds in sorted(totals.items()))
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request and collecting its per-stage breakdown.
+
+    Durations run until the last body chunk was sent, so streamed responses are measured in
+    full. Requests slower than REQUEST_SLOW_LOG_SECONDS are logged with the time they spent
+    in each stage, and requests that opt in are handed to the request profiler.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Callable[[], Awaitable[Message]],
+        send: Callable[[Message], Awaitable[None]],
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started_at = time.perf_counter()
+        totals = project.stage_timing.start_request()
+        sampler = project.request_profiling.request_profiler.begin(scope["headers"])
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        requests_in_progress.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            requests_in_progress.dec()
+            elapsed = time.perf_counter() - started_at
+            method, route = scope["method"], route_label(scope)
+            request_time.observe(elapsed, method=method, route=route)
+            requests_handled.inc(method=method, route=route, status=str(status))
+            if elapsed >= REQUEST_SLOW_LOG_SECONDS:
+                logger.warning(
+                    "Slow request %s %s took %.3fs: %s",
+                    method,
+                    route,
+                    elapsed,
+                    stage_breakdown(totals) or "no stages recorded",
+                )
+            if sampler is not None:
+                profiler = project.request_profiling.request_profiler
+                label = f"{method} {route}"
+                path = profiler.finish(sampler, label, elapsed)
+                if path is not None:
+                    await asyncio.to_thread(profiler.write, sampler, path, label, elapsed)
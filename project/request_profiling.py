@@ -0,0 +1,162 @@
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+import project.metrics
+
+logger = logging.getLogger(__name__)
+
+# Share of requests sent with PROFILE_HEADER that are profiled; 0 turns profiling off.
+REQUEST_PROFILE_SAMPLE_RATE = float(os.getenv("REQUEST_PROFILE_SAMPLE_RATE", "0"))
+
+# Profiles of requests that finish faster than this are thrown away.
+REQUEST_PROFILE_SLOW_SECONDS = float(os.getenv("REQUEST_PROFILE_SLOW_SECONDS", "1"))
+
+REQUEST_PROFILE_INTERVAL_SECONDS = float(os.getenv("REQUEST_PROFILE_INTERVAL_SECONDS", "0.005"))
+
+REQUEST_PROFILE_DIR = os.getenv(
+    "REQUEST_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "tts-profiles")
+)
+
+PROFILE_HEADER = b"x-profile"
+
+profiles_taken = project.metrics.counter(
+    "tts_request_profiles",
+    "Requests profiled, by whether the profile was kept for being slow.",
+    ["outcome"],
+)
+
+
+class StackSampler:
+    """
+    Samples the stack of every thread at a fixed interval, from a background thread.
+
+    Stacks are aggregated in the collapsed format (``frame;frame;frame count`` per line) read by
+    flamegraph.pl and speedscope. Threads are labelled by name, so event loop time and the
+    synthesis and hashing pools show up as separate trees. The samples cover the whole process
+    while the request ran, so requests running alongside it appear too.
+    """
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.stacks: "Counter[str]" = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def _sample(self) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                filename = os.path.basename(code.co_filename)
+                frames.append(f"{code.co_name} ({filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            frames.append(names.get(ident, str(ident)))
+            self.stacks[";".join(reversed(frames))] += 1
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval_seconds):
+            self._sample()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def write(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as profile_file:
+            for stack, count in self.stacks.most_common():
+                profile_file.write(f"{stack} {count}\n")
+
+
+class RequestProfiler:
+    """
+    Opt-in stack profiles of slow requests.
+
+    A request is profiled when it carries PROFILE_HEADER and wins a ``sample_rate`` draw, and
+    only one request per process is profiled at a time. If it then takes longer than
+    ``slow_seconds`` its profile is written to ``directory``; otherwise it is discarded. With a
+    sample rate of 0 the only cost per request is one comparison.
+    """
+
+    def __init__(
+        self, sample_rate: float, slow_seconds: float, interval_seconds: float, directory: str
+    ):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.interval_seconds = interval_seconds
+        self.directory = directory
+        self._busy = threading.Lock()
+
+    def begin(self, headers) -> Optional[StackSampler]:
+        """
+        Start profiling a request if it asked for it and was sampled.
+
+        Args:
+            headers: The raw ASGI header pairs of the request.
+
+        Returns:
+            Optional[StackSampler]: The running sampler, to be passed to finish, or None.
+        """
+        if self.sample_rate <= 0:
+            return None
+        if not any(name == PROFILE_HEADER for name, _ in headers):
+            return None
+        if random.random() >= self.sample_rate or not self._busy.acquire(blocking=False):
+            return None
+        sampler = StackSampler(self.interval_seconds)
+        sampler.start()
+        return sampler
+
+    def finish(self, sampler: StackSampler, label: str, seconds: float) -> Optional[str]:
+        """
+        Stop a sampler started by begin, so that the next request may be profiled.
+
+        This never waits on I/O and is safe to call from the event loop, even while the
+        request is being cancelled.
+
+        Returns:
+            Optional[str]: Where the profile should be written with write, if the request was
+            slow, or None if it was discarded.
+        """
+        try:
+            sampler.stop()
+        finally:
+            self._busy.release()
+        if seconds < self.slow_seconds:
+            profiles_taken.inc(outcome="discarded")
+            return None
+        name = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_")
+        return os.path.join(self.directory, f"{int(time.time() * 1000)}-{name}.folded")
+
+    def write(self, sampler: StackSampler, path: str, label: str, seconds: float) -> None:
+        """
+        Write the profile of a slow request to the path chosen by finish.
+
+        This performs blocking file I/O and should be called off the event loop.
+        """
+        sampler.write(path)
+        profiles_taken.inc(outcome="kept")
+        logger.warning("Slow request %s took %.3fs, profile written to %s", label, seconds, path)
+
+
+request_profiler = RequestProfiler(
+    REQUEST_PROFILE_SAMPLE_RATE,
+    REQUEST_PROFILE_SLOW_SECONDS,
+    REQUEST_PROFILE_INTERVAL_SECONDS,
+    REQUEST_PROFILE_DIR,
+)
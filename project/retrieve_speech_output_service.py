@@ -1,36 +1,90 @@
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+import prisma
+import prisma.models
+import project.audio_store
+import project.stage_timing
 from pydantic import BaseModel
 
+ETAG_CACHE_SIZE = int(os.getenv("SPEECH_OUTPUT_ETAG_CACHE_SIZE", "4096"))
+
+MEDIA_TYPES = {".mp3": "audio/mpeg", ".wav": "audio/wav"}
+
+_etags: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
 
-class RetrieveSpeechOutputResponse(BaseModel):
+_etags_lock = threading.Lock()
+
+
+class SpeechOutputFile(BaseModel):
+    """
+    Describes a generated speech file on disk, ready to be served to the client.
     """
-    The response model encapsulates the speech file's information, including a URL to access/download the file. The response will ensure the file is served securely and only to authorized users requesting their specific files.
+
+    path: str
+    size: int
+    media_type: str
+    etag: str
+
+
+def content_etag(path: str, size: int, mtime_ns: int) -> str:
     """
+    Compute a strong ETag from the file's content, memoized by path, size and mtime.
 
-    url: str
-    fileSize: int
-    format: str
-    contentLength: float
+    This reads the whole file on a memo miss and should be called off the event loop.
+
+    Returns:
+        str: The quoted ETag value.
+    """
+    key = (path, size, mtime_ns)
+    with _etags_lock:
+        etag = _etags.get(key)
+        if etag is not None:
+            _etags.move_to_end(key)
+            return etag
+    with open(path, "rb") as audio_file:
+        digest = hashlib.file_digest(audio_file, "sha256").hexdigest()
+    etag = f'"{digest[:32]}"'
+    with _etags_lock:
+        _etags[key] = etag
+        while len(_etags) > ETAG_CACHE_SIZE:
+            _etags.popitem(last=False)
+    return etag
 
 
-async def retrieve_speech_output(fileId: str) -> RetrieveSpeechOutputResponse:
+async def retrieve_speech_output(fileId: str, user_id: str) -> SpeechOutputFile:
     """
     Retrieve generated speech file
 
     Args:
         fileId (str): The unique identifier for the speech file to be retrieved. Corresponds to the id in the SpeechResult table.
+        user_id (str): The caller; outputs of other users' requests are reported as missing.
 
     Returns:
-        RetrieveSpeechOutputResponse: The response model encapsulates the speech file's information, including a URL to access/download the file. The response will ensure the file is served securely and only to authorized users requesting their specific files.
+        SpeechOutputFile: Describes a generated speech file on disk, ready to be served to the client.
 
-    Example:
-        # Assuming fileId is 'some-unique-id' and a speech result with this ID exists with an MP3 format.
-        response = await retrieve_speech_output('some-unique-id')
-        print(response)
-        > RetrieveSpeechOutputResponse(url="https://example.com/download/speech-file.mp3", fileSize=1024000, format="MP3", contentLength=180.5)
+    Raises:
+        LookupError: If no speech result of this user has this id.
+        FileNotFoundError: If the result exists but its audio file is no longer on disk.
     """
-    return RetrieveSpeechOutputResponse(
-        url="https://example.com/download/speech-file.mp3",
-        fileSize=1024000,
-        format="MP3",
-        contentLength=180.5,
+    with project.stage_timing.span(project.stage_timing.DB):
+        speech_result = await prisma.models.SpeechResult.prisma().find_unique(
+            where={"id": fileId}, include={"speechRequest": True}
+        )
+    if speech_result is None or speech_result.speechRequest.userId != user_id:
+        raise LookupError(f"No speech output with id {fileId}.")
+    path = project.audio_store.audio_store.resolve(speech_result.audioFilePath)
+    with project.stage_timing.span(project.stage_timing.STORAGE):
+        stat = await asyncio.to_thread(os.stat, path)
+        await asyncio.to_thread(project.audio_store.audio_store.touch, path)
+        etag = await asyncio.to_thread(content_etag, path, stat.st_size, stat.st_mtime_ns)
+    return SpeechOutputFile(
+        path=path,
+        size=stat.st_size,
+        media_type=MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream"),
+        etag=etag,
     )
@@ -0,0 +1,172 @@
+import asyncio
+import os
+import re
+from typing import Mapping, Optional, Tuple
+
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 256 * 1024
+
+_BYTE_RANGE = re.compile(r"^([0-9]*)-([0-9]*)$")
+
+
+class SendfileResponse(Response):
+    """
+    Serves a byte range of a file without passing it through Python buffers when possible.
+
+    Servers that implement the ASGI ``http.response.zerocopysend`` extension get the open file
+    and hand it to ``sendfile(2)``; servers with ``http.response.pathsend`` get the path for
+    whole-file responses. Otherwise the range is streamed in CHUNK_SIZE reads off the event loop.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        byte_range: Tuple[int, int],
+        status_code: int,
+        media_type: str,
+        headers: Mapping[str, str],
+        full_file: bool,
+    ):
+        super().__init__(status_code=status_code, media_type=media_type, headers=headers)
+        self.path = path
+        self.offset, end = byte_range
+        self.count = end - self.offset + 1
+        self.full_file = full_file
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if scope.get("method") == "HEAD" or self.count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as source:
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": source,
+                        "offset": self.offset,
+                        "count": self.count,
+                        "more_body": False,
+                    }
+                )
+            return
+        if self.full_file and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": self.path})
+            return
+        source = await asyncio.to_thread(open, self.path, "rb")
+        try:
+            offset, remaining = self.offset, self.count
+            while remaining > 0:
+                chunk = await asyncio.to_thread(
+                    os.pread, source.fileno(), min(CHUNK_SIZE, remaining), offset
+                )
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": remaining > 0}
+                )
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            source.close()
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range ``Range`` header.
+
+    Args:
+        header (Optional[str]): The raw header value, e.g. ``bytes=0-1023`` or ``bytes=-500``.
+        size (int): The size of the file in bytes.
+
+    Returns:
+        Optional[Tuple[int, int]]: The inclusive start and end offsets, or None if the whole
+        file should be served (no header, a multi-range request, a unit other than bytes, or
+        a range that is not well-formed, such as one that ends before it starts).
+
+    Raises:
+        ValueError: If the range cannot be satisfied for a file of this size.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    match = _BYTE_RANGE.match(header[len("bytes=") :].strip())
+    if match is None or not any(match.groups()):
+        return None
+    start_text, end_text = match.groups()
+    if start_text:
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+        if end_text and end < start:
+            return None
+    else:
+        start = size - int(end_text)
+        end = size - 1
+    start, end = max(start, 0), min(end, size - 1)
+    if start > end or start >= size:
+        raise ValueError(f"Range {header} cannot be satisfied for {size} bytes.")
+    return start, end
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def file_response(
+    path: str,
+    size: int,
+    etag: str,
+    media_type: str,
+    request_headers: Mapping[str, str],
+) -> Response:
+    """
+    Answer a GET/HEAD for a file, honouring If-None-Match, If-Range and single-range Range.
+
+    Args:
+        path (str): The file to serve.
+        size (int): The file size in bytes.
+        etag (str): The file's strong, quoted ETag.
+        media_type (str): The Content-Type to send.
+        request_headers (Mapping[str, str]): The request headers (case-insensitive mapping).
+
+    Returns:
+        Response: A 304, 416, 206 or 200 response.
+    """
+    headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    range_header: Optional[str] = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    if if_range and if_range.strip() != etag:
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    if byte_range is None:
+        byte_range, status_code = (0, size - 1), 200
+    else:
+        headers["Content-Range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+        status_code = 206
+    headers["Content-Length"] = str(byte_range[1] - byte_range[0] + 1)
+    return SendfileResponse(
+        path,
+        byte_range,
+        status_code,
+        media_type,
+        headers,
+        full_file=status_code == 200,
+    )
@@ -2,17 +2,36 @@ import logging
 from contextlib import asynccontextmanager
 from typing import Optional
 
+import project.audio_store
+import project.auth
 import project.authenticate_user_service
+import project.cache_prewarm
+import project.convert_text_to_speech_batch_service
 import project.convert_text_to_speech_service
 import project.create_user_preferences_service
 import project.delete_user_preferences_service
+import project.get_speech_job_service
 import project.get_user_preferences_service
+import project.log_writer
+import project.metrics
+import project.password_hashing
 import project.refresh_token_service
+import project.request_metrics
 import project.retrieve_speech_output_service
+import project.sendfile_response
+import project.speech_job_queue
+import project.speech_stream_service
+import project.submit_speech_job_service
+import project.synthesis_engines
+import project.synthesis_pool
+import project.synthesis_scheduler
 import project.update_user_preferences_service
-from fastapi import FastAPI
+import project.upstream_http
+import project.upstream_resilience
+import project.user_preferences_cache
+from fastapi import Depends, FastAPI, Request, WebSocket
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import Response
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from prisma import Prisma
 
 logger = logging.getLogger(__name__)
@@ -23,7 +42,25 @@ db_client = Prisma(auto_register=True)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await db_client.connect()
+    if project.log_writer.log_table_handler is not None:
+        project.log_writer.log_table_handler.start()
+    project.speech_job_queue.speech_job_workers.start()
+    project.audio_store.audio_store_sweeper.start()
+    project.user_preferences_cache.invalidation_listener.start()
+    if project.cache_prewarm.CACHE_PREWARM_ON_STARTUP:
+        project.cache_prewarm.cache_prewarmer.start()
     yield
+    await project.cache_prewarm.cache_prewarmer.stop()
+    await project.user_preferences_cache.invalidation_listener.stop()
+    await project.audio_store.audio_store_sweeper.stop()
+    await project.speech_job_queue.speech_job_workers.stop()
+    project.synthesis_pool.synthesis_pool.shutdown()
+    project.password_hashing.password_hasher.shutdown()
+    project.upstream_http.upstream_session.close()
+    if project.log_writer.log_table_handler is not None:
+        await project.log_writer.log_table_handler.stop(
+            project.log_writer.LOG_TABLE_DRAIN_TIMEOUT_SECONDS
+        )
     await db_client.disconnect()
 
 
@@ -33,6 +70,8 @@ app = FastAPI(
     description="Based on the questions and responses during the interview, the task involves creating a text-to-speech (TTS) endpoint with specific requirements: 1. **Input Handling**: The endpoint must accept both plain text and SSML (Speech Synthesis Markup Language) formatted input. This dual-input capability allows for a broader range of speech expressions, from simple text conversion to complex speech patterns that include pauses, emphasis, and audio adjustments. 2. **Speech Conversion**: The core functionality is to convert the provided input text into natural-sounding speech audio. It involves selecting a TTS library that can handle both input types efficiently and produce high-quality audio output. Based on the interview, potential libraries include `gTTS` for simplicity and access to Google's TTS engine, `pyttsx3` for offline capabilities, or `aws-polly` for advanced features and natural voice options. 3. **Customization Features**: The endpoint must offer customization options for voice (e.g., gender, accent), speed, pitch, and other parameters. This level of customization allows users to tailor the speech output to match their preferences or application requirements, enhancing the overall user experience. 4. **Output Format**: The generated audio should be returned in a specified format, with MP3 being the preferred format due to its balance of sound quality and file size. This flexibility ensures that the TTS service can be used in a variety of applications, including those that require specific audio formats for compatibility or quality reasons. **Technical Implementation**: The service will be implemented using Python and FastAPI, leveraging FastAPI's asynchronous capabilities to handle speech synthesis operations efficiently. PostgreSQL, in conjunction with Prisma as the ORM, will be used to store and manage user preferences and possibly cache generated speech files for frequent requests. Special consideration will be given to security, error handling, and integration with the frontend to ensure a robust and scalable service.",
 )
 
+app.add_middleware(project.request_metrics.RequestMetricsMiddleware)
+
 
 @app.post(
     "/auth/refresh", response_model=project.refresh_token_service.RefreshTokenResponse
@@ -46,6 +85,10 @@ async def api_post_refresh_token(
     try:
         res = await project.refresh_token_service.refresh_token(existing_token)
         return res
+    except project.auth.InvalidCredentials as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=401)
     except Exception as e:
         logger.exception("Error processing request")
         res = dict()
@@ -62,14 +105,18 @@ async def api_post_refresh_token(
     response_model=project.create_user_preferences_service.CreateUserPreferencesResponse,
 )
 async def api_post_create_user_preferences(
-    userId: str, voice: str, speed: float, pitch: float, language: str
+    voice: str,
+    speed: float,
+    pitch: float,
+    language: str,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.current_user),
 ) -> project.create_user_preferences_service.CreateUserPreferencesResponse | Response:
     """
     Create new user preferences
     """
     try:
         res = await project.create_user_preferences_service.create_user_preferences(
-            userId, voice, speed, pitch, language
+            user.id, voice, speed, pitch, language
         )
         return res
     except Exception as e:
@@ -88,14 +135,14 @@ async def api_post_create_user_preferences(
     response_model=project.delete_user_preferences_service.DeleteUserPreferencesResponse,
 )
 async def api_delete_delete_user_preferences(
-    user_id: str,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.current_user),
 ) -> project.delete_user_preferences_service.DeleteUserPreferencesResponse | Response:
     """
     Delete user's preferences
     """
     try:
         res = await project.delete_user_preferences_service.delete_user_preferences(
-            user_id
+            user.id
         )
         return res
     except Exception as e:
@@ -114,14 +161,18 @@ async def api_delete_delete_user_preferences(
     response_model=project.update_user_preferences_service.UpdateUserPreferencesOutput,
 )
 async def api_put_update_user_preferences(
-    voice: str, speed: float, pitch: float, language: str
+    voice: str,
+    speed: float,
+    pitch: float,
+    language: str,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.current_user),
 ) -> project.update_user_preferences_service.UpdateUserPreferencesOutput | Response:
     """
     Update existing user preferences
     """
     try:
         res = await project.update_user_preferences_service.update_user_preferences(
-            voice, speed, pitch, language
+            user.id, voice, speed, pitch, language
         )
         return res
     except Exception as e:
@@ -148,6 +199,15 @@ async def api_post_authenticate_user(
     try:
         res = await project.authenticate_user_service.authenticate_user(email, password)
         return res
+    except project.password_hashing.PasswordHashingSaturated as e:
+        logger.warning("Rejecting login: %s", e)
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(
+            content=jsonable_encoder(res),
+            status_code=503,
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except Exception as e:
         logger.exception("Error processing request")
         res = dict()
@@ -164,69 +224,256 @@ async def api_post_authenticate_user(
     response_model=project.convert_text_to_speech_service.SpeechSynthesisResponse,
 )
 async def api_post_convert_text_to_speech(
-    user_id: str,
     text: str,
     language: str,
     voice_preference: str,
     input_format: str,
     speed: Optional[float],
     pitch: Optional[float],
+    stream: bool = False,
+    output_format: str = "MP3",
+    engine: Optional[str] = None,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.current_user),
 ) -> project.convert_text_to_speech_service.SpeechSynthesisResponse | Response:
     """
     Convert provided text to speech and return audio file
+
+    With ``stream=true`` the audio itself is returned as a chunked ``audio/mpeg`` response
+    that starts as soon as the first sentence has been synthesized. Streaming is MP3 only;
+    ``output_format=WAV`` is available for buffered conversions. ``engine`` picks the synthesis
+    engine (``gtts``, ``local`` or ``fake``) instead of the configured default. SSML input may
+    use ``<break>``, ``<p>``, ``<s>``, ``<prosody rate pitch>`` and ``<sub alias>``.
     """
     try:
+        if stream and output_format.upper() != "MP3":
+            raise ValueError("Streaming is only available for MP3 output.")
+        if stream:
+            frames = await project.convert_text_to_speech_service.stream_text_to_speech(
+                user.id,
+                text,
+                language,
+                voice_preference,
+                input_format,
+                speed,
+                pitch,
+                engine,
+            )
+            return StreamingResponse(frames, media_type="audio/mpeg")
         res = await project.convert_text_to_speech_service.convert_text_to_speech(
-            user_id, text, language, voice_preference, input_format, speed, pitch
+            user.id,
+            text,
+            language,
+            voice_preference,
+            input_format,
+            speed,
+            pitch,
+            output_format,
+            engine,
         )
         return res
+    except project.synthesis_scheduler.SynthesisRateLimited as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(
+            content=jsonable_encoder(res),
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except (
+        project.synthesis_pool.SynthesisPoolSaturated,
+        project.synthesis_scheduler.SynthesisQueueFull,
+        project.upstream_resilience.UpstreamUnavailable,
+    ) as e:
+        logger.warning("Rejecting speech conversion: %s", e)
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(
+            content=jsonable_encoder(res),
+            status_code=503,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except ValueError as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=400)
+    except project.upstream_resilience.UpstreamDeadlineExceeded as e:
+        logger.warning("Speech conversion timed out: %s", e)
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=504)
+    except project.synthesis_engines.SynthesisEngineError as e:
+        logger.warning("Speech conversion failed upstream: %s", e)
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=502)
     except Exception as e:
         logger.exception("Error processing request")
         res = dict()
         res["error"] = str(e)
-        return Response(
+        return JSONResponse(content=jsonable_encoder(res), status_code=500)
+
+
+@app.post(
+    "/speech/convert/batch",
+    response_model=project.convert_text_to_speech_batch_service.BatchSpeechResponse,
+)
+async def api_post_convert_text_to_speech_batch(
+    request: project.convert_text_to_speech_batch_service.BatchSpeechRequest,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.current_user),
+) -> project.convert_text_to_speech_batch_service.BatchSpeechResponse | Response:
+    """
+    Convert many texts to speech in one call
+    """
+    try:
+        res = await project.convert_text_to_speech_batch_service.convert_text_to_speech_batch(
+            request, user.id
+        )
+        return res
+    except project.synthesis_scheduler.SynthesisRateLimited as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(
             content=jsonable_encoder(res),
-            status_code=500,
-            media_type="application/json",
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after)},
         )
+    except ValueError as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=400)
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=500)
+
+
+@app.post(
+    "/speech/jobs",
+    response_model=project.submit_speech_job_service.SubmitSpeechJobResponse,
+    status_code=202,
+)
+async def api_post_submit_speech_job(
+    text: str,
+    language: str,
+    voice_preference: str,
+    input_format: str,
+    speed: Optional[float] = None,
+    pitch: Optional[float] = None,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.current_user),
+) -> project.submit_speech_job_service.SubmitSpeechJobResponse | Response:
+    """
+    Queue a text-to-speech conversion to be processed in the background
+    """
+    try:
+        res = await project.submit_speech_job_service.submit_speech_job(
+            user.id, text, language, voice_preference, input_format, speed, pitch
+        )
+        return res
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=500)
 
 
 @app.get(
-    "/speech/output/{fileId}",
-    response_model=project.retrieve_speech_output_service.RetrieveSpeechOutputResponse,
+    "/speech/jobs/{jobId}",
+    response_model=project.get_speech_job_service.SpeechJobStatusResponse,
 )
+async def api_get_speech_job(
+    jobId: str,
+    wait: float = 0.0,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.current_user),
+) -> project.get_speech_job_service.SpeechJobStatusResponse | Response:
+    """
+    Retrieve the status of an asynchronous conversion, optionally long-polling for completion
+    """
+    try:
+        res = await project.get_speech_job_service.get_speech_job(jobId, user.id, wait)
+        return res
+    except LookupError as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=404)
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=500)
+
+
+@app.websocket("/speech/stream")
+async def api_websocket_stream_speech(
+    websocket: WebSocket,
+    language: str,
+    voice_preference: str,
+    speed: Optional[float] = None,
+    pitch: Optional[float] = None,
+    engine: Optional[str] = None,
+) -> None:
+    """
+    Convert text fragments to speech incrementally over a WebSocket
+
+    The access token goes in the ``Authorization`` header or the ``token`` query parameter.
+    """
+    user = project.auth.websocket_user(websocket)
+    if user is None:
+        await websocket.close(
+            code=project.speech_stream_service.WS_CLOSE_POLICY_VIOLATION
+        )
+        return
+    await websocket.accept()
+    try:
+        await project.speech_stream_service.stream_speech_session(
+            websocket, user.id, language, voice_preference, speed, pitch, engine
+        )
+    except Exception:
+        logger.exception("Error processing request")
+
+
+@app.api_route("/speech/output/{fileId}", methods=["GET", "HEAD"])
 async def api_get_retrieve_speech_output(
     fileId: str,
-) -> project.retrieve_speech_output_service.RetrieveSpeechOutputResponse | Response:
+    request: Request,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.current_user),
+) -> Response:
     """
     Retrieve generated speech file
+
+    Supports single-range ``Range`` requests for seeking and ``If-None-Match`` revalidation
+    against a strong, content-derived ETag.
     """
     try:
         res = await project.retrieve_speech_output_service.retrieve_speech_output(
-            fileId
+            fileId, user.id
         )
-        return res
+        return project.sendfile_response.file_response(
+            res.path, res.size, res.etag, res.media_type, request.headers
+        )
+    except (LookupError, FileNotFoundError) as e:
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=jsonable_encoder(res), status_code=404)
     except Exception as e:
         logger.exception("Error processing request")
         res = dict()
         res["error"] = str(e)
-        return Response(
-            content=jsonable_encoder(res),
-            status_code=500,
-            media_type="application/json",
-        )
+        return JSONResponse(content=jsonable_encoder(res), status_code=500)
 
 
 @app.get(
     "/user/preferences",
     response_model=project.get_user_preferences_service.UserPreferencesResponse,
 )
-async def api_get_get_user_preferences() -> project.get_user_preferences_service.UserPreferencesResponse | Response:
+async def api_get_get_user_preferences(
+    user: project.auth.AuthenticatedUser = Depends(project.auth.current_user),
+) -> project.get_user_preferences_service.UserPreferencesResponse | Response:
     """
     Retrieve user's saved preferences
     """
     try:
-        res = await project.get_user_preferences_service.get_user_preferences()
+        res = await project.get_user_preferences_service.get_user_preferences(user.id)
         return res
     except Exception as e:
         logger.exception("Error processing request")
@@ -237,3 +484,13 @@ async def api_get_get_user_preferences() -> project.get_user_preferences_service
             status_code=500,
             media_type="application/json",
         )
+
+
+@app.get("/metrics")
+async def api_get_metrics() -> Response:
+    """
+    Expose service metrics in the Prometheus text format
+    """
+    return Response(
+        content=project.metrics.render(), media_type=project.metrics.CONTENT_TYPE
+    )
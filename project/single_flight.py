@@ -0,0 +1,166 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import tempfile
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import project.metrics
+
+SINGLE_FLIGHT_LOCK_DIR = os.getenv(
+    "SINGLE_FLIGHT_LOCK_DIR", os.path.join(tempfile.gettempdir(), "tts-single-flight")
+)
+
+SINGLE_FLIGHT_LOCK_STRIPES = int(os.getenv("SINGLE_FLIGHT_LOCK_STRIPES", "1024"))
+
+SINGLE_FLIGHT_POLL_SECONDS = float(os.getenv("SINGLE_FLIGHT_POLL_SECONDS", "0.05"))
+
+coalesced_calls = project.metrics.counter(
+    "tts_single_flight_coalesced",
+    "Upstream synthesis calls saved by joining an identical in-flight request.",
+    ["scope"],
+)
+
+leader_calls = project.metrics.counter(
+    "tts_single_flight_leaders", "Synthesis calls actually made by a single-flight leader."
+)
+
+published_results = project.metrics.counter(
+    "tts_single_flight_published",
+    "Leader results published to shared storage because another worker was waiting on them.",
+)
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent work so that only one caller performs it.
+
+    Within a process, the first caller for a key becomes the leader and later callers await
+    the leader's result. Across worker processes on the same host, leaders additionally take an
+    exclusive ``flock`` on one of ``stripes`` lock files and re-check for a result produced by
+    another worker before doing the work themselves. Leaders of different keys that share a
+    stripe queue on an ``asyncio.Lock`` per stripe, so at most one ``flock`` per stripe is held
+    or awaited per process, and the lock is awaited by polling with ``LOCK_NB`` rather than by
+    parking an executor thread that the lock holder may need to finish.
+
+    A result only the leader's process can see would make another worker's re-check miss, so
+    a leader that finds another worker waiting on its key ``publish``es the result, e.g. writes
+    it to shared storage, before letting go of the lock. Waiters announce themselves by creating
+    a marker file for the key; a waiter that shows up just as the leader finishes may still miss
+    and do the work again.
+    """
+
+    def __init__(self, lock_dir: str, stripes: int, poll_seconds: float):
+        self.lock_dir = lock_dir
+        self.stripes = stripes
+        self.poll_seconds = poll_seconds
+        self._in_flight: Dict[str, "asyncio.Task[Any]"] = {}
+        self._stripe_locks: Dict[int, asyncio.Lock] = {}
+
+    def _stripe(self, key: str) -> Tuple[int, str]:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return int(digest[:8], 16) % self.stripes, digest
+
+    @staticmethod
+    def _take_waiting(waiting_path: str) -> bool:
+        try:
+            os.remove(waiting_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    async def _flock(self, fd: int, waiting_path: str) -> None:
+        """
+        Take an exclusive ``flock`` on ``fd``, announcing the wait with a marker file if
+        another process holds it.
+        """
+        announced = False
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if not announced:
+                    os.close(os.open(waiting_path, os.O_WRONLY | os.O_CREAT, 0o644))
+                    announced = True
+                await asyncio.sleep(self.poll_seconds)
+
+    async def _lead(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        recheck: Optional[Callable[[], Awaitable[Optional[Any]]]],
+        publish: Optional[Callable[[Any], Awaitable[None]]],
+    ) -> Any:
+        stripe, digest = self._stripe(key)
+        lock = self._stripe_locks.get(stripe)
+        if lock is None:
+            lock = self._stripe_locks[stripe] = asyncio.Lock()
+        async with lock:
+            os.makedirs(self.lock_dir, exist_ok=True)
+            lock_path = os.path.join(self.lock_dir, f"{stripe:05d}.lock")
+            waiting_path = f"{lock_path}.{digest}.waiting"
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                await self._flock(fd, waiting_path)
+                try:
+                    if recheck is not None:
+                        result = await recheck()
+                        if result is not None:
+                            # The result is already shared; nobody needs it published.
+                            self._take_waiting(waiting_path)
+                            coalesced_calls.inc(scope="host")
+                            return result
+                    leader_calls.inc()
+                    result = await fn()
+                    if publish is not None and self._take_waiting(waiting_path):
+                        await publish(result)
+                        published_results.inc()
+                    return result
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        recheck: Optional[Callable[[], Awaitable[Optional[Any]]]] = None,
+        publish: Optional[Callable[[Any], Awaitable[None]]] = None,
+    ) -> Any:
+        """
+        Run ``fn`` once for all concurrent callers sharing ``key``.
+
+        Args:
+            key (str): Identifies identical work, e.g. a speech cache key.
+            fn (Callable[[], Awaitable[Any]]): Performs the work; called only by the leader.
+            recheck (Optional[Callable[[], Awaitable[Optional[Any]]]]): Awaited by the leader
+                once it holds the cross-process lock; a non-None result is returned instead of
+                calling ``fn``.
+            publish (Optional[Callable[[Any], Awaitable[None]]]): Called by the leader with the
+                result of ``fn``, before it releases the lock, when another worker is waiting;
+                it must make the result visible to that worker's ``recheck``.
+
+        Returns:
+            Any: The result of ``fn`` (or ``recheck``), shared by every caller.
+        """
+        task = self._in_flight.get(key)
+        if task is not None:
+            coalesced_calls.inc(scope="process")
+        else:
+            task = asyncio.ensure_future(self._lead(key, fn, recheck, publish))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._finished(key, task))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: "asyncio.Task[Any]") -> None:
+        self._in_flight.pop(key, None)
+        # Every waiter may have been cancelled; mark the leader's failure as observed.
+        if not task.cancelled():
+            task.exception()
+
+
+single_flight = SingleFlight(
+    SINGLE_FLIGHT_LOCK_DIR, SINGLE_FLIGHT_LOCK_STRIPES, SINGLE_FLIGHT_POLL_SECONDS
+)
@@ -0,0 +1,386 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import project.audio_store
+import project.metrics
+import project.mp3
+import project.wav
+from pydantic import BaseModel, Field
+
+SPEECH_CACHE_ENABLED = os.getenv("SPEECH_CACHE_ENABLED", "true").lower() == "true"
+
+SPEECH_CACHE_MAX_BYTES = int(os.getenv("SPEECH_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+SPEECH_CACHE_TTL_SECONDS = int(os.getenv("SPEECH_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Results up to this size stay in memory and reach the disk only when a row must reference them
+# or another worker is waiting for them.
+SPEECH_SPILL_THRESHOLD_BYTES = int(os.getenv("SPEECH_SPILL_THRESHOLD_BYTES", str(256 * 1024)))
+
+SPEECH_MEMORY_CACHE_MAX_BYTES = int(
+    os.getenv("SPEECH_MEMORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+)
+
+cache_hits = project.metrics.counter(
+    "tts_speech_cache_hits", "Synthesis requests served from the speech cache."
+)
+
+cache_misses = project.metrics.counter(
+    "tts_speech_cache_misses", "Synthesis requests that were not in the speech cache."
+)
+
+cache_evictions = project.metrics.counter(
+    "tts_speech_cache_evictions", "Entries dropped from the speech cache index.", ["reason"]
+)
+
+cache_bytes = project.metrics.gauge(
+    "tts_speech_cache_bytes", "Bytes of audio indexed by the speech cache."
+)
+
+cache_entries = project.metrics.gauge(
+    "tts_speech_cache_entries", "Number of entries indexed by the speech cache."
+)
+
+cache_memory_bytes = project.metrics.gauge(
+    "tts_speech_cache_memory_bytes", "Bytes of audio the speech cache holds in memory."
+)
+
+cache_writes = project.metrics.counter(
+    "tts_speech_cache_writes",
+    "Results written to the audio store: spilled for size, or persisted for a row.",
+    ["reason"],
+)
+
+
+class CacheEntry(BaseModel):
+    """
+    A cached synthesis result, held in memory, stored on disk, or both.
+
+    ``path`` is where the audio lives in the audio store, or where it will be written once it
+    is persisted; ``on_disk`` says whether it is there yet. ``audio`` holds the bytes while the
+    entry is in memory and is None once only the file is left.
+    """
+
+    key: str
+    path: str
+    size: int
+    created_at: float
+    metadata: project.mp3.AudioMetadata = project.mp3.EMPTY_METADATA
+    on_disk: bool = True
+    audio: Optional[bytes] = Field(default=None, repr=False, exclude=True)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text so that trivially different inputs share a cache entry.
+
+    Args:
+        text (str): The raw input text.
+
+    Returns:
+        str: The NFC-normalized text with runs of whitespace collapsed to single spaces.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(
+    text: str,
+    language: str,
+    voice_preference: str,
+    input_format: str,
+    output_format: str,
+    speed: Optional[float] = None,
+    pitch: Optional[float] = None,
+    engine: str = "gtts",
+) -> str:
+    """
+    Compute the content address of a synthesis request.
+
+    Args:
+        text (str): The text content to be converted into speech.
+        language (str): The language and accent desired for the speech output.
+        voice_preference (str): The user's preferred voice setting for the speech.
+        input_format (str): The format of the input text, plain text or SSML.
+        output_format (str): The audio format of the output, e.g. MP3.
+        speed (Optional[float]): The rate of speech to apply to the output.
+        pitch (Optional[float]): The pitch adjustment for the speech output.
+        engine (str): The synthesis engine that produces the audio.
+
+    Returns:
+        str: A hex SHA-256 digest of the normalized request parameters.
+    """
+    parameters = [
+        normalize_text(text),
+        language.strip().lower(),
+        voice_preference.strip().lower(),
+        input_format.strip().upper(),
+        output_format.strip().upper(),
+        round(speed if speed is not None else 1.0, 3),
+        round(pitch if pitch is not None else 0.0, 3),
+    ]
+    if engine != "gtts":
+        # Keys of gTTS audio predate engine selection and are kept stable.
+        parameters.append(engine)
+    encoded = json.dumps(parameters, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class SpeechCache:
+    """
+    Content-addressed cache of synthesized audio.
+
+    Results up to ``spill_threshold`` bytes are kept in memory and never touch the filesystem
+    unless a SpeechResult row has to reference them (see persist); larger ones spill straight
+    to the managed audio ``store``. An LRU index holds both kinds: entries expire after
+    ``ttl_seconds``, the least recently used are dropped once the indexed audio exceeds
+    ``max_bytes``, and in-memory audio beyond ``memory_max_bytes`` is released (entries that
+    were never persisted are dropped with it). Dropping an entry leaves its file alone: files
+    may be referenced by SpeechResult rows, and the store's quota and sweeper decide when they
+    go. Files written by other workers are adopted into the index on a miss; in-memory
+    results are private to their process, unless single-flight persists one for a worker
+    waiting on the same synthesis.
+    """
+
+    def __init__(
+        self,
+        store: project.audio_store.AudioStore,
+        max_bytes: int,
+        ttl_seconds: int,
+        enabled: bool = True,
+        spill_threshold: int = SPEECH_SPILL_THRESHOLD_BYTES,
+        memory_max_bytes: int = SPEECH_MEMORY_CACHE_MAX_BYTES,
+    ):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.spill_threshold = spill_threshold
+        self.memory_max_bytes = memory_max_bytes
+        self._index: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        return now - entry.created_at > self.ttl_seconds
+
+    def _remove_locked(self, key: str, reason: str) -> None:
+        entry = self._index.pop(key, None)
+        if entry is None:
+            return
+        self._total_bytes -= entry.size
+        if entry.audio is not None:
+            self._memory_bytes -= entry.size
+        cache_evictions.inc(reason=reason)
+        self._update_gauges_locked()
+
+    def _insert_locked(self, entry: CacheEntry) -> None:
+        previous = self._index.pop(entry.key, None)
+        if previous is not None:
+            self._total_bytes -= previous.size
+            if previous.audio is not None:
+                self._memory_bytes -= previous.size
+        self._index[entry.key] = entry
+        self._total_bytes += entry.size
+        if entry.audio is not None:
+            self._memory_bytes += entry.size
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            oldest_key = next(iter(self._index))
+            self._remove_locked(oldest_key, "size")
+        self._release_memory_locked()
+        self._update_gauges_locked()
+
+    def _release_memory_locked(self) -> None:
+        for key in list(self._index):
+            if self._memory_bytes <= self.memory_max_bytes:
+                break
+            entry = self._index[key]
+            if entry.audio is None:
+                continue
+            if entry.on_disk:
+                entry.audio = None
+                self._memory_bytes -= entry.size
+            else:
+                self._remove_locked(key, "memory")
+
+    def _update_gauges_locked(self) -> None:
+        cache_bytes.set(self._total_bytes)
+        cache_entries.set(len(self._index))
+        cache_memory_bytes.set(self._memory_bytes)
+
+    def _adopt_from_disk(self, key: str, extension: str) -> Optional[CacheEntry]:
+        path = self.store.path_for(key, extension)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        entry = CacheEntry(key=key, path=path, size=stat.st_size, created_at=stat.st_mtime)
+        if self._expired(entry, time.time()):
+            cache_evictions.inc(reason="ttl")
+            return None
+        entry.metadata = (
+            project.wav.probe_file(path)
+            if extension == ".wav"
+            else project.mp3.probe_file(path)
+        )
+        with self._lock:
+            self._insert_locked(entry)
+        return entry
+
+    def _get_in_memory(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None and self._expired(entry, time.time()):
+                self._remove_locked(key, "ttl")
+                return None
+            if entry is None or entry.audio is None:
+                return None
+            self._index.move_to_end(key)
+            return entry
+
+    def _get_on_disk(
+        self, key: str, extension: str, entry: Optional[CacheEntry]
+    ) -> Optional[CacheEntry]:
+        """
+        Finish a lookup that needs the filesystem: check that an indexed file still exists,
+        adopt a file written by another worker, and touch the file of a hit. ``entry`` is a hit
+        already found in memory, if any. This performs blocking file I/O.
+        """
+        if entry is None:
+            with self._lock:
+                entry = self._index.get(key)
+            if entry is not None and entry.audio is None and not os.path.exists(entry.path):
+                with self._lock:
+                    if self._index.get(key) is entry:
+                        self._remove_locked(key, "missing")
+                entry = None
+            if entry is None:
+                entry = self._adopt_from_disk(key, extension)
+            if entry is None:
+                return None
+            with self._lock:
+                if self._index.get(key) is entry:
+                    self._index.move_to_end(key)
+        if entry.on_disk:
+            self.store.touch(entry.path)
+        return entry
+
+    async def get(self, key: str, extension: str = ".mp3") -> Optional[CacheEntry]:
+        """
+        Look up a cached result and mark it as recently used.
+
+        A result held only in memory is returned without leaving the event loop; checking,
+        adopting or touching a file runs in a worker thread.
+
+        Args:
+            key (str): The cache key computed by cache_key.
+            extension (str): The file extension of the output format, used to find entries
+                written by other workers.
+
+        Returns:
+            Optional[CacheEntry]: The cached entry, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        entry = self._get_in_memory(key)
+        if entry is None or entry.on_disk:
+            entry = await asyncio.to_thread(self._get_on_disk, key, extension, entry)
+        if entry is None:
+            cache_misses.inc()
+            return None
+        cache_hits.inc()
+        return entry
+
+    def put(self, key: str, audio: bytes, extension: str = ".mp3") -> CacheEntry:
+        """
+        Store freshly synthesized audio in the cache.
+
+        Audio up to the spill threshold is only kept in memory. Larger audio is written
+        atomically into the audio store, so other workers never adopt a partially written
+        entry. When the cache is disabled the entry gets a file name of its own, since callers
+        discard intermediate results that nobody else may share. Spilling performs blocking
+        file I/O, so this should be called off the event loop.
+
+        Args:
+            key (str): The cache key computed by cache_key.
+            audio (bytes): The synthesized audio; it is referenced, not copied.
+            extension (str): The file extension of its format, ``.mp3`` or ``.wav``.
+
+        Returns:
+            CacheEntry: The entry holding the audio or describing where it now lives.
+        """
+        metadata = (
+            project.wav.probe(audio) if extension == ".wav" else project.mp3.probe(audio)
+        )
+        storage_key = key if self.enabled else f"{key}-{uuid.uuid4().hex}"
+        entry = CacheEntry(
+            key=key,
+            path=self.store.path_for(storage_key, extension),
+            size=len(audio),
+            created_at=time.time(),
+            metadata=metadata,
+            on_disk=False,
+            audio=audio,
+        )
+        if len(audio) > self.spill_threshold:
+            self.store.write_file(entry.path, audio)
+            cache_writes.inc(reason="spill")
+            entry.on_disk = True
+            entry.audio = None
+        if self.enabled:
+            with self._lock:
+                self._insert_locked(entry)
+        return entry
+
+    def read(self, entry: CacheEntry) -> bytes:
+        """
+        Return the audio of an entry, from memory if it is still there.
+
+        This may read the file and should then be called off the event loop.
+        """
+        audio = entry.audio
+        if audio is not None:
+            return audio
+        with open(entry.path, "rb") as audio_file:
+            return audio_file.read()
+
+    def persist(self, entry: CacheEntry) -> None:
+        """
+        Make sure an entry's audio is on disk at ``entry.path``, for a row to reference it.
+
+        This performs blocking file I/O when the entry is only in memory and should be called
+        off the event loop.
+        """
+        audio = entry.audio
+        if entry.on_disk or audio is None:
+            return
+        self.store.write_file(entry.path, audio)
+        cache_writes.inc(reason="persist")
+        entry.on_disk = True
+
+    def discard(self, entry: CacheEntry) -> None:
+        """
+        Remove the file of an intermediate result when caching is disabled.
+        """
+        if self.enabled or not entry.on_disk:
+            return
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+speech_cache = SpeechCache(
+    project.audio_store.audio_store,
+    SPEECH_CACHE_MAX_BYTES,
+    SPEECH_CACHE_TTL_SECONDS,
+    enabled=SPEECH_CACHE_ENABLED,
+)
@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import os
+import random
+import weakref
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import prisma
+import prisma.enums
+import prisma.models
+import project.convert_text_to_speech_service
+import project.metrics
+import project.synthesis_pool
+import project.synthesis_scheduler
+import project.upstream_resilience
+
+logger = logging.getLogger(__name__)
+
+SPEECH_JOB_WORKERS = int(os.getenv("SPEECH_JOB_WORKERS", "2"))
+
+SPEECH_JOB_POLL_SECONDS = float(os.getenv("SPEECH_JOB_POLL_SECONDS", "2"))
+
+SPEECH_JOB_MAX_ATTEMPTS = int(os.getenv("SPEECH_JOB_MAX_ATTEMPTS", "5"))
+
+SPEECH_JOB_BACKOFF_SECONDS = float(os.getenv("SPEECH_JOB_BACKOFF_SECONDS", "2"))
+
+SPEECH_JOB_MAX_BACKOFF_SECONDS = float(os.getenv("SPEECH_JOB_MAX_BACKOFF_SECONDS", "300"))
+
+SPEECH_JOB_LEASE_SECONDS = int(os.getenv("SPEECH_JOB_LEASE_SECONDS", "600"))
+
+# How often a worker renews the lease of the job it is running; well under the lease itself.
+SPEECH_JOB_HEARTBEAT_SECONDS = float(
+    os.getenv("SPEECH_JOB_HEARTBEAT_SECONDS", str(SPEECH_JOB_LEASE_SECONDS / 3))
+)
+
+TERMINAL_STATUSES = (prisma.enums.ProcessStatus.COMPLETED, prisma.enums.ProcessStatus.FAILED)
+
+# Claims the oldest due job. PROCESSING jobs whose lease ran out (their worker died) are
+# reclaimed too, unless they have used up their attempts. SKIP LOCKED lets any number of
+# workers claim concurrently without blocking.
+CLAIM_JOB_SQL = """
+UPDATE speech_requests
+SET status = 'PROCESSING'::"ProcessStatus", attempts = attempts + 1, "updatedAt" = now()
+WHERE id = (
+    SELECT id FROM speech_requests
+    WHERE (status = 'PENDING'::"ProcessStatus"
+           AND ("nextAttemptAt" IS NULL OR "nextAttemptAt" <= now()))
+       OR (status = 'PROCESSING'::"ProcessStatus"
+           AND "updatedAt" < now() - make_interval(secs => $1)
+           AND attempts < $2)
+    ORDER BY "createdAt"
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+)
+RETURNING id, "userId", "inputText", "inputFormat", language, "voicePreference",
+          speed, pitch, attempts
+"""
+
+# Fails jobs whose lease ran out on their last attempt: a job that keeps killing its worker
+# (out of memory, a crash in native code) never gets to record its own failure.
+FAIL_ABANDONED_JOBS_SQL = """
+UPDATE speech_requests
+SET status = 'FAILED'::"ProcessStatus", "processedAt" = now(), "updatedAt" = now(),
+    "lastError" = 'The job''s worker stopped before it finished, on every attempt.'
+WHERE status = 'PROCESSING'::"ProcessStatus"
+  AND "updatedAt" < now() - make_interval(secs => $1)
+  AND attempts >= $2
+"""
+
+# Renews a running job's lease, as long as this worker still holds it.
+EXTEND_LEASE_SQL = """
+UPDATE speech_requests
+SET "updatedAt" = now()
+WHERE id = $1 AND status = 'PROCESSING'::"ProcessStatus" AND attempts = $2
+"""
+
+jobs_claimed = project.metrics.counter(
+    "tts_speech_jobs_claimed", "Asynchronous speech jobs claimed by a worker."
+)
+
+jobs_finished = project.metrics.counter(
+    "tts_speech_jobs_finished", "Asynchronous speech job attempts by outcome.", ["outcome"]
+)
+
+jobs_busy_workers = project.metrics.gauge(
+    "tts_speech_jobs_busy_workers", "Job workers currently processing a job."
+)
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Exponential backoff with full jitter for a job that has failed ``attempts`` times.
+    """
+    ceiling = min(
+        SPEECH_JOB_MAX_BACKOFF_SECONDS, SPEECH_JOB_BACKOFF_SECONDS * 2 ** (attempts - 1)
+    )
+    return random.uniform(ceiling / 2, ceiling)
+
+
+async def claim_job() -> Optional[Dict[str, Any]]:
+    """
+    Claim the oldest due job and mark it PROCESSING.
+
+    Returns:
+        Optional[Dict[str, Any]]: The claimed job's columns, or None if nothing is due.
+    """
+    rows: List[Dict[str, Any]] = await prisma.get_client().query_raw(
+        CLAIM_JOB_SQL, SPEECH_JOB_LEASE_SECONDS, SPEECH_JOB_MAX_ATTEMPTS
+    )
+    if not rows:
+        return None
+    jobs_claimed.inc()
+    return rows[0]
+
+
+async def fail_abandoned_jobs() -> int:
+    """
+    Mark FAILED the jobs whose lease expired after their last allowed attempt.
+
+    Returns:
+        int: The number of jobs failed.
+    """
+    failed: int = await prisma.get_client().execute_raw(
+        FAIL_ABANDONED_JOBS_SQL, SPEECH_JOB_LEASE_SECONDS, SPEECH_JOB_MAX_ATTEMPTS
+    )
+    if failed:
+        logger.warning("Failed %d speech jobs whose worker stopped on every attempt", failed)
+        jobs_finished.inc(failed, outcome="abandoned")
+    return failed
+
+
+async def extend_lease(job: Dict[str, Any]) -> None:
+    """
+    Renew a claimed job's lease every SPEECH_JOB_HEARTBEAT_SECONDS until cancelled, so that a
+    synthesis running longer than SPEECH_JOB_LEASE_SECONDS is not reclaimed by another worker.
+    """
+    while True:
+        await asyncio.sleep(SPEECH_JOB_HEARTBEAT_SECONDS)
+        try:
+            await prisma.get_client().execute_raw(EXTEND_LEASE_SQL, job["id"], job["attempts"])
+        except Exception:
+            logger.warning("Could not extend the lease of speech job %s", job["id"], exc_info=True)
+
+
+async def process_job(job: Dict[str, Any]) -> None:
+    """
+    Synthesize a claimed job and move it to COMPLETED, back to PENDING, or to FAILED.
+
+    The job's lease is renewed while it runs. Jobs whose input is invalid fail straight away,
+    since retrying them cannot succeed.
+
+    Args:
+        job (Dict[str, Any]): A job returned by claim_job.
+    """
+    now = datetime.now(timezone.utc)
+    heartbeat = asyncio.ensure_future(extend_lease(job))
+    try:
+        async with project.synthesis_scheduler.synthesis_scheduler.admit(job["userId"]):
+            entry = await project.convert_text_to_speech_service.synthesize_chunked(
+                job["inputText"],
+                job["language"],
+                job["voicePreference"],
+                job["inputFormat"],
+                job["speed"],
+                job["pitch"],
+            )
+        await project.convert_text_to_speech_service.persist_entry(entry)
+    except (
+        project.synthesis_pool.SynthesisPoolSaturated,
+        project.synthesis_scheduler.SynthesisRateLimited,
+        project.synthesis_scheduler.SynthesisQueueFull,
+        project.upstream_resilience.UpstreamUnavailable,
+    ) as e:
+        jobs_finished.inc(outcome="deferred")
+        await prisma.models.SpeechRequest.prisma().update(
+            where={"id": job["id"]},
+            data={
+                "status": prisma.enums.ProcessStatus.PENDING,
+                "attempts": {"decrement": 1},
+                "nextAttemptAt": now + timedelta(seconds=e.retry_after),
+            },
+        )
+        return
+    except ValueError as e:
+        logger.warning("Speech job %s has invalid input: %s", job["id"], e)
+        jobs_finished.inc(outcome="failed")
+        await prisma.models.SpeechRequest.prisma().update(
+            where={"id": job["id"]},
+            data={
+                "status": prisma.enums.ProcessStatus.FAILED,
+                "processedAt": now,
+                "lastError": str(e)[:1000],
+            },
+        )
+        return
+    except Exception as e:
+        logger.exception("Speech job %s failed", job["id"])
+        retry = job["attempts"] < SPEECH_JOB_MAX_ATTEMPTS
+        jobs_finished.inc(outcome="retried" if retry else "failed")
+        data: Dict[str, Any] = {"lastError": str(e)[:1000]}
+        if retry:
+            data["status"] = prisma.enums.ProcessStatus.PENDING
+            data["nextAttemptAt"] = now + timedelta(seconds=retry_delay(job["attempts"]))
+        else:
+            data["status"] = prisma.enums.ProcessStatus.FAILED
+            data["processedAt"] = now
+        await prisma.models.SpeechRequest.prisma().update(where={"id": job["id"]}, data=data)
+        return
+    finally:
+        heartbeat.cancel()
+    jobs_finished.inc(outcome="completed")
+    await prisma.models.SpeechRequest.prisma().update(
+        where={"id": job["id"]},
+        data={
+            "status": prisma.enums.ProcessStatus.COMPLETED,
+            "processedAt": datetime.now(timezone.utc),
+            "lastError": None,
+            "speechResult": {
+                "create": project.convert_text_to_speech_service.speech_result_data(entry)
+            },
+        },
+    )
+
+
+class SpeechJobWorkers:
+    """
+    Background workers that drain the speech job queue stored in ``speech_requests``.
+
+    Each worker claims one job at a time. Idle workers sleep for SPEECH_JOB_POLL_SECONDS, or
+    until a job is submitted from this process, and finished jobs wake local long-pollers.
+    Jobs interrupted by a shutdown stay PROCESSING and are reclaimed once their lease expires;
+    idle workers fail those that were interrupted on their last attempt.
+    """
+
+    def __init__(self, count: int, poll_seconds: float):
+        self.count = count
+        self.poll_seconds = poll_seconds
+        self._tasks: List["asyncio.Task[None]"] = []
+        self._job_available = asyncio.Event()
+        self._job_finished: "weakref.WeakValueDictionary[str, asyncio.Event]" = (
+            weakref.WeakValueDictionary()
+        )
+        self._busy = 0
+
+    def notify_submitted(self) -> None:
+        self._job_available.set()
+
+    def finished_event(self, job_id: str) -> asyncio.Event:
+        """
+        Return an event set when a local worker finishes ``job_id``; held only by its waiters.
+        """
+        event = self._job_finished.get(job_id)
+        if event is None:
+            event = self._job_finished[job_id] = asyncio.Event()
+        return event
+
+    async def _idle(self) -> None:
+        try:
+            await asyncio.wait_for(self._job_available.wait(), self.poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._job_available.clear()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                job = await claim_job()
+            except Exception:
+                logger.exception("Could not claim a speech job")
+                job = None
+            if job is None:
+                try:
+                    await fail_abandoned_jobs()
+                except Exception:
+                    logger.exception("Could not fail abandoned speech jobs")
+                await self._idle()
+                continue
+            self._busy += 1
+            jobs_busy_workers.set(self._busy)
+            try:
+                await process_job(job)
+            except Exception:
+                logger.exception("Could not record the outcome of speech job %s", job["id"])
+            finally:
+                self._busy -= 1
+                jobs_busy_workers.set(self._busy)
+                event = self._job_finished.pop(job["id"], None)
+                if event is not None:
+                    event.set()
+
+    def start(self) -> None:
+        for _ in range(self.count):
+            self._tasks.append(asyncio.ensure_future(self._run()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+speech_job_workers = SpeechJobWorkers(SPEECH_JOB_WORKERS, SPEECH_JOB_POLL_SECONDS)
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import os
+from typing import Optional, Union
+
+import project.audio_dsp
+import project.convert_text_to_speech_service
+import project.mp3
+import project.synthesis_engines
+import project.synthesis_pool
+import project.synthesis_scheduler
+import project.text_chunking
+import project.upstream_resilience
+from fastapi import WebSocket, WebSocketDisconnect
+from pydantic import BaseModel
+
+SPEECH_WS_MAX_FRAGMENT_CHARS = int(os.getenv("SPEECH_WS_MAX_FRAGMENT_CHARS", "4096"))
+
+SPEECH_WS_MAX_PENDING_CHUNKS = int(os.getenv("SPEECH_WS_MAX_PENDING_CHUNKS", "8"))
+
+WS_CLOSE_NORMAL = 1000
+
+WS_CLOSE_UNSUPPORTED = 1003
+
+WS_CLOSE_POLICY_VIOLATION = 1008
+
+WS_CLOSE_TOO_BIG = 1009
+
+WS_CLOSE_INTERNAL_ERROR = 1011
+
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class SpeechStreamMessage(BaseModel):
+    """
+    A control or text message sent by the client over the speech WebSocket.
+
+    ``type`` is one of ``text`` (append ``text`` to the document), ``flush`` (synthesize
+    whatever is pending, even mid-sentence) or ``close`` (flush, then end the session).
+    """
+
+    type: str
+    text: Optional[str] = None
+
+
+class SpeechStreamProtocolError(Exception):
+    """
+    Raised when a client breaks the speech WebSocket protocol; carries the close code to use.
+    """
+
+    def __init__(self, message: str, close_code: int):
+        super().__init__(message)
+        self.close_code = close_code
+
+
+class _Flush:
+    pass
+
+
+class _Close:
+    pass
+
+
+_QueueItem = Union["asyncio.Task[bytes]", _Flush, _Close]
+
+
+async def _send_audio(websocket: WebSocket, queue: "asyncio.Queue[_QueueItem]") -> None:
+    while True:
+        item = await queue.get()
+        if isinstance(item, _Flush):
+            await websocket.send_json({"type": "flushed"})
+        elif isinstance(item, _Close):
+            await websocket.send_json({"type": "done"})
+            return
+        else:
+            audio = await item
+            await websocket.send_bytes(project.mp3.strip_to_frames(audio))
+
+
+async def _receive_text(
+    websocket: WebSocket,
+    queue: "asyncio.Queue[_QueueItem]",
+    sentences: project.text_chunking.SentenceStream,
+    fanout: asyncio.Semaphore,
+    language: str,
+    voice_preference: str,
+    speed: Optional[float],
+    pitch: Optional[float],
+    engine: str,
+    user_id: str,
+) -> None:
+    async def synthesize(chunk: str) -> bytes:
+        scheduler = project.synthesis_scheduler.synthesis_scheduler
+        async with fanout, scheduler.admit(user_id, charge=False):
+            entry = await project.convert_text_to_speech_service.synthesize_segment(
+                chunk, language, voice_preference, "TEXT", speed, pitch, engine
+            )
+        return await project.convert_text_to_speech_service.entry_audio(entry)
+
+    async def enqueue(chunks) -> None:
+        for chunk in chunks:
+            await queue.put(asyncio.ensure_future(synthesize(chunk)))
+
+    while True:
+        raw = await websocket.receive_text()
+        try:
+            message = SpeechStreamMessage(**json.loads(raw))
+        except (ValueError, TypeError):
+            # TypeError: valid JSON that is not an object, e.g. a list or a string.
+            raise SpeechStreamProtocolError(
+                "Messages must be JSON objects with a type.", WS_CLOSE_UNSUPPORTED
+            )
+        if message.type == "text":
+            fragment = message.text or ""
+            if len(fragment) > SPEECH_WS_MAX_FRAGMENT_CHARS:
+                raise SpeechStreamProtocolError(
+                    f"Text fragments may be at most {SPEECH_WS_MAX_FRAGMENT_CHARS} characters.",
+                    WS_CLOSE_TOO_BIG,
+                )
+            await enqueue(sentences.feed(fragment))
+        elif message.type == "flush":
+            await enqueue(sentences.flush())
+            await queue.put(_Flush())
+        elif message.type == "close":
+            await enqueue(sentences.flush())
+            await queue.put(_Close())
+            return
+        else:
+            raise SpeechStreamProtocolError(
+                f"Unknown message type: {message.type}", WS_CLOSE_UNSUPPORTED
+            )
+
+
+async def stream_speech_session(
+    websocket: WebSocket,
+    user_id: str,
+    language: str,
+    voice_preference: str,
+    speed: Optional[float] = None,
+    pitch: Optional[float] = None,
+    engine: Optional[str] = None,
+) -> None:
+    """
+    Serve an incremental text-in / audio-out session over an accepted WebSocket.
+
+    Text fragments are scanned for sentence boundaries as they arrive and every completed
+    sentence is synthesized straight away; its MP3 frames are sent back as binary messages in
+    reading order. Memory per connection is bounded: at most SPEECH_WS_MAX_PENDING_CHUNKS
+    sentences are queued or in flight (the client is not read from while the queue is full),
+    at most SPEECH_CHUNK_FANOUT are synthesized at once, and the unfinished sentence is capped
+    at SPEECH_CHUNK_MAX_CHARS. The engine is chosen once, so a session keeps one voice. The
+    session counts once against the plan's rate limit when it starts; each sentence then waits
+    for its own synthesis slot from the scheduler, under the user's plan.
+
+    Args:
+        websocket (WebSocket): The accepted WebSocket connection.
+        user_id (str): The authenticated user the session belongs to.
+        language (str): The language and accent desired for the speech output.
+        voice_preference (str): The user's preferred voice setting for the speech.
+        speed (Optional[float]): The rate of speech to apply to the output.
+        pitch (Optional[float]): The pitch adjustment for the speech output.
+        engine (Optional[str]): The synthesis engine to use; the configured default if None.
+    """
+    try:
+        project.audio_dsp.validate_effects(speed, pitch)
+        engine = project.synthesis_engines.select_engine(engine)
+    except ValueError as e:
+        await websocket.send_json({"type": "error", "message": str(e)})
+        await websocket.close(code=WS_CLOSE_UNSUPPORTED, reason=str(e)[:120])
+        return
+    try:
+        await project.synthesis_scheduler.synthesis_scheduler.charge(user_id)
+    except project.synthesis_scheduler.SynthesisRateLimited as e:
+        await websocket.send_json({"type": "error", "message": str(e)})
+        await websocket.close(code=WS_CLOSE_TRY_AGAIN_LATER, reason=str(e)[:120])
+        return
+    queue: "asyncio.Queue[_QueueItem]" = asyncio.Queue(maxsize=SPEECH_WS_MAX_PENDING_CHUNKS)
+    sentences = project.text_chunking.SentenceStream(
+        project.convert_text_to_speech_service.SPEECH_CHUNK_MAX_CHARS
+    )
+    fanout = asyncio.Semaphore(project.convert_text_to_speech_service.SPEECH_CHUNK_FANOUT)
+    receiver = asyncio.ensure_future(
+        _receive_text(
+            websocket,
+            queue,
+            sentences,
+            fanout,
+            language,
+            voice_preference,
+            speed,
+            pitch,
+            engine,
+            user_id,
+        )
+    )
+    sender = asyncio.ensure_future(_send_audio(websocket, queue))
+    close_code, reason = WS_CLOSE_NORMAL, ""
+    try:
+        done, _ = await asyncio.wait(
+            {receiver, sender}, return_when=asyncio.FIRST_EXCEPTION
+        )
+        for task in done:
+            task.result()
+        await sender
+    except WebSocketDisconnect:
+        return
+    except (
+        project.synthesis_pool.SynthesisPoolSaturated,
+        project.synthesis_scheduler.SynthesisQueueFull,
+        project.upstream_resilience.UpstreamUnavailable,
+    ) as e:
+        close_code, reason = WS_CLOSE_TRY_AGAIN_LATER, str(e)
+    except SpeechStreamProtocolError as e:
+        close_code, reason = e.close_code, str(e)
+    except Exception as e:
+        close_code, reason = WS_CLOSE_INTERNAL_ERROR, str(e)
+    finally:
+        receiver.cancel()
+        sender.cancel()
+        while not queue.empty():
+            item = queue.get_nowait()
+            if isinstance(item, asyncio.Task):
+                item.cancel()
+    if close_code != WS_CLOSE_NORMAL:
+        await websocket.send_json({"type": "error", "message": reason})
+    await websocket.close(code=close_code, reason=reason[:120])
@@ -0,0 +1,282 @@
+import math
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+from typing import List, NamedTuple, Optional, Tuple, Union
+
+import project.audio_dsp
+import project.text_chunking
+
+# Longest pause a single <break> may ask for.
+SSML_MAX_BREAK_SECONDS = float(os.getenv("SSML_MAX_BREAK_SECONDS", "10"))
+
+# Pause inserted after every <p> paragraph.
+SSML_PARAGRAPH_PAUSE_SECONDS = float(os.getenv("SSML_PARAGRAPH_PAUSE_SECONDS", "0.5"))
+
+BREAK_STRENGTHS = {
+    "none": 0.0,
+    "x-weak": 0.1,
+    "weak": 0.25,
+    "medium": 0.4,
+    "strong": 0.75,
+    "x-strong": 1.2,
+}
+
+RATES = {"x-slow": 0.5, "slow": 0.75, "medium": 1.0, "default": 1.0, "fast": 1.25, "x-fast": 1.75}
+
+# In semitones.
+PITCHES = {"x-low": -6.0, "low": -3.0, "medium": 0.0, "default": 0.0, "high": 3.0, "x-high": 6.0}
+
+_TIME = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ms|s)\s*$")
+
+_PERCENT = re.compile(r"^\s*([+-]?\d+(?:\.\d+)?)\s*%\s*$")
+
+_SEMITONES = re.compile(r"^\s*([+-]?\d+(?:\.\d+)?)\s*st\s*$")
+
+
+class Speech(NamedTuple):
+    """
+    A run of plain text to synthesize, with the prosody it is spoken with.
+    """
+
+    text: str
+    rate: float = 1.0
+    pitch: float = 0.0
+
+    def effects(
+        self, speed: Optional[float], pitch: Optional[float]
+    ) -> Tuple[Optional[float], Optional[float]]:
+        """
+        Combine the run's prosody with a request's speed and pitch, within the DSP's range.
+
+        Runs without prosody keep the request's values as given, so they share cache entries
+        with plain-text conversions of the same text.
+        """
+        if self.rate != 1.0:
+            speed = min(
+                max((speed or 1.0) * self.rate, project.audio_dsp.MIN_SPEED),
+                project.audio_dsp.MAX_SPEED,
+            )
+        if self.pitch != 0.0:
+            pitch = min(
+                max((pitch or 0.0) + self.pitch, project.audio_dsp.MIN_PITCH),
+                project.audio_dsp.MAX_PITCH,
+            )
+        return speed, pitch
+
+
+class Pause(NamedTuple):
+    """
+    Silence of a given length, rendered without calling the synthesis engine.
+    """
+
+    seconds: float
+
+
+Segment = Union[Speech, Pause]
+
+
+def break_seconds(element: ElementTree.Element) -> float:
+    """
+    The length of a ``<break>``, from its ``time`` or else its ``strength``.
+
+    Raises:
+        ValueError: If either attribute has a value SSML does not define.
+    """
+    time = element.get("time")
+    if time is not None:
+        match = _TIME.match(time)
+        if match is None:
+            raise ValueError(f"Invalid SSML break time: {time}")
+        seconds = float(match.group(1)) / (1000 if match.group(2) == "ms" else 1)
+        return min(seconds, SSML_MAX_BREAK_SECONDS)
+    strength = element.get("strength", "medium")
+    if strength not in BREAK_STRENGTHS:
+        raise ValueError(f"Invalid SSML break strength: {strength}")
+    return BREAK_STRENGTHS[strength]
+
+
+def prosody_rate(value: str) -> float:
+    """
+    A ``<prosody rate>`` as a speed factor: a keyword, a percentage or a plain number.
+
+    An unsigned percentage is of the default rate (``"80%"`` is 0.8); a signed one changes it
+    (``"+20%"`` is 1.2 and ``"-10%"`` is 0.9).
+    """
+    if value in RATES:
+        return RATES[value]
+    match = _PERCENT.match(value)
+    try:
+        if match is None:
+            rate = float(value)
+        elif match.group(1)[0] in "+-":
+            rate = 1 + float(match.group(1)) / 100
+        else:
+            rate = float(match.group(1)) / 100
+    except ValueError:
+        raise ValueError(f"Invalid SSML prosody rate: {value}")
+    if rate <= 0:
+        raise ValueError(f"Invalid SSML prosody rate: {value}")
+    return rate
+
+
+def prosody_pitch(value: str) -> float:
+    """
+    A ``<prosody pitch>`` in semitones: a keyword, a semitone offset or a relative percentage.
+    """
+    if value in PITCHES:
+        return PITCHES[value]
+    match = _SEMITONES.match(value)
+    if match:
+        return float(match.group(1))
+    match = _PERCENT.match(value)
+    if match and float(match.group(1)) > -100:
+        return 12 * math.log2(1 + float(match.group(1)) / 100)
+    raise ValueError(f"Invalid SSML prosody pitch: {value}")
+
+
+class SsmlSegmenter:
+    """
+    Incremental SSML parser that turns a document into speech runs and pauses.
+
+    The document is fed in any number of pieces, and every call returns the segments that
+    became complete. Markup is never sent to the engine: text runs come out as plain text, cut
+    into sentences of at most ``max_chars``; ``<break>`` and the end of each ``<p>`` become
+    Pause segments; ``<prosody rate pitch>`` sets the rate and pitch of the runs inside it,
+    multiplying and adding up when nested; ``<sub alias>`` speaks its alias. Other elements,
+    such as ``<emphasis>`` or ``<say-as>``, are read as their text.
+    """
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self._parser = ElementTree.XMLPullParser(events=("start", "end"))
+        self._prosody: List[Tuple[float, float]] = [(1.0, 0.0)]
+        self._run: List[str] = []
+        self._run_prosody = self._prosody[-1]
+        self._pending: Optional[Tuple[ElementTree.Element, str]] = None
+        self._substituted = 0
+        self._segments: List[Segment] = []
+
+    def feed(self, data: str) -> List[Segment]:
+        """
+        Parse the next piece of the document.
+
+        Raises:
+            ValueError: If the document is not well-formed or uses invalid attribute values.
+        """
+        try:
+            self._parser.feed(data)
+            self._handle_events()
+        except ElementTree.ParseError as e:
+            raise ValueError(f"Invalid SSML: {e}")
+        return self._take()
+
+    def close(self) -> List[Segment]:
+        """
+        Finish the document and return its last segments.
+
+        Raises:
+            ValueError: If the document is incomplete.
+        """
+        try:
+            self._parser.close()
+            self._handle_events()
+        except ElementTree.ParseError as e:
+            raise ValueError(f"Invalid SSML: {e}")
+        self._take_pending_text()
+        self._end_run()
+        return self._take(final=True)
+
+    def _take(self, final: bool = False) -> List[Segment]:
+        # A trailing pause is held back, since the next piece may start with another break.
+        held = not final and self._segments and isinstance(self._segments[-1], Pause)
+        segments = self._segments[:-1] if held else self._segments
+        self._segments = self._segments[-1:] if held else []
+        return segments
+
+    def _handle_events(self) -> None:
+        for event, element in self._parser.read_events():
+            # The text before this event, held by the previous element, is now complete.
+            self._take_pending_text()
+            tag = element.tag.rsplit("}", 1)[-1]
+            if event == "start":
+                self._start(tag, element)
+                self._pending = (element, "text")
+            else:
+                self._end(tag)
+                self._pending = (element, "tail")
+
+    def _take_pending_text(self) -> None:
+        if self._pending is None:
+            return
+        element, attribute = self._pending
+        self._pending = None
+        text = getattr(element, attribute)
+        if attribute == "tail":
+            # Nothing reads a finished element again, so drop what it holds.
+            element.clear()
+        if text and not self._substituted:
+            self._add_text(text)
+
+    def _start(self, tag: str, element: ElementTree.Element) -> None:
+        if tag == "break":
+            self._pause(break_seconds(element))
+        elif tag == "prosody":
+            rate, pitch = self._prosody[-1]
+            if element.get("rate") is not None:
+                rate *= prosody_rate(element.get("rate"))
+            if element.get("pitch") is not None:
+                pitch += prosody_pitch(element.get("pitch"))
+            self._prosody.append((rate, pitch))
+        elif tag in ("p", "s"):
+            self._end_run()
+        elif tag == "sub":
+            if not self._substituted:
+                self._add_text(f" {element.get('alias', '')} ")
+            self._substituted += 1
+
+    def _end(self, tag: str) -> None:
+        if tag == "prosody":
+            self._prosody.pop()
+        elif tag == "p":
+            self._pause(SSML_PARAGRAPH_PAUSE_SECONDS)
+        elif tag == "s":
+            self._end_run()
+        elif tag == "sub":
+            self._substituted -= 1
+
+    def _add_text(self, text: str) -> None:
+        if self._prosody[-1] != self._run_prosody:
+            self._end_run()
+            self._run_prosody = self._prosody[-1]
+        self._run.append(text)
+
+    def _end_run(self) -> None:
+        text = " ".join("".join(self._run).split())
+        self._run = []
+        if not text:
+            return
+        rate, pitch = self._run_prosody
+        for chunk in project.text_chunking.split_sentences(text, self.max_chars):
+            self._segments.append(Speech(chunk, rate, pitch))
+
+    def _pause(self, seconds: float) -> None:
+        self._end_run()
+        if seconds <= 0:
+            return
+        if self._segments and isinstance(self._segments[-1], Pause):
+            seconds = min(self._segments[-1].seconds + seconds, SSML_MAX_BREAK_SECONDS)
+            self._segments[-1] = Pause(seconds)
+        else:
+            self._segments.append(Pause(seconds))
+
+
+def segment(document: str, max_chars: int) -> List[Segment]:
+    """
+    Split a whole SSML document into speech runs and pauses.
+
+    Raises:
+        ValueError: If the document is not valid SSML.
+    """
+    segmenter = SsmlSegmenter(max_chars)
+    return segmenter.feed(document) + segmenter.close()
@@ -0,0 +1,79 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+import project.metrics
+
+QUEUE_WAIT = "queue_wait"
+SYNTHESIS = "synthesis"
+POST_PROCESSING = "post_processing"
+STORAGE = "storage"
+DB = "db"
+
+STAGE_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+stage_time = project.metrics.histogram(
+    "tts_stage_seconds",
+    "Time spent in each stage of handling a request: queue_wait, synthesis, post_processing, "
+    "storage or db.",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+
+# Per-request totals, shared with the tasks a request starts since they copy its context.
+_request_stages: "contextvars.ContextVar[Optional[Dict[str, float]]]" = contextvars.ContextVar(
+    "request_stages", default=None
+)
+
+
+def record(stage: str, seconds: float) -> None:
+    """
+    Account ``seconds`` to ``stage``, for the histogram and for the current request.
+    """
+    stage_time.observe(seconds, stage=stage)
+    totals = _request_stages.get()
+    if totals is not None:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Time the enclosed block, awaits included, as one occurrence of ``stage``.
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started_at)
+
+
+def start_request() -> Dict[str, float]:
+    """
+    Collect the stage times of everything that runs in the current context from now on.
+
+    Stages of concurrent chunks add up, so a request's totals can exceed its duration.
+
+    Returns:
+        Dict[str, float]: Seconds per stage, filled in as the request runs.
+    """
+    totals: Dict[str, float] = {}
+    _request_stages.set(totals)
+    return totals
@@ -0,0 +1,62 @@
+from typing import Optional
+
+import prisma
+import prisma.enums
+import prisma.models
+import project.convert_text_to_speech_service
+import project.speech_job_queue
+import project.stage_timing
+from pydantic import BaseModel
+
+
+class SubmitSpeechJobResponse(BaseModel):
+    """
+    Acknowledges an asynchronous conversion request with the id to poll for its result.
+    """
+
+    job_id: str
+    status: str
+
+
+async def submit_speech_job(
+    user_id: str,
+    text: str,
+    language: str,
+    voice_preference: str,
+    input_format: str,
+    speed: Optional[float] = None,
+    pitch: Optional[float] = None,
+) -> SubmitSpeechJobResponse:
+    """
+    Queue a text-to-speech conversion to be processed in the background
+
+    Args:
+    user_id (str): Unique identifier for the user making the request.
+    text (str): The text content to be converted into speech.
+    language (str): The language and accent desired for the speech output.
+    voice_preference (str): The user's preferred voice setting for the speech.
+    input_format (str): The format of the input text, plain text or SSML.
+    speed (Optional[float]): The rate of speech to apply to the output.
+    pitch (Optional[float]): The pitch adjustment for the speech output.
+
+    Returns:
+    SubmitSpeechJobResponse: Acknowledges an asynchronous conversion request with the id to poll for its result.
+    """
+    data = project.convert_text_to_speech_service.speech_request_data(
+        user_id,
+        text,
+        language,
+        voice_preference,
+        input_format,
+        speed,
+        pitch,
+        prisma.enums.ProcessStatus.PENDING,
+    )
+    with project.stage_timing.span(project.stage_timing.DB):
+        speech_request = await prisma.models.SpeechRequest.prisma().create(
+            data={**data, "user": {"connect": {"id": user_id}}}
+        )
+    project.speech_job_queue.speech_job_workers.notify_submitted()
+    return SubmitSpeechJobResponse(
+        job_id=speech_request.id, status=speech_request.status
+    )
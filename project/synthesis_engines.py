@@ -0,0 +1,393 @@
+import base64
+import io
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+import wave
+from typing import Dict, Optional, Tuple
+
+import httpx
+import numpy as np
+import project.audio_dsp
+import project.metrics
+import project.synthesis_pool
+import project.upstream_http
+import project.upstream_resilience
+from gtts import gTTS, gTTSError
+
+SYNTHESIS_ENGINE = os.getenv("SYNTHESIS_ENGINE", "gtts")
+
+# Engine that takes requests which did not name one while SYNTHESIS_ENGINE is slow; empty
+# disables overflow routing.
+SYNTHESIS_OVERFLOW_ENGINE = os.getenv("SYNTHESIS_OVERFLOW_ENGINE", "")
+
+SYNTHESIS_OVERFLOW_LATENCY_SECONDS = float(
+    os.getenv("SYNTHESIS_OVERFLOW_LATENCY_SECONDS", "2.0")
+)
+
+LOCAL_TTS_COMMAND = os.getenv("LOCAL_TTS_COMMAND", "espeak-ng")
+
+LOCAL_TTS_TIMEOUT_SECONDS = float(os.getenv("LOCAL_TTS_TIMEOUT_SECONDS", "30"))
+
+FAKE_TTS_LATENCY_SECONDS = float(os.getenv("FAKE_TTS_LATENCY_SECONDS", "0.3"))
+
+FAKE_TTS_JITTER_SECONDS = float(os.getenv("FAKE_TTS_JITTER_SECONDS", "0.1"))
+
+FAKE_TTS_FAILURE_RATE = float(os.getenv("FAKE_TTS_FAILURE_RATE", "0.0"))
+
+FAKE_TTS_SEED = int(os.getenv("FAKE_TTS_SEED", "0"))
+
+# Fraction of fake calls that take FAKE_TTS_TAIL_SECONDS instead, to exercise hedging.
+FAKE_TTS_TAIL_RATE = float(os.getenv("FAKE_TTS_TAIL_RATE", "0.0"))
+
+FAKE_TTS_TAIL_SECONDS = float(os.getenv("FAKE_TTS_TAIL_SECONDS", "3.0"))
+
+SYNTHESIS_DEADLINE_SECONDS = float(os.getenv("SYNTHESIS_DEADLINE_SECONDS", "20"))
+
+SYNTHESIS_RETRIES = int(os.getenv("SYNTHESIS_RETRIES", "2"))
+
+SYNTHESIS_RETRY_BACKOFF_SECONDS = float(os.getenv("SYNTHESIS_RETRY_BACKOFF_SECONDS", "0.25"))
+
+# Latency percentile after which a duplicate request is fired; 0 disables hedging.
+SYNTHESIS_HEDGE_PERCENTILE = float(os.getenv("SYNTHESIS_HEDGE_PERCENTILE", "95"))
+
+SYNTHESIS_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("SYNTHESIS_HEDGE_MIN_DELAY_SECONDS", "0.5"))
+
+SYNTHESIS_HEDGE_BUDGET = float(os.getenv("SYNTHESIS_HEDGE_BUDGET", "0.1"))
+
+SYNTHESIS_BREAKER_WINDOW_SECONDS = float(os.getenv("SYNTHESIS_BREAKER_WINDOW_SECONDS", "30"))
+
+SYNTHESIS_BREAKER_MIN_REQUESTS = int(os.getenv("SYNTHESIS_BREAKER_MIN_REQUESTS", "20"))
+
+SYNTHESIS_BREAKER_ERROR_RATE = float(os.getenv("SYNTHESIS_BREAKER_ERROR_RATE", "0.5"))
+
+SYNTHESIS_BREAKER_OPEN_SECONDS = float(os.getenv("SYNTHESIS_BREAKER_OPEN_SECONDS", "30"))
+
+# Weight of the newest observation in each engine's moving latency average.
+_LATENCY_SMOOTHING = 0.2
+
+# While overflowing, one request per interval still goes to the default engine so its latency
+# average can recover.
+_OVERFLOW_PROBE_SECONDS = 5.0
+
+engine_seconds = project.metrics.histogram(
+    "tts_synthesis_engine_seconds",
+    "Time an engine took to synthesize one segment.",
+    ["engine"],
+)
+
+engine_failures = project.metrics.counter(
+    "tts_synthesis_engine_failures", "Segments an engine failed to synthesize.", ["engine"]
+)
+
+engine_overflow = project.metrics.counter(
+    "tts_synthesis_engine_overflow",
+    "Requests routed to the overflow engine because the default engine was slow or failing.",
+)
+
+
+class SynthesisEngineError(Exception):
+    """
+    Raised when an engine could not synthesize a segment.
+    """
+
+
+class SynthesisEngine:
+    """
+    Turns one piece of text into MP3 audio.
+
+    ``synthesize`` blocks and runs on a synthesis pool worker, possibly in another process,
+    so engines are looked up by name there rather than passed around.
+    """
+
+    name = ""
+
+    def synthesize(self, text: str, language: str, voice_preference: str) -> bytes:
+        raise NotImplementedError
+
+
+class GTTSEngine(SynthesisEngine):
+    """
+    Google Translate's text-to-speech endpoint, through gTTS.
+
+    gTTS builds the requests (one per ~100-character part of the text), but they are sent over
+    the process-wide keep-alive pool in project.upstream_http instead of a fresh connection
+    per part, and the audio is pulled out of the responses the way gTTS does it. This relies on
+    gTTS internals, so gTTS is pinned to an exact version and a test checks that the engine
+    still sends the same requests and returns the same audio as ``gTTS.stream``.
+    """
+
+    name = "gtts"
+
+    AUDIO_PATTERN = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+    def synthesize(self, text: str, language: str, voice_preference: str) -> bytes:
+        tts = gTTS(text=text, lang=language)
+        parts = []
+        for request in tts._prepare_requests():
+            try:
+                response = project.upstream_http.upstream_session.post(
+                    request.url, content=request.body, headers=dict(request.headers)
+                )
+            except httpx.HTTPError as e:
+                raise gTTSError(f"Failed to connect to the gTTS upstream: {e}") from e
+            if response.is_error:
+                raise gTTSError(
+                    f"The gTTS upstream answered {response.status_code} {response.reason_phrase}"
+                )
+            for line in response.text.splitlines():
+                if "jQ1olc" not in line:
+                    continue
+                match = self.AUDIO_PATTERN.search(line)
+                if match is None:
+                    raise gTTSError("The gTTS upstream answered without audio")
+                parts.append(base64.b64decode(match.group(1)))
+        return b"".join(parts)
+
+
+class LocalEngine(SynthesisEngine):
+    """
+    Offline synthesis with eSpeak NG, run as a subprocess; needs no network access.
+
+    ``voice_preference`` values ``male`` and ``female`` pick an eSpeak voice variant.
+    """
+
+    name = "local"
+
+    VARIANTS = {"male": "+m3", "female": "+f3"}
+
+    def synthesize(self, text: str, language: str, voice_preference: str) -> bytes:
+        voice = language + self.VARIANTS.get(voice_preference.strip().lower(), "")
+        try:
+            completed = subprocess.run(
+                [LOCAL_TTS_COMMAND, "--stdout", "-v", voice],
+                input=text.encode("utf-8"),
+                capture_output=True,
+                timeout=LOCAL_TTS_TIMEOUT_SECONDS,
+                check=True,
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            raise SynthesisEngineError(f"{LOCAL_TTS_COMMAND} failed: {e}") from e
+        with wave.open(io.BytesIO(completed.stdout)) as speech:
+            sample_rate = speech.getframerate()
+            samples = np.frombuffer(speech.readframes(speech.getnframes()), dtype="<i2")
+        return project.audio_dsp.encode_mp3([samples / 32768.0], sample_rate)
+
+
+class FakeEngine(SynthesisEngine):
+    """
+    A deterministic stand-in for gTTS for load tests and benchmarks.
+
+    It sleeps for a seeded, jittered latency (occasionally a much longer tail latency), fails a
+    seeded fraction of calls, and returns silent MP3 in the format gTTS produces (24 kHz mono,
+    32 kbit/s) lasting about as long as the text would take to read. With the same seed, the
+    same sequence of calls sees the same latencies and failures.
+    """
+
+    name = "fake"
+
+    # MPEG-2 layer III, 32 kbit/s, 24 kHz, mono; zeroed side info decodes as silence.
+    FRAME = bytes([0xFF, 0xF3, 0x44, 0xC4]) + bytes(92)
+
+    FRAME_SECONDS = 576 / 24000
+
+    SECONDS_PER_CHARACTER = 0.065
+
+    def __init__(
+        self,
+        latency: float,
+        jitter: float,
+        failure_rate: float,
+        seed: int,
+        tail_rate: float = 0.0,
+        tail_latency: float = 0.0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self) -> Tuple[float, bool]:
+        with self._lock:
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+            if self._random.random() < self.tail_rate:
+                delay = self.tail_latency
+            return max(delay, 0.0), self._random.random() < self.failure_rate
+
+    def synthesize(self, text: str, language: str, voice_preference: str) -> bytes:
+        delay, fail = self._draw()
+        time.sleep(delay)
+        if fail:
+            raise SynthesisEngineError("Simulated upstream failure.")
+        frames = max(1, round(len(text) * self.SECONDS_PER_CHARACTER / self.FRAME_SECONDS))
+        return self.FRAME * frames
+
+
+ENGINES: Dict[str, SynthesisEngine] = {
+    engine.name: engine
+    for engine in (
+        GTTSEngine(),
+        LocalEngine(),
+        FakeEngine(
+            FAKE_TTS_LATENCY_SECONDS,
+            FAKE_TTS_JITTER_SECONDS,
+            FAKE_TTS_FAILURE_RATE,
+            FAKE_TTS_SEED,
+            FAKE_TTS_TAIL_RATE,
+            FAKE_TTS_TAIL_SECONDS,
+        ),
+    )
+}
+
+UPSTREAMS: Dict[str, project.upstream_resilience.ResilientUpstream] = {
+    name: project.upstream_resilience.ResilientUpstream(
+        name,
+        project.upstream_resilience.CircuitBreaker(
+            name,
+            SYNTHESIS_BREAKER_WINDOW_SECONDS,
+            SYNTHESIS_BREAKER_MIN_REQUESTS,
+            SYNTHESIS_BREAKER_ERROR_RATE,
+            SYNTHESIS_BREAKER_OPEN_SECONDS,
+        ),
+        SYNTHESIS_RETRIES,
+        SYNTHESIS_RETRY_BACKOFF_SECONDS,
+        SYNTHESIS_DEADLINE_SECONDS,
+        SYNTHESIS_HEDGE_PERCENTILE,
+        SYNTHESIS_HEDGE_MIN_DELAY_SECONDS,
+        SYNTHESIS_HEDGE_BUDGET,
+    )
+    for name in ENGINES
+}
+
+_latency: Dict[str, float] = {}
+
+_probed_at: Dict[str, float] = {}
+
+
+def get_engine(name: str) -> SynthesisEngine:
+    """
+    Look up an engine by name.
+
+    Raises:
+        ValueError: If no engine has this name.
+    """
+    try:
+        return ENGINES[name.strip().lower()]
+    except KeyError:
+        raise ValueError(
+            f"Unknown synthesis engine {name!r}; expected one of {', '.join(ENGINES)}."
+        )
+
+
+def select_engine(requested: Optional[str] = None) -> str:
+    """
+    Choose the engine for a request.
+
+    An explicitly requested engine is always used. Otherwise SYNTHESIS_ENGINE is used, unless
+    an overflow engine is configured and the default engine's circuit breaker is open, or its
+    moving average latency is above SYNTHESIS_OVERFLOW_LATENCY_SECONDS; in the latter case one
+    request every few seconds is still sent to the default engine to see whether it recovered.
+
+    Args:
+        requested (Optional[str]): The engine named by the request, if any.
+
+    Returns:
+        str: The engine's name.
+
+    Raises:
+        ValueError: If the requested engine does not exist.
+    """
+    if requested:
+        return get_engine(requested).name
+    default = get_engine(SYNTHESIS_ENGINE).name
+    breaker = UPSTREAMS[default].breaker
+    if SYNTHESIS_OVERFLOW_ENGINE and breaker.state == breaker.OPEN:
+        project.upstream_resilience.breaker_rejections.inc(upstream=default, action="reroute")
+        engine_overflow.inc()
+        return get_engine(SYNTHESIS_OVERFLOW_ENGINE).name
+    if (
+        not SYNTHESIS_OVERFLOW_ENGINE
+        or _latency.get(default, 0.0) <= SYNTHESIS_OVERFLOW_LATENCY_SECONDS
+    ):
+        return default
+    now = time.monotonic()
+    if now - _probed_at.get(default, 0.0) >= _OVERFLOW_PROBE_SECONDS:
+        _probed_at[default] = now
+        return default
+    engine_overflow.inc()
+    return get_engine(SYNTHESIS_OVERFLOW_ENGINE).name
+
+
+def _synthesize_timed(
+    name: str, text: str, language: str, voice_preference: str
+) -> Tuple[bytes, float]:
+    started = time.perf_counter()
+    audio = ENGINES[name].synthesize(text, language, voice_preference)
+    return audio, time.perf_counter() - started
+
+
+def _retryable(error: BaseException) -> bool:
+    return not isinstance(error, (ValueError, project.synthesis_pool.SynthesisPoolSaturated))
+
+
+async def synthesize(name: str, text: str, language: str, voice_preference: str) -> bytes:
+    """
+    Synthesize one segment with the named engine on the synthesis pool.
+
+    The call goes through the engine's ResilientUpstream: it is retried, hedged and bounded
+    by SYNTHESIS_DEADLINE_SECONDS, and shed while the engine's circuit breaker is open.
+
+    Args:
+        name (str): An engine name returned by select_engine.
+        text (str): The text content to be converted into speech.
+        language (str): The language and accent desired for the speech output.
+        voice_preference (str): The user's preferred voice setting for the speech.
+
+    Returns:
+        bytes: The MP3 audio.
+
+    Raises:
+        SynthesisPoolSaturated: If the synthesis pool cannot accept more work right now.
+        UpstreamUnavailable: If the engine's circuit breaker is open.
+        UpstreamDeadlineExceeded: If the engine did not answer within the deadline.
+        SynthesisEngineError: If every attempt failed.
+        ValueError: If the engine rejected the request itself, e.g. an unsupported language.
+    """
+
+    async def attempt() -> bytes:
+        try:
+            audio, elapsed = await project.synthesis_pool.synthesis_pool.run(
+                _synthesize_timed, name, text, language, voice_preference
+            )
+        except project.synthesis_pool.SynthesisPoolSaturated:
+            raise
+        except Exception:
+            engine_failures.inc(engine=name)
+            raise
+        engine_seconds.observe(elapsed, engine=name)
+        previous = _latency.get(name)
+        _latency[name] = (
+            elapsed
+            if previous is None
+            else previous + _LATENCY_SMOOTHING * (elapsed - previous)
+        )
+        return audio
+
+    try:
+        return await UPSTREAMS[name].call(attempt, _retryable)
+    except (
+        ValueError,
+        SynthesisEngineError,
+        project.synthesis_pool.SynthesisPoolSaturated,
+        project.upstream_resilience.UpstreamUnavailable,
+        project.upstream_resilience.UpstreamDeadlineExceeded,
+    ):
+        raise
+    except Exception as e:
+        raise SynthesisEngineError(f"The {name} engine failed: {e}") from e
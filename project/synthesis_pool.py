@@ -0,0 +1,147 @@
+import asyncio
+import math
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import project.metrics
+import project.stage_timing
+
+SYNTHESIS_POOL_KIND = os.getenv("SYNTHESIS_POOL_KIND", "thread")
+
+SYNTHESIS_MAX_WORKERS = int(os.getenv("SYNTHESIS_MAX_WORKERS", "4"))
+
+SYNTHESIS_MAX_QUEUE = int(os.getenv("SYNTHESIS_MAX_QUEUE", "32"))
+
+SYNTHESIS_MIN_RETRY_AFTER_SECONDS = 1
+
+pool_in_flight = project.metrics.gauge(
+    "tts_synthesis_pool_in_flight", "Synthesis jobs currently running on a worker."
+)
+
+pool_queued = project.metrics.gauge(
+    "tts_synthesis_pool_queued", "Synthesis jobs waiting for a free worker."
+)
+
+pool_capacity = project.metrics.gauge(
+    "tts_synthesis_pool_capacity", "Configured synthesis workers and wait-queue slots.", ["slot"]
+)
+
+pool_rejected = project.metrics.counter(
+    "tts_synthesis_pool_rejected", "Synthesis jobs rejected because the wait queue was full."
+)
+
+pool_queue_wait = project.metrics.histogram(
+    "tts_synthesis_pool_queue_wait_seconds", "Time a synthesis job waited for a worker."
+)
+
+pool_run_time = project.metrics.histogram(
+    "tts_synthesis_pool_run_seconds", "Time a synthesis job spent running on a worker."
+)
+
+
+class SynthesisPoolSaturated(Exception):
+    """
+    Raised when every synthesis worker is busy and the wait queue is full.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(
+            f"Speech synthesis is at capacity, retry in {retry_after} seconds."
+        )
+        self.retry_after = retry_after
+
+
+class SynthesisPool:
+    """
+    Runs blocking synthesis calls on a thread or process pool so they never block the event loop.
+
+    At most ``max_workers`` jobs run at once and at most ``max_queue`` further jobs wait for a
+    worker; anything beyond that is rejected straight away with SynthesisPoolSaturated.
+    """
+
+    def __init__(self, kind: str, max_workers: int, max_queue: int):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown synthesis pool kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        self._queued = 0
+        self._avg_run_time = 0.0
+        pool_capacity.set(max_workers, slot="workers")
+        pool_capacity.set(max_queue, slot="queue")
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="synthesis"
+                )
+        return self._executor
+
+    def _retry_after(self) -> int:
+        backlog = self._queued + self._in_flight
+        estimate = backlog * self._avg_run_time / max(self.max_workers, 1)
+        return max(SYNTHESIS_MIN_RETRY_AFTER_SECONDS, math.ceil(estimate))
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run ``fn(*args)`` on a pool worker once a slot is free.
+
+        Args:
+            fn (Callable): The blocking function to run. Must be picklable for a process pool.
+            *args: Positional arguments passed to ``fn``.
+
+        Returns:
+            Any: Whatever ``fn`` returns.
+
+        Raises:
+            SynthesisPoolSaturated: If all workers are busy and the wait queue is full.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        if self._slots.locked() and self._queued >= self.max_queue:
+            pool_rejected.inc()
+            raise SynthesisPoolSaturated(self._retry_after())
+        self._queued += 1
+        pool_queued.set(self._queued)
+        enqueued_at = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self._queued -= 1
+            pool_queued.set(self._queued)
+        started_at = time.perf_counter()
+        pool_queue_wait.observe(started_at - enqueued_at)
+        project.stage_timing.record(project.stage_timing.QUEUE_WAIT, started_at - enqueued_at)
+        self._in_flight += 1
+        pool_in_flight.set(self._in_flight)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            run_time = time.perf_counter() - started_at
+            pool_run_time.observe(run_time)
+            self._avg_run_time = 0.8 * self._avg_run_time + 0.2 * run_time
+            self._in_flight -= 1
+            pool_in_flight.set(self._in_flight)
+            self._slots.release()
+
+    def shutdown(self) -> None:
+        """
+        Stop the underlying executor, waiting for running jobs to finish.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+synthesis_pool = SynthesisPool(
+    SYNTHESIS_POOL_KIND, SYNTHESIS_MAX_WORKERS, SYNTHESIS_MAX_QUEUE
+)
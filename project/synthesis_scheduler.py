@@ -0,0 +1,424 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, NamedTuple, Optional, Tuple
+
+import prisma.enums
+import prisma.models
+import project.metrics
+import project.stage_timing
+
+PLANS = [plan.value for plan in prisma.enums.SubscriptionPlan]
+
+# Users without an active subscription are scheduled as this plan.
+DEFAULT_PLAN = prisma.enums.SubscriptionPlan.FREE.value
+
+
+def plan_settings(name: str, default: str) -> Dict[str, float]:
+    """
+    Read a per-plan setting written as ``PLAN=value,PLAN=value``.
+
+    Plans missing from the environment variable keep their value from ``default``.
+    """
+    settings: Dict[str, float] = {}
+    for source in (default, os.getenv(name, "")):
+        for pair in source.split(","):
+            plan, _, value = pair.partition("=")
+            if value.strip():
+                settings[plan.strip().upper()] = float(value)
+    return settings
+
+
+SYNTHESIS_SCHEDULER_MAX_CONCURRENCY = int(os.getenv("SYNTHESIS_SCHEDULER_MAX_CONCURRENCY", "16"))
+
+# Share of the contended slots each plan gets while several plans are waiting.
+SYNTHESIS_PLAN_WEIGHTS = plan_settings("SYNTHESIS_PLAN_WEIGHTS", "FREE=1,BASIC=2,PREMIUM=4")
+
+# Conversions each user may start per second, and how many may be started in one burst.
+# A rate of 0 disables rate limiting for that plan.
+SYNTHESIS_PLAN_RATES = plan_settings("SYNTHESIS_PLAN_RATES", "FREE=0.5,BASIC=2,PREMIUM=10")
+
+SYNTHESIS_PLAN_BURSTS = plan_settings("SYNTHESIS_PLAN_BURSTS", "FREE=5,BASIC=20,PREMIUM=50")
+
+# Conversions all users of a plan may run at once, and may have waiting for a slot.
+SYNTHESIS_PLAN_CONCURRENCY = plan_settings(
+    "SYNTHESIS_PLAN_CONCURRENCY", "FREE=4,BASIC=8,PREMIUM=16"
+)
+
+SYNTHESIS_PLAN_MAX_QUEUE = plan_settings("SYNTHESIS_PLAN_MAX_QUEUE", "FREE=16,BASIC=32,PREMIUM=64")
+
+SUBSCRIPTION_PLAN_CACHE_TTL_SECONDS = float(
+    os.getenv("SUBSCRIPTION_PLAN_CACHE_TTL_SECONDS", "300")
+)
+
+SUBSCRIPTION_PLAN_CACHE_MAX_ENTRIES = int(os.getenv("SUBSCRIPTION_PLAN_CACHE_MAX_ENTRIES", "10000"))
+
+SCHEDULER_MIN_RETRY_AFTER_SECONDS = 1
+
+queue_depth = project.metrics.gauge(
+    "tts_scheduler_queue_depth", "Conversions waiting for a synthesis slot.", ["plan"]
+)
+
+in_flight = project.metrics.gauge(
+    "tts_scheduler_in_flight", "Conversions holding a synthesis slot.", ["plan"]
+)
+
+queue_wait = project.metrics.histogram(
+    "tts_scheduler_queue_wait_seconds",
+    "Time a conversion waited for a synthesis slot, zero when admitted straight away.",
+    ["plan"],
+)
+
+hold_time = project.metrics.histogram(
+    "tts_scheduler_hold_seconds", "Time a conversion held its synthesis slot.", ["plan"]
+)
+
+admitted = project.metrics.counter(
+    "tts_scheduler_admitted", "Conversions granted a synthesis slot.", ["plan"]
+)
+
+rejected = project.metrics.counter(
+    "tts_scheduler_rejected",
+    "Conversions refused admission, by plan and by whether the user's rate limit or the plan's "
+    "queue was exhausted.",
+    ["plan", "reason"],
+)
+
+plan_lookups = project.metrics.counter(
+    "tts_subscription_plan_lookups",
+    "Subscription plan lookups, by whether they were served from the cache.",
+    ["result"],
+)
+
+
+class SynthesisRateLimited(Exception):
+    """
+    Raised when a user has started more conversions than their plan's rate allows.
+    """
+
+    def __init__(self, plan: str, retry_after: int):
+        super().__init__(
+            f"The {plan} plan's conversion rate is exhausted, retry in {retry_after} seconds."
+        )
+        self.plan = plan
+        self.retry_after = retry_after
+
+
+class SynthesisQueueFull(Exception):
+    """
+    Raised when a plan already has as many conversions waiting as its queue allows.
+    """
+
+    def __init__(self, plan: str, retry_after: int):
+        super().__init__(
+            f"Speech synthesis is at capacity for the {plan} plan, retry in {retry_after} seconds."
+        )
+        self.plan = plan
+        self.retry_after = retry_after
+
+
+class PlanPolicy(NamedTuple):
+    weight: float
+    rate: float
+    burst: float
+    max_concurrency: int
+    max_queue: int
+
+
+def configured_policies() -> Dict[str, PlanPolicy]:
+    return {
+        plan: PlanPolicy(
+            weight=SYNTHESIS_PLAN_WEIGHTS[plan],
+            rate=SYNTHESIS_PLAN_RATES[plan],
+            burst=SYNTHESIS_PLAN_BURSTS[plan],
+            max_concurrency=int(SYNTHESIS_PLAN_CONCURRENCY[plan]),
+            max_queue=int(SYNTHESIS_PLAN_MAX_QUEUE[plan]),
+        )
+        for plan in PLANS
+    }
+
+
+class SubscriptionPlanCache:
+    """
+    Read-through cache of each user's subscription plan, bounded by TTL and size.
+
+    A user's plan is that of their most recent ACTIVE subscription, or DEFAULT_PLAN if they
+    have none. Plan changes therefore take effect within ``ttl_seconds``.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, user_id: str) -> Optional[str]:
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached is None:
+                return None
+            stored_at, plan = cached
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return plan
+
+    def store(self, user_id: str, plan: str) -> None:
+        with self._lock:
+            self._entries[user_id] = (time.monotonic(), plan)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def get(self, user_id: str) -> str:
+        """
+        Return the user's plan, from the cache or else from their subscriptions.
+        """
+        plan = self._lookup(user_id)
+        if plan is not None:
+            plan_lookups.inc(result="hit")
+            return plan
+        plan_lookups.inc(result="miss")
+        with project.stage_timing.span(project.stage_timing.DB):
+            subscription = await prisma.models.Subscription.prisma().find_first(
+                where={"userId": user_id, "status": prisma.enums.SubscriptionStatus.ACTIVE},
+                order={"createdAt": "desc"},
+            )
+        plan = DEFAULT_PLAN if subscription is None else subscription.plan.value
+        self.store(user_id, plan)
+        return plan
+
+
+class TokenBucket:
+    """
+    Allows ``rate`` events per second on average and up to ``burst`` at once.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Take a token if one is available.
+
+        Returns:
+            float: 0 if a token was taken, otherwise how many seconds until one is available.
+        """
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+
+class Admission(NamedTuple):
+    plan: str
+    admitted_at: float
+
+
+class SynthesisScheduler:
+    """
+    Admission control and weighted fair queueing of conversions by subscription plan.
+
+    A conversion first takes a token from its user's bucket, refilled at the plan's rate, and
+    is refused with SynthesisRateLimited when the bucket is empty. A batch or a streaming
+    session is charged a single token up front with ``charge``, and each of its syntheses then
+    acquires a slot with ``charge=False``. A conversion then needs one of
+    ``max_concurrency`` synthesis slots, of which each plan may hold at most its own cap. When
+    no slot is free it waits in its plan's queue, and is refused with SynthesisQueueFull if that
+    queue is full, so a flood on one plan cannot grow the wait of the others.
+
+    Freed slots go to the waiting plans in proportion to their weights (stride scheduling):
+    each plan advances a virtual clock by ``1 / weight`` per slot it is granted, and the plan
+    furthest behind is served next. A plan that was idle rejoins at the current virtual time
+    rather than with credit for the time it was idle. Within a plan, conversions are FIFO.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        policies: Dict[str, PlanPolicy],
+        plans: SubscriptionPlanCache,
+        max_tracked_users: int,
+    ):
+        self.max_concurrency = max_concurrency
+        self.policies = policies
+        self.plans = plans
+        self.max_tracked_users = max_tracked_users
+        self._queues: Dict[str, Deque[Tuple["asyncio.Future[None]", float]]] = {
+            plan: deque() for plan in policies
+        }
+        self._in_flight = {plan: 0 for plan in policies}
+        self._total_in_flight = 0
+        self._passes = {plan: 0.0 for plan in policies}
+        self._virtual_time = 0.0
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._avg_hold_time = 0.0
+
+    def _policy(self, plan: str) -> Tuple[str, PlanPolicy]:
+        if plan not in self.policies:
+            plan = DEFAULT_PLAN
+        return plan, self.policies[plan]
+
+    def _retry_after(self, seconds: float = 0.0) -> int:
+        backlog = self._total_in_flight + sum(len(queue) for queue in self._queues.values())
+        estimate = max(seconds, backlog * self._avg_hold_time / max(self.max_concurrency, 1))
+        return max(SCHEDULER_MIN_RETRY_AFTER_SECONDS, math.ceil(estimate))
+
+    def _take_token(self, user_id: str, policy: PlanPolicy) -> float:
+        if policy.rate <= 0:
+            return 0.0
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(policy.rate, policy.burst)
+            while len(self._buckets) > self.max_tracked_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket.rate, bucket.burst = policy.rate, policy.burst
+        return bucket.take()
+
+    def _has_slot(self, plan: str) -> bool:
+        return (
+            self._total_in_flight < self.max_concurrency
+            and self._in_flight[plan] < self.policies[plan].max_concurrency
+        )
+
+    def _grant(self, plan: str) -> None:
+        self._virtual_time = self._passes[plan]
+        self._passes[plan] += 1 / self.policies[plan].weight
+        self._in_flight[plan] += 1
+        self._total_in_flight += 1
+        in_flight.set(self._in_flight[plan], plan=plan)
+        admitted.inc(plan=plan)
+
+    def _dispatch(self) -> None:
+        while self._total_in_flight < self.max_concurrency:
+            waiting = [
+                plan for plan, queue in self._queues.items() if queue and self._has_slot(plan)
+            ]
+            if not waiting:
+                return
+            plan = min(waiting, key=lambda plan: self._passes[plan])
+            waiter, enqueued_at = self._queues[plan].popleft()
+            queue_depth.set(len(self._queues[plan]), plan=plan)
+            if waiter.done():
+                # Cancelled; its task has not run yet to take it off the queue.
+                continue
+            self._grant(plan)
+            queue_wait.observe(time.perf_counter() - enqueued_at, plan=plan)
+            waiter.set_result(None)
+
+    def _charge(self, user_id: str, plan: str, policy: PlanPolicy) -> None:
+        wait = self._take_token(user_id, policy)
+        if wait > 0:
+            rejected.inc(plan=plan, reason="rate_limited")
+            raise SynthesisRateLimited(plan, max(1, math.ceil(wait)))
+
+    async def charge(self, user_id: str) -> None:
+        """
+        Take one token from the user's bucket for a request that synthesizes many texts.
+
+        Raises:
+            SynthesisRateLimited: If the user's plan rate is exhausted.
+        """
+        plan, policy = self._policy(await self.plans.get(user_id))
+        self._charge(user_id, plan, policy)
+
+    async def acquire(self, user_id: str, charge: bool = True) -> Admission:
+        """
+        Wait for a synthesis slot on behalf of a user, under their plan's limits.
+
+        Every successful call must be paired with a call to release.
+
+        Args:
+            user_id (str): The user the conversion is made for.
+            charge (bool): Whether to take a token from the user's bucket; False when the
+                request was already charged with ``charge``.
+
+        Returns:
+            Admission: The plan the slot was granted under and when.
+
+        Raises:
+            SynthesisRateLimited: If the user's plan rate is exhausted.
+            SynthesisQueueFull: If the plan's wait queue is full.
+        """
+        plan, policy = self._policy(await self.plans.get(user_id))
+        queue = self._queues[plan]
+        if not self._has_slot(plan) and len(queue) >= policy.max_queue:
+            rejected.inc(plan=plan, reason="queue_full")
+            raise SynthesisQueueFull(plan, self._retry_after())
+        if charge:
+            self._charge(user_id, plan, policy)
+        if not queue and self._has_slot(plan):
+            self._grant(plan)
+            queue_wait.observe(0.0, plan=plan)
+            project.stage_timing.record(project.stage_timing.QUEUE_WAIT, 0.0)
+            return Admission(plan, time.perf_counter())
+        if not queue:
+            self._passes[plan] = max(self._passes[plan], self._virtual_time)
+        entry = (asyncio.get_running_loop().create_future(), time.perf_counter())
+        queue.append(entry)
+        queue_depth.set(len(queue), plan=plan)
+        try:
+            await entry[0]
+        except asyncio.CancelledError:
+            if entry[0].done() and not entry[0].cancelled():
+                self.release(Admission(plan, time.perf_counter()))
+            elif entry in queue:
+                queue.remove(entry)
+                queue_depth.set(len(queue), plan=plan)
+            raise
+        project.stage_timing.record(
+            project.stage_timing.QUEUE_WAIT, time.perf_counter() - entry[1]
+        )
+        return Admission(plan, time.perf_counter())
+
+    def release(self, admission: Admission) -> None:
+        """
+        Give back a slot granted by acquire and hand it to the next waiting conversion.
+        """
+        plan = admission.plan
+        held = time.perf_counter() - admission.admitted_at
+        hold_time.observe(held, plan=plan)
+        self._avg_hold_time = 0.8 * self._avg_hold_time + 0.2 * held
+        self._in_flight[plan] -= 1
+        self._total_in_flight -= 1
+        in_flight.set(self._in_flight[plan], plan=plan)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, user_id: str, charge: bool = True) -> AsyncIterator[str]:
+        """
+        Hold a synthesis slot for the user for the duration of the block.
+
+        Yields:
+            str: The plan the slot was granted under.
+        """
+        admission = await self.acquire(user_id, charge)
+        try:
+            yield admission.plan
+        finally:
+            self.release(admission)
+
+
+subscription_plans = SubscriptionPlanCache(
+    SUBSCRIPTION_PLAN_CACHE_TTL_SECONDS, SUBSCRIPTION_PLAN_CACHE_MAX_ENTRIES
+)
+
+synthesis_scheduler = SynthesisScheduler(
+    SYNTHESIS_SCHEDULER_MAX_CONCURRENCY,
+    configured_policies(),
+    subscription_plans,
+    SUBSCRIPTION_PLAN_CACHE_MAX_ENTRIES,
+)
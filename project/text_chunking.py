@@ -0,0 +1,109 @@
+import re
+from typing import List
+
+_SENTENCE_END = re.compile(r"(?:(?<=[.!?…。！？])|(?<=[.!?…。！？][\"')\]”’]))\s+")
+
+_CLAUSE_END = re.compile(r"(?<=[,;:—、，；])\s+")
+
+
+def _split_long(piece: str, max_chars: int) -> List[str]:
+    if len(piece) <= max_chars:
+        return [piece]
+    parts: List[str] = []
+    current = ""
+    for clause in _CLAUSE_END.split(piece):
+        candidate = f"{current} {clause}" if current else clause
+        if len(candidate) <= max_chars:
+            current = candidate
+            continue
+        if current:
+            parts.append(current)
+        current = ""
+        for word in clause.split():
+            candidate = f"{current} {word}" if current else word
+            if len(candidate) <= max_chars or not current:
+                current = candidate
+            else:
+                parts.append(current)
+                current = word
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_sentences(text: str, max_chars: int) -> List[str]:
+    """
+    Split text into sentence-sized chunks that can be synthesized independently.
+
+    Text is split after sentence-ending punctuation. Sentences longer than ``max_chars`` are
+    split further at clause punctuation, and as a last resort between words.
+
+    Args:
+        text (str): The text content to be converted into speech.
+        max_chars (int): The longest chunk to produce, unless a single word is longer.
+
+    Returns:
+        List[str]: The non-empty chunks in reading order.
+    """
+    chunks: List[str] = []
+    for sentence in _SENTENCE_END.split(text.strip()):
+        sentence = " ".join(sentence.split())
+        if sentence:
+            chunks.extend(_split_long(sentence, max_chars))
+    return chunks
+
+
+class SentenceStream:
+    """
+    Detects sentence boundaries in text that arrives in fragments, e.g. LLM tokens.
+
+    Completed sentences are released as soon as the whitespace after their closing punctuation
+    arrives. The pending tail is never allowed to grow past ``max_chars``: longer runs are
+    released at clause or word boundaries, or cut outright if they contain no whitespace.
+    """
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    @property
+    def pending(self) -> str:
+        return self._buffer
+
+    def feed(self, fragment: str) -> List[str]:
+        """
+        Add a fragment and return the chunks it completed.
+
+        Args:
+            fragment (str): The next piece of text, exactly as received.
+
+        Returns:
+            List[str]: Chunks ready for synthesis, in reading order.
+        """
+        self._buffer += fragment
+        boundary = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            boundary = match.end()
+        chunks = split_sentences(self._buffer[:boundary], self.max_chars)
+        self._buffer = self._buffer[boundary:]
+        while len(self._buffer) > self.max_chars:
+            trailing_space = self._buffer[-1:].isspace()
+            pieces = _split_long(" ".join(self._buffer.split()), self.max_chars)
+            if len(pieces) > 1:
+                chunks.extend(pieces[:-1])
+                self._buffer = pieces[-1] + (" " if trailing_space else "")
+            else:
+                chunks.append(self._buffer[: self.max_chars])
+                self._buffer = self._buffer[self.max_chars :]
+        return chunks
+
+    def flush(self) -> List[str]:
+        """
+        Release whatever text is pending, even without a closing sentence boundary.
+
+        Returns:
+            List[str]: The remaining chunks, in reading order.
+        """
+        chunks = split_sentences(self._buffer, self.max_chars)
+        self._buffer = ""
+        return chunks
@@ -1,5 +1,6 @@
 import prisma
 import prisma.models
+import project.user_preferences_cache
 from pydantic import BaseModel
 
 
@@ -24,12 +25,13 @@ class UpdateUserPreferencesOutput(BaseModel):
 
 
 async def update_user_preferences(
-    voice: str, speed: float, pitch: float, language: str
+    user_id: str, voice: str, speed: float, pitch: float, language: str
 ) -> UpdateUserPreferencesOutput:
     """
     Update existing user preferences
 
     Args:
+    user_id (str): The authenticated user whose preferences are updated.
     voice (str): Preferred voice model for TTS. Eg: 'en-US-Wavenet-F'
     speed (float): Speech speed rate where 1.0 is normal speed. Acceptable range could be between 0.25 and 4.0
     pitch (float): Pitch adjustment. Values might range from -20.0 to 20.0, where 0 is the default.
@@ -38,19 +40,17 @@ async def update_user_preferences(
     Returns:
     UpdateUserPreferencesOutput: Confirms the updated user preferences. Echoes back the updated preferences for verification by the client.
     """
-    fake_user_id = "existing-user-uuid-goes-here"
-    updated_preference = await prisma.models.UserPreference.prisma().update(
-        where={"userId": fake_user_id},
+    # userId is not unique in the schema, so update() cannot address the row by it.
+    updated_count = await prisma.models.UserPreference.prisma().update_many(
+        where={"userId": user_id},
         data={"voice": voice, "speed": speed, "pitch": pitch, "language": language},
     )
-    if updated_preference:
+    await project.user_preferences_cache.user_preferences_cache.invalidate(user_id)
+    if updated_count:
         return UpdateUserPreferencesOutput(
             success=True,
             updated_preferences=UserPreference(
-                voice=updated_preference.voice,
-                speed=updated_preference.speed,
-                pitch=updated_preference.pitch,
-                language=updated_preference.language,
+                voice=voice, speed=speed, pitch=pitch, language=language
             ),
         )
     else:
@@ -0,0 +1,159 @@
+import importlib.util
+import os
+import threading
+from typing import Any, Dict, Mapping, Optional
+
+import httpx
+import project.metrics
+
+UPSTREAM_HTTP_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_HTTP_MAX_CONNECTIONS", "32"))
+
+UPSTREAM_HTTP_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_HTTP_MAX_KEEPALIVE", "16"))
+
+# Concurrent requests per host; with HTTP/2 these share one multiplexed connection.
+UPSTREAM_HTTP_MAX_PER_HOST = int(os.getenv("UPSTREAM_HTTP_MAX_PER_HOST", "8"))
+
+UPSTREAM_HTTP_IDLE_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_HTTP_IDLE_TIMEOUT_SECONDS", "60"))
+
+UPSTREAM_HTTP_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_HTTP_TIMEOUT_SECONDS", "10"))
+
+# HTTP/2 is negotiated through ALPN when the ``h2`` package is installed.
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "true").lower() in ("1", "true", "yes")
+
+http_requests = project.metrics.counter(
+    "tts_upstream_http_requests",
+    "HTTP requests sent to synthesis upstreams, by whether they opened a new connection.",
+    ["host", "connection", "http_version"],
+)
+
+http_handshakes = project.metrics.counter(
+    "tts_upstream_http_handshakes",
+    "TCP connects and TLS handshakes made to synthesis upstreams.",
+    ["host", "kind"],
+)
+
+http_reuse_ratio = project.metrics.gauge(
+    "tts_upstream_http_connection_reuse_ratio",
+    "Share of upstream HTTP requests served on an already open connection.",
+    ["host"],
+)
+
+
+class UpstreamSession:
+    """
+    A process-wide, bounded pool of keep-alive HTTP connections to synthesis upstreams.
+
+    Connections stay open for ``idle_timeout`` seconds after their last request, so
+    back-to-back synthesis calls skip the TCP and TLS handshakes. The client is thread-safe
+    and created on first use, which lets synthesis pool workers (threads or processes) share
+    the pool of their own process.
+    """
+
+    def __init__(
+        self,
+        max_connections: int,
+        max_keepalive: int,
+        max_per_host: int,
+        idle_timeout: float,
+        timeout: float,
+        http2: bool,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        self._client: Optional[httpx.Client] = None
+        self._lock = threading.Lock()
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._totals: Dict[str, list] = {}
+
+    def _get_client(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(
+                    http2=self.http2,
+                    timeout=self.timeout,
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_keepalive,
+                        keepalive_expiry=self.idle_timeout,
+                    ),
+                )
+            return self._client
+
+    def _host_slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return slot
+
+    def _record(self, host: str, reused: bool, http_version: str) -> None:
+        with self._lock:
+            totals = self._totals.setdefault(host, [0, 0])
+            totals[0] += 1
+            totals[1] += reused
+            ratio = totals[1] / totals[0]
+        http_requests.inc(
+            host=host, connection="reused" if reused else "new", http_version=http_version
+        )
+        http_reuse_ratio.set(ratio, host=host)
+
+    def post(
+        self,
+        url: str,
+        content: Any = None,
+        headers: Optional[Mapping[str, str]] = None,
+    ) -> httpx.Response:
+        """
+        POST to ``url`` on a pooled connection and read the whole response.
+
+        Args:
+            url (str): The upstream URL.
+            content (Any): The request body, as bytes or str.
+            headers (Optional[Mapping[str, str]]): Extra request headers.
+
+        Returns:
+            httpx.Response: The response, already read.
+
+        Raises:
+            httpx.HTTPError: If the request fails or times out.
+        """
+        host = httpx.URL(url).host
+        handshakes = []
+
+        def trace(event: str, info: Dict[str, Any]) -> None:
+            if event == "connection.connect_tcp.complete":
+                handshakes.append("tcp")
+            elif event == "connection.start_tls.complete":
+                handshakes.append("tls")
+
+        with self._host_slot(host):
+            response = self._get_client().post(
+                url, content=content, headers=headers, extensions={"trace": trace}
+            )
+        for kind in handshakes:
+            http_handshakes.inc(host=host, kind=kind)
+        self._record(host, not handshakes, response.http_version)
+        return response
+
+    def close(self) -> None:
+        """
+        Close every pooled connection; the next request opens a new pool.
+        """
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+upstream_session = UpstreamSession(
+    max_connections=UPSTREAM_HTTP_MAX_CONNECTIONS,
+    max_keepalive=UPSTREAM_HTTP_MAX_KEEPALIVE,
+    max_per_host=UPSTREAM_HTTP_MAX_PER_HOST,
+    idle_timeout=UPSTREAM_HTTP_IDLE_TIMEOUT_SECONDS,
+    timeout=UPSTREAM_HTTP_TIMEOUT_SECONDS,
+    http2=UPSTREAM_HTTP2,
+)
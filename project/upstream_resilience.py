@@ -0,0 +1,348 @@
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Optional, Set, Tuple, TypeVar
+
+import project.metrics
+
+T = TypeVar("T")
+
+# Hedging stays off until this many latencies have been observed.
+MIN_LATENCY_SAMPLES = 20
+
+attempts = project.metrics.counter(
+    "tts_upstream_attempts", "Calls made to a synthesis upstream.", ["upstream", "kind"]
+)
+
+retries = project.metrics.counter(
+    "tts_upstream_retries", "Failed upstream calls that were retried.", ["upstream"]
+)
+
+deadline_exceeded = project.metrics.counter(
+    "tts_upstream_deadline_exceeded",
+    "Upstream calls abandoned because their deadline passed.",
+    ["upstream"],
+)
+
+hedges = project.metrics.counter(
+    "tts_upstream_hedges", "Duplicate upstream calls fired after the hedge delay.", ["upstream"]
+)
+
+hedge_wins = project.metrics.counter(
+    "tts_upstream_hedge_wins",
+    "Hedged calls that answered before the call they duplicated.",
+    ["upstream"],
+)
+
+hedge_saved = project.metrics.counter(
+    "tts_upstream_hedge_saved_seconds",
+    "Latency removed by hedge wins: how much later the original call answered.",
+    ["upstream"],
+)
+
+breaker_state = project.metrics.gauge(
+    "tts_upstream_breaker_state",
+    "Circuit breaker state: 0 closed, 1 half-open, 2 open.",
+    ["upstream"],
+)
+
+breaker_rejections = project.metrics.counter(
+    "tts_upstream_breaker_rejections",
+    "Calls shed or rerouted because an upstream's circuit breaker was open.",
+    ["upstream", "action"],
+)
+
+
+class UpstreamUnavailable(Exception):
+    """
+    Raised when an upstream's circuit breaker is open and the call was shed.
+    """
+
+    def __init__(self, upstream: str, retry_after: int):
+        super().__init__(
+            f"The {upstream} synthesis upstream is failing, retry in {retry_after} seconds."
+        )
+        self.retry_after = retry_after
+
+
+class UpstreamDeadlineExceeded(Exception):
+    """
+    Raised when an upstream call and its retries did not finish within the deadline.
+    """
+
+
+class LatencyWindow:
+    """
+    The most recent ``size`` successful call latencies, for percentile estimates.
+    """
+
+    def __init__(self, size: int = 500):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """
+        Return the given percentile (0-100), or None until MIN_LATENCY_SAMPLES are recorded.
+        """
+        if len(self._samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        rank = min(len(ordered) - 1, math.ceil(percentile / 100 * len(ordered)) - 1)
+        return ordered[max(rank, 0)]
+
+
+class CircuitBreaker:
+    """
+    Opens when the error rate over the last ``window_seconds`` reaches ``error_rate``.
+
+    At least ``min_requests`` outcomes must be in the window before it can open. Once open,
+    calls are refused for ``open_seconds``; then a single probe call is let through (half-open)
+    and its outcome closes or re-opens the breaker.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float,
+        min_requests: int,
+        error_rate: float,
+        open_seconds: float,
+    ):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        breaker_state.set(self.CLOSED, upstream=name)
+
+    @property
+    def state(self) -> int:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._set_state(self.HALF_OPEN)
+        return self._state
+
+    def _set_state(self, state: int) -> None:
+        self._state = state
+        breaker_state.set(state, upstream=self.name)
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go ahead; in the half-open state only one probe at a time may.
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def retry_after(self) -> int:
+        remaining = self.open_seconds - (time.monotonic() - self._opened_at)
+        return max(1, math.ceil(remaining))
+
+    def release(self) -> None:
+        """
+        End a call whose outcome says nothing about the upstream's health.
+        """
+        self._probing = False
+
+    def record(self, success: bool) -> None:
+        now = time.monotonic()
+        if self._state == self.HALF_OPEN:
+            self._probing = False
+            self._outcomes.clear()
+            self._failures = 0
+            if success:
+                self._set_state(self.CLOSED)
+            else:
+                self._opened_at = now
+                self._set_state(self.OPEN)
+            return
+        self._outcomes.append((now, success))
+        self._failures += not success
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            _, succeeded = self._outcomes.popleft()
+            self._failures -= not succeeded
+        if (
+            self._state == self.CLOSED
+            and len(self._outcomes) >= self.min_requests
+            and self._failures >= self.error_rate * len(self._outcomes)
+        ):
+            self._opened_at = now
+            self._set_state(self.OPEN)
+
+
+class ResilientUpstream:
+    """
+    Calls an unreliable upstream with a deadline, retries, hedging and a circuit breaker.
+
+    Each call gets ``deadline_seconds`` in total. A failed attempt is retried up to ``retries``
+    times with jittered exponential backoff, as long as the deadline leaves room. If an attempt
+    has not answered after the ``hedge_percentile`` of recent latencies (and never sooner than
+    ``hedge_min_delay``), one duplicate is fired and the first success wins. At most
+    ``hedge_budget`` of calls are hedged, so a slow upstream does not get double the load.
+    Attempts that lose a hedge race are left to finish, both because a worker thread cannot be
+    interrupted and to measure how much time the hedge saved.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        breaker: CircuitBreaker,
+        retries: int,
+        backoff_seconds: float,
+        deadline_seconds: float,
+        hedge_percentile: float,
+        hedge_min_delay: float,
+        hedge_budget: float,
+    ):
+        self.name = name
+        self.breaker = breaker
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.deadline_seconds = deadline_seconds
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_budget = hedge_budget
+        self.latencies = LatencyWindow()
+        self._calls = 0
+        self._hedged_calls = 0
+
+    def _hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile <= 0:
+            return None
+        percentile = self.latencies.percentile(self.hedge_percentile)
+        if percentile is None:
+            return None
+        return max(percentile, self.hedge_min_delay)
+
+    def _take_hedge(self) -> bool:
+        if self._hedged_calls >= self.hedge_budget * self._calls:
+            return False
+        self._hedged_calls += 1
+        return True
+
+    def _start(self, attempt: Callable[[], Awaitable[T]], kind: str) -> "asyncio.Task[T]":
+        attempts.inc(upstream=self.name, kind=kind)
+        started = time.monotonic()
+        task = asyncio.ensure_future(attempt())
+
+        # Also retrieves the error of attempts nobody waits for any more.
+        def observe(finished: "asyncio.Task[T]") -> None:
+            if not finished.cancelled() and finished.exception() is None:
+                self.latencies.observe(time.monotonic() - started)
+
+        task.add_done_callback(observe)
+        return task
+
+    def _measure_saving(self, primary: "asyncio.Task[Any]", hedge_answered_at: float) -> None:
+        def settle(finished: "asyncio.Task[Any]") -> None:
+            if not finished.cancelled() and finished.exception() is None:
+                hedge_saved.inc(time.monotonic() - hedge_answered_at, upstream=self.name)
+
+        primary.add_done_callback(settle)
+
+    async def _race(
+        self, attempt: Callable[[], Awaitable[T]], kind: str, deadline: float
+    ) -> T:
+        loop = asyncio.get_running_loop()
+        primary = self._start(attempt, kind)
+        pending: Set["asyncio.Task[T]"] = {primary}
+        delay = self._hedge_delay()
+        if delay is not None and loop.time() + delay < deadline:
+            await asyncio.wait(pending, timeout=delay)
+            if not primary.done() and self._take_hedge():
+                hedges.inc(upstream=self.name)
+                pending.add(self._start(attempt, "hedge"))
+        while True:
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=max(deadline - loop.time(), 0),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                deadline_exceeded.inc(upstream=self.name)
+                raise UpstreamDeadlineExceeded(
+                    f"The {self.name} synthesis upstream did not answer within "
+                    f"{self.deadline_seconds:g} seconds."
+                )
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        hedge_wins.inc(upstream=self.name)
+                        self._measure_saving(primary, time.monotonic())
+                    return task.result()
+            if not pending:
+                raise done.pop().exception()  # type: ignore[misc]
+
+    async def call(
+        self,
+        attempt: Callable[[], Awaitable[T]],
+        retryable: Callable[[BaseException], bool],
+    ) -> T:
+        """
+        Run ``attempt`` under this upstream's deadline, retry, hedging and breaker policies.
+
+        Args:
+            attempt (Callable[[], Awaitable[T]]): Makes one call to the upstream.
+            retryable (Callable[[BaseException], bool]): Whether an error is the upstream's
+                fault; other errors are raised straight away and do not count against it.
+
+        Returns:
+            T: The first successful attempt's result.
+
+        Raises:
+            UpstreamUnavailable: If the circuit breaker is open.
+            UpstreamDeadlineExceeded: If no attempt succeeded within the deadline.
+        """
+        if not self.breaker.allow():
+            breaker_rejections.inc(upstream=self.name, action="shed")
+            raise UpstreamUnavailable(self.name, self.breaker.retry_after())
+        self._calls += 1
+        if self._calls > 10000:
+            self._calls //= 2
+            self._hedged_calls //= 2
+        deadline = asyncio.get_running_loop().time() + self.deadline_seconds
+        failures = 0
+        while True:
+            try:
+                result = await self._race(attempt, "retry" if failures else "primary", deadline)
+            except Exception as e:
+                if not isinstance(e, UpstreamDeadlineExceeded) and not retryable(e):
+                    self.breaker.release()
+                    raise
+                self.breaker.record(False)
+                failures += 1
+                backoff = random.uniform(0, self.backoff_seconds * 2 ** (failures - 1))
+                remaining = deadline - asyncio.get_running_loop().time()
+                if (
+                    isinstance(e, UpstreamDeadlineExceeded)
+                    or failures > self.retries
+                    or remaining <= backoff
+                ):
+                    raise
+                retries.inc(upstream=self.name)
+                await asyncio.sleep(backoff)
+                if not self.breaker.allow():
+                    breaker_rejections.inc(upstream=self.name, action="shed")
+                    raise UpstreamUnavailable(self.name, self.breaker.retry_after())
+                continue
+            except BaseException:
+                # Cancelled: the attempt says nothing about the upstream, but a half-open
+                # probe must still be given back, or the breaker never lets another through.
+                self.breaker.release()
+                raise
+            self.breaker.record(True)
+            return result
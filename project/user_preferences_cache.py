@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+import asyncpg
+import prisma
+import prisma.models
+import project.metrics
+
+logger = logging.getLogger(__name__)
+
+USER_PREFERENCES_CACHE_TTL_SECONDS = float(os.getenv("USER_PREFERENCES_CACHE_TTL_SECONDS", "60"))
+
+USER_PREFERENCES_CACHE_MAX_ENTRIES = int(
+    os.getenv("USER_PREFERENCES_CACHE_MAX_ENTRIES", "10000")
+)
+
+USER_PREFERENCES_NOTIFY_CHANNEL = os.getenv(
+    "USER_PREFERENCES_NOTIFY_CHANNEL", "user_preferences_invalidated"
+)
+
+LISTENER_RECONNECT_SECONDS = 5.0
+
+cache_lookups = project.metrics.counter(
+    "tts_user_preferences_cache_lookups",
+    "User preference lookups, by whether they were served from the cache.",
+    ["result"],
+)
+
+cache_invalidations = project.metrics.counter(
+    "tts_user_preferences_cache_invalidations",
+    "User preference cache entries invalidated, by where the change was made.",
+    ["source"],
+)
+
+listener_connected = project.metrics.gauge(
+    "tts_user_preferences_listener_connected",
+    "Whether this worker is listening for preference invalidations from other workers.",
+)
+
+
+class UserPreferencesCache:
+    """
+    Read-through cache of UserPreference rows keyed by user id, bounded by TTL and size.
+
+    Users without preferences are cached too, as None. Writers call invalidate, which drops the
+    local entry and sends a NOTIFY on ``channel`` so that every other worker drops it as well.
+    A lookup that raced with an invalidation does not store what it read, since the row may
+    have changed after it was fetched.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int, channel: str):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.channel = channel
+        self._entries: "OrderedDict[str, Tuple[float, Optional[prisma.models.UserPreference]]]" = (
+            OrderedDict()
+        )
+        self._generations: Dict[str, int] = {}
+        self._clears = 0
+        self._lock = threading.Lock()
+
+    def _lookup(self, user_id: str) -> Tuple[bool, Optional[prisma.models.UserPreference]]:
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached is None:
+                return False, None
+            stored_at, preference = cached
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[user_id]
+                return False, None
+            self._entries.move_to_end(user_id)
+            return True, preference
+
+    def _generation(self, user_id: str) -> Tuple[int, int]:
+        with self._lock:
+            return self._clears, self._generations.get(user_id, 0)
+
+    def _store(
+        self,
+        user_id: str,
+        preference: Optional[prisma.models.UserPreference],
+        generation: Tuple[int, int],
+    ) -> None:
+        with self._lock:
+            if (self._clears, self._generations.get(user_id, 0)) != generation:
+                return
+            self._entries[user_id] = (time.monotonic(), preference)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def get(self, user_id: str) -> Optional[prisma.models.UserPreference]:
+        """
+        Return the user's preferences, from the cache or else from the database.
+
+        Args:
+            user_id (str): The user whose preferences are wanted.
+
+        Returns:
+            Optional[UserPreference]: The stored preferences, or None if the user has none.
+        """
+        hit, preference = self._lookup(user_id)
+        if hit:
+            cache_lookups.inc(result="hit")
+            return preference
+        cache_lookups.inc(result="miss")
+        generation = self._generation(user_id)
+        preference = await prisma.models.UserPreference.prisma().find_first(
+            where={"userId": user_id}
+        )
+        self._store(user_id, preference, generation)
+        return preference
+
+    def drop(self, user_id: str) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            if len(self._generations) > 2 * self.max_entries:
+                # Lookups in flight compare against the clear count as well, so this is safe.
+                self._generations.clear()
+                self._clears += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._clears += 1
+
+    async def invalidate(self, user_id: str) -> None:
+        """
+        Drop a user's cached preferences here and in every other worker.
+
+        Call this after the user's preferences were created, updated or deleted.
+        """
+        self.drop(user_id)
+        cache_invalidations.inc(source="local")
+        await prisma.get_client().execute_raw(
+            "SELECT pg_notify($1, $2)", self.channel, user_id
+        )
+
+
+def listener_dsn(database_url: str) -> str:
+    """
+    Strip the Prisma-specific query parameters (``schema``, ``connection_limit``...) from a URL.
+    """
+    parts = urlsplit(database_url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+
+class InvalidationListener:
+    """
+    Background task that LISTENs for invalidations sent by other workers.
+
+    Prisma's query engine cannot LISTEN, so this keeps a dedicated asyncpg connection. While it
+    is disconnected notifications may be missed, so the whole cache is cleared every time it
+    (re)connects; until then entries expire through their TTL.
+    """
+
+    def __init__(self, cache: UserPreferencesCache, database_url: str):
+        self.cache = cache
+        self.database_url = database_url
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def _on_notification(self, connection, pid, channel, payload: str) -> None:
+        self.cache.drop(payload)
+        cache_invalidations.inc(source="remote")
+
+    async def _listen(self) -> None:
+        connection = await asyncpg.connect(listener_dsn(self.database_url))
+        try:
+            await connection.add_listener(self.cache.channel, self._on_notification)
+            self.cache.clear()
+            listener_connected.set(1)
+            closed = asyncio.Event()
+            connection.add_termination_listener(lambda _: closed.set())
+            await closed.wait()
+        finally:
+            listener_connected.set(0)
+            await connection.close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Preference invalidation listener disconnected")
+            await asyncio.sleep(LISTENER_RECONNECT_SECONDS)
+
+    def start(self) -> None:
+        if not self.database_url:
+            logger.warning("DATABASE_URL is not set; preference invalidations stay local")
+            return
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+user_preferences_cache = UserPreferencesCache(
+    USER_PREFERENCES_CACHE_TTL_SECONDS,
+    USER_PREFERENCES_CACHE_MAX_ENTRIES,
+    USER_PREFERENCES_NOTIFY_CHANNEL,
+)
+
+invalidation_listener = InvalidationListener(
+    user_preferences_cache, os.getenv("DATABASE_URL", "")
+)
@@ -0,0 +1,96 @@
+import struct
+from typing import Optional
+
+import project.mp3
+
+_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+
+HEADER_SIZE = _HEADER.size
+
+PCM_FORMAT = 1
+
+
+def header(sample_rate: int, channels: int, data_size: int, sample_width: int = 2) -> bytes:
+    """
+    Build the 44-byte RIFF header of a PCM WAV file.
+
+    Args:
+        sample_rate (int): Samples per second per channel.
+        channels (int): Number of interleaved channels.
+        data_size (int): Size of the sample data that follows the header, in bytes.
+        sample_width (int): Bytes per sample.
+
+    Returns:
+        bytes: The header.
+    """
+    block_align = channels * sample_width
+    return _HEADER.pack(
+        b"RIFF",
+        36 + data_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        PCM_FORMAT,
+        channels,
+        sample_rate,
+        sample_rate * block_align,
+        block_align,
+        sample_width * 8,
+        b"data",
+        data_size,
+    )
+
+
+def probe(data: bytes) -> project.mp3.AudioMetadata:
+    """
+    Read the duration and format of a PCM WAV file from its header.
+
+    Args:
+        data (bytes): The start of the file; the header is all that is read.
+
+    Returns:
+        AudioMetadata: Duration and format of the file, or EMPTY_METADATA if it is not a PCM
+        WAV file. ``frame_count`` counts sample frames.
+    """
+    fields = _parse(data)
+    if fields is None:
+        return project.mp3.EMPTY_METADATA
+    channels, sample_rate, byte_rate, block_align, data_size = fields
+    frame_count = data_size // block_align
+    return project.mp3.AudioMetadata(
+        duration=frame_count / sample_rate,
+        bitrate=byte_rate * 8,
+        frame_count=frame_count,
+        sample_rate=sample_rate,
+        channels=channels,
+    )
+
+
+def probe_file(path: str) -> project.mp3.AudioMetadata:
+    with open(path, "rb") as audio_file:
+        return probe(audio_file.read(HEADER_SIZE))
+
+
+def _parse(data: bytes) -> Optional[tuple]:
+    if len(data) < HEADER_SIZE:
+        return None
+    (
+        riff,
+        _,
+        wave,
+        fmt,
+        _,
+        audio_format,
+        channels,
+        sample_rate,
+        byte_rate,
+        block_align,
+        _,
+        chunk,
+        data_size,
+    ) = _HEADER.unpack_from(data)
+    if (riff, wave, fmt, chunk) != (b"RIFF", b"WAVE", b"fmt ", b"data"):
+        return None
+    if audio_format != PCM_FORMAT or not channels or not sample_rate or not block_align:
+        return None
+    return channels, sample_rate, byte_rate, block_align, data_size
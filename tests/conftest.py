@@ -0,0 +1,35 @@
+import time
+
+import pytest
+
+
+class Clock:
+    """
+    Stands in for a module's ``time``, with a monotonic clock the test moves by hand.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def __getattr__(self, name: str):
+        return getattr(time, name)
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    """
+    Return a function that gives the modules passed to it one Clock, and returns that Clock.
+
+    Only those modules see it; the event loop keeps the real clock.
+    """
+
+    def install(*modules) -> Clock:
+        clock = Clock()
+        for module in modules:
+            monkeypatch.setattr(module, "time", clock)
+        return clock
+
+    return install
@@ -0,0 +1,16 @@
+import project.audio_store
+
+AUDIO = bytes(1000)
+
+
+def test_rewriting_a_file_does_not_count_it_twice(tmp_path):
+    store = project.audio_store.AudioStore(str(tmp_path), 10_000, 3600)
+    path = store.path_for("a" * 64)
+    for _ in range(3):
+        store.write_file(path, AUDIO)
+    assert store._bytes == len(AUDIO)
+    store.write_file(path, AUDIO[:400])
+    assert store._bytes == 400
+    store.write_file(store.path_for("b" * 64), AUDIO)
+    assert store._bytes == 1400
+
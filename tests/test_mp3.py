@@ -0,0 +1,138 @@
+import pytest
+
+import project.mp3
+
+# MPEG-1 layer III, 128 kbit/s, 44.1 kHz, stereo, unprotected: 417-byte frames, 418 padded.
+MPEG1_HEADER = bytes([0xFF, 0xFB, 0x90, 0x00])
+
+MPEG1_PADDED_HEADER = bytes([0xFF, 0xFB, 0x92, 0x00])
+
+# MPEG-2 layer III, 32 kbit/s, 24 kHz, mono: the format gTTS produces, 96-byte frames.
+GTTS_HEADER = project.mp3.DEFAULT_SILENCE_HEADER
+
+
+def frame(header: bytes) -> bytes:
+    return header + bytes(project.mp3.parse_frame_header(header).frame_length - 4)
+
+
+def id3v2_tag(payload_size: int) -> bytes:
+    size = bytes([(payload_size >> shift) & 0x7F for shift in (21, 14, 7, 0)])
+    return b"ID3\x04\x00\x00" + size + bytes(payload_size)
+
+
+def xing_frame(frames: int, delay: int, padding: int) -> bytes:
+    data = bytearray(frame(MPEG1_HEADER))
+    tag = 4 + 32
+    flags = 0x01 | 0x02 | 0x04 | 0x08
+    data[tag : tag + 8] = b"Xing" + flags.to_bytes(4, "big")
+    data[tag + 8 : tag + 12] = frames.to_bytes(4, "big")
+    lame = tag + 8 + 4 + 4 + 100 + 4
+    data[lame : lame + 4] = b"LAME"
+    data[lame + 21 : lame + 24] = ((delay << 12) | padding).to_bytes(3, "big")
+    return bytes(data)
+
+
+def test_parse_frame_header_mpeg2_layer3():
+    header = project.mp3.parse_frame_header(GTTS_HEADER)
+    assert header.version == 2.0
+    assert header.layer == 3
+    assert header.bitrate == 32000
+    assert header.sample_rate == 24000
+    assert header.frame_length == 96
+    assert header.samples == 576
+    assert header.channels == 1
+    assert header.side_info_size == 9
+    assert not header.protected
+
+
+def test_parse_frame_header_mpeg1_padding():
+    header = project.mp3.parse_frame_header(MPEG1_HEADER)
+    padded = project.mp3.parse_frame_header(MPEG1_PADDED_HEADER)
+    assert (header.frame_length, header.samples, header.channels) == (417, 1152, 2)
+    assert padded.frame_length == 418
+    assert padded.padding == 1
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"\xff\xfb\x90",  # truncated
+        b"\xfe\xfb\x90\x00",  # no frame sync
+        b"\xff\xf9\x90\x00",  # reserved layer
+        b"\xff\xfb\xf0\x00",  # bad bitrate index
+        b"\xff\xfb\x0c\x00",  # free format bitrate and reserved sample rate
+        b"\xff\xfb\x9c\x00",  # reserved sample rate
+    ],
+)
+def test_parse_frame_header_rejects_invalid_headers(data):
+    assert project.mp3.parse_frame_header(data) is None
+
+
+def test_iter_frames_skips_tags_and_resynchronises():
+    audio = frame(MPEG1_HEADER) * 2
+    id3v1_tag = b"TAG" + bytes(125)
+    data = id3v2_tag(20) + audio + b"\x00\xffjunk" + frame(MPEG1_PADDED_HEADER) + id3v1_tag
+    frames = list(project.mp3.iter_frames(data))
+    assert [offset for offset, _ in frames] == [30, 30 + 417, 30 + 2 * 417 + 6]
+    assert [header.frame_length for _, header in frames] == [417, 417, 418]
+
+
+def test_probe_constant_bitrate():
+    metadata = project.mp3.probe(frame(GTTS_HEADER) * 100)
+    assert metadata.frame_count == 100
+    assert metadata.duration == pytest.approx(100 * 576 / 24000)
+    assert metadata.bitrate == 32000
+    assert (metadata.sample_rate, metadata.channels) == (24000, 1)
+
+
+def test_probe_padded_constant_bitrate():
+    data = (frame(MPEG1_HEADER) + frame(MPEG1_PADDED_HEADER)) * 10
+    metadata = project.mp3.probe(data)
+    assert metadata.frame_count == 20
+    assert metadata.duration == pytest.approx(20 * 1152 / 44100)
+
+
+def test_probe_variable_bitrate_counts_every_frame():
+    other = bytes([0xFF, 0xFB, 0xB0, 0x00])  # 192 kbit/s
+    data = frame(MPEG1_HEADER) + frame(other) + frame(MPEG1_HEADER) + frame(other)
+    assert project.mp3.probe(data).frame_count == 4
+
+
+def test_probe_reads_xing_frame_count_and_gapless_info():
+    data = xing_frame(frames=1000, delay=576, padding=1000) + frame(MPEG1_HEADER) * 3
+    metadata = project.mp3.probe(data)
+    assert metadata.frame_count == 1000
+    assert metadata.duration == pytest.approx((1000 * 1152 - 1576) / 44100)
+
+
+def test_probe_reads_vbri_frame_count():
+    data = bytearray(frame(MPEG1_HEADER))
+    data[36:40] = b"VBRI"
+    data[36 + 14 : 36 + 18] = (250).to_bytes(4, "big")
+    metadata = project.mp3.probe(bytes(data) + frame(MPEG1_HEADER))
+    assert metadata.frame_count == 250
+
+
+def test_probe_without_frames():
+    assert project.mp3.probe(b"not an mp3 at all") == project.mp3.EMPTY_METADATA
+
+
+def test_concatenate_drops_tags_and_info_frames():
+    first = id3v2_tag(10) + xing_frame(frames=2, delay=0, padding=0) + frame(MPEG1_HEADER) * 2
+    second = frame(MPEG1_PADDED_HEADER) + b"TAG" + bytes(125)
+    joined = project.mp3.concatenate([first, second])
+    assert joined == frame(MPEG1_HEADER) * 2 + frame(MPEG1_PADDED_HEADER)
+
+
+def test_silence_matches_the_reference_format():
+    silence = project.mp3.silence(1.0, frame(MPEG1_HEADER))
+    frames = list(project.mp3.iter_frames(silence))
+    assert len(frames) == round(44100 / 1152)
+    assert all(header.bitrate == 128000 and header.channels == 2 for _, header in frames)
+    assert project.mp3.probe(silence).duration == pytest.approx(1.0, abs=1152 / 44100)
+
+
+def test_silence_defaults_to_the_gtts_format():
+    metadata = project.mp3.probe(project.mp3.silence(0.5))
+    assert (metadata.sample_rate, metadata.channels, metadata.bitrate) == (24000, 1, 32000)
+    assert metadata.frame_count == round(0.5 * 24000 / 576)
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+import project.sendfile_response
+
+ETAG = '"abc"'
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-199", (100, 199)),
+        ("bytes=900-", (900, 999)),
+        ("bytes=-100", (900, 999)),
+        ("bytes=-5000", (0, 999)),
+        ("bytes=990-5000", (990, 999)),
+        ("bytes= 10-20 ", (10, 20)),
+        ("bytes=5-5", (5, 5)),
+    ],
+)
+def test_parse_range(header, expected):
+    assert project.sendfile_response.parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        None,
+        "",
+        "items=0-10",
+        "bytes=0-10,20-30",
+        "bytes=-",
+        "bytes=abc-",
+        "bytes=5",
+        "bytes=+5-10",
+        "bytes=5--3",
+        "bytes=20-10",
+    ],
+)
+def test_parse_range_ignores_invalid_headers(header):
+    assert project.sendfile_response.parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5000-6000", "bytes=-0"])
+def test_parse_range_rejects_unsatisfiable_ranges(header):
+    with pytest.raises(ValueError):
+        project.sendfile_response.parse_range(header, 1000)
+
+
+def serve(response, method="GET"):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(response({"type": "http", "method": method}, None, send))
+    start = messages[0]
+    headers = {name.decode(): value.decode() for name, value in start["headers"]}
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return start["status"], headers, body
+
+
+@pytest.fixture
+def audio_file(tmp_path):
+    path = tmp_path / "speech.mp3"
+    path.write_bytes(bytes(range(256)) * 4)
+    return str(path)
+
+
+def test_file_response_serves_a_range(audio_file):
+    response = project.sendfile_response.file_response(
+        audio_file, 1024, ETAG, "audio/mpeg", {"range": "bytes=10-19"}
+    )
+    status, headers, body = serve(response)
+    assert status == 206
+    assert headers["content-range"] == "bytes 10-19/1024"
+    assert headers["content-length"] == "10"
+    assert body == bytes(range(10, 20))
+
+
+def test_file_response_serves_the_whole_file_for_a_stale_if_range(audio_file):
+    response = project.sendfile_response.file_response(
+        audio_file, 1024, ETAG, "audio/mpeg", {"range": "bytes=10-19", "if-range": '"old"'}
+    )
+    status, headers, body = serve(response)
+    assert status == 200
+    assert len(body) == 1024
+
+
+def test_file_response_answers_416_for_unsatisfiable_ranges(audio_file):
+    response = project.sendfile_response.file_response(
+        audio_file, 1024, ETAG, "audio/mpeg", {"range": "bytes=2000-"}
+    )
+    status, headers, _ = serve(response)
+    assert status == 416
+    assert headers["content-range"] == "bytes */1024"
+
+
+def test_file_response_answers_304_for_a_matching_etag(audio_file):
+    response = project.sendfile_response.file_response(
+        audio_file, 1024, ETAG, "audio/mpeg", {"if-none-match": f"W/{ETAG}"}
+    )
+    assert serve(response)[0] == 304
@@ -0,0 +1,118 @@
+import asyncio
+import concurrent.futures
+import fcntl
+import os
+
+import pytest
+
+from project.single_flight import SingleFlight
+
+
+@pytest.fixture
+def flight(tmp_path):
+    return SingleFlight(str(tmp_path), stripes=1, poll_seconds=0.01)
+
+
+def hold_stripe(flight: SingleFlight) -> int:
+    """
+    Take the only stripe's lock the way another worker process would.
+    """
+    os.makedirs(flight.lock_dir, exist_ok=True)
+    fd = os.open(os.path.join(flight.lock_dir, "00000.lock"), os.O_RDWR | os.O_CREAT)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    return fd
+
+
+def markers(flight: SingleFlight):
+    return [name for name in os.listdir(flight.lock_dir) if name.endswith(".waiting")]
+
+
+def test_identical_calls_share_one_leader(flight):
+    calls = []
+
+    async def work() -> str:
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return "audio"
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["audio"] * 5
+    assert len(calls) == 1
+
+
+def test_keys_sharing_a_stripe_queue_in_process_without_markers(flight):
+    async def work(key: str) -> str:
+        await asyncio.sleep(0.01)
+        return key
+
+    async def run():
+        return await asyncio.gather(*(flight.do(key, lambda key=key: work(key)) for key in "abc"))
+
+    assert asyncio.run(run()) == ["a", "b", "c"]
+    assert markers(flight) == []
+
+
+def test_waiting_on_another_worker_leaves_the_default_executor_free(flight):
+    fd = hold_stripe(flight)
+
+    async def work() -> str:
+        # The holder's own disk I/O goes through the default executor.
+        return await asyncio.to_thread(lambda: "audio")
+
+    async def run():
+        asyncio.get_running_loop().set_default_executor(
+            concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        )
+        waiters = [asyncio.ensure_future(flight.do(key, work)) for key in ("a", "b")]
+        await asyncio.sleep(0.05)
+        assert not any(waiter.done() for waiter in waiters)
+        assert await asyncio.wait_for(asyncio.to_thread(lambda: "free"), 1) == "free"
+        os.close(fd)
+        return await asyncio.wait_for(asyncio.gather(*waiters), 1)
+
+    assert asyncio.run(run()) == ["audio", "audio"]
+
+
+def test_waiters_mark_their_own_key(flight):
+    fd = hold_stripe(flight)
+    published = []
+
+    async def work() -> str:
+        return "audio"
+
+    async def publish(result: str) -> None:
+        published.append(result)
+
+    async def run():
+        waiters = [asyncio.ensure_future(flight.do(key, work, publish=publish)) for key in "ab"]
+        await asyncio.sleep(0.05)
+        # Only the key waiting on the other worker's lock is marked, not the one queued behind
+        # it in this process, so only its leader publishes.
+        assert len(markers(flight)) == 1
+        os.close(fd)
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(run()) == ["audio", "audio"]
+    assert published == ["audio"]
+    assert markers(flight) == []
+
+
+def test_recheck_hit_clears_the_marker(flight):
+    fd = hold_stripe(flight)
+
+    async def work() -> str:
+        raise AssertionError("another worker already produced the result")
+
+    async def cached() -> str:
+        return "cached"
+
+    async def run():
+        waiter = asyncio.ensure_future(flight.do("a", work, cached))
+        await asyncio.sleep(0.05)
+        os.close(fd)
+        return await waiter
+
+    assert asyncio.run(run()) == "cached"
+    assert markers(flight) == []
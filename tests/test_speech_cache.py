@@ -0,0 +1,48 @@
+import asyncio
+import os
+
+import pytest
+
+import project.audio_store
+import project.speech_cache
+from project.speech_cache import SpeechCache
+
+AUDIO = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def store(tmp_path):
+    return project.audio_store.AudioStore(str(tmp_path), 1 << 30, 3600)
+
+
+def cache(store, spill_threshold: int) -> SpeechCache:
+    return SpeechCache(store, 1 << 30, 3600, spill_threshold=spill_threshold)
+
+
+def test_memory_hits_stay_on_the_event_loop(store, monkeypatch):
+    speech = cache(store, spill_threshold=len(AUDIO))
+    speech.put("a" * 64, AUDIO)
+
+    async def no_thread(*args, **kwargs):
+        raise AssertionError("a memory hit must not touch the filesystem")
+
+    monkeypatch.setattr(project.speech_cache.asyncio, "to_thread", no_thread)
+    entry = asyncio.run(speech.get("a" * 64))
+    assert entry.audio == AUDIO
+    assert not entry.on_disk
+
+
+def test_files_of_other_workers_are_adopted(store):
+    cache(store, spill_threshold=0).put("b" * 64, AUDIO)
+    entry = asyncio.run(cache(store, spill_threshold=0).get("b" * 64))
+    assert entry.on_disk
+    assert entry.size == len(AUDIO)
+    assert entry.path == store.path_for("b" * 64)
+
+
+def test_entries_whose_file_went_away_miss(store):
+    speech = cache(store, spill_threshold=0)
+    entry = speech.put("c" * 64, AUDIO)
+    os.remove(entry.path)
+    assert asyncio.run(speech.get("c" * 64)) is None
+    assert asyncio.run(speech.get("d" * 64)) is None
@@ -0,0 +1,149 @@
+import pytest
+
+import project.ssml
+from project.ssml import Pause, Speech
+
+
+def segment(document: str, max_chars: int = 200):
+    return project.ssml.segment(document, max_chars)
+
+
+def test_plain_text_is_one_run():
+    assert segment("<speak>Hello there, world.</speak>") == [Speech("Hello there, world.")]
+
+
+def test_markup_never_reaches_the_text():
+    document = (
+        '<speak xmlns="http://www.w3.org/2001/10/synthesis">'
+        'Say <emphasis level="strong">this</emphasis> as <say-as interpret-as="characters">'
+        "ABC</say-as>.</speak>"
+    )
+    assert segment(document) == [Speech("Say this as ABC.")]
+
+
+def test_long_runs_are_split_into_sentences():
+    document = "<speak>First sentence here. Second sentence here.</speak>"
+    assert segment(document, max_chars=30) == [
+        Speech("First sentence here."),
+        Speech("Second sentence here."),
+    ]
+
+
+def test_breaks_become_pauses():
+    document = (
+        '<speak>One.<break time="750ms"/>Two.<break time="2s"/>Three.'
+        '<break strength="weak"/>Four.<break/>Five.</speak>'
+    )
+    assert segment(document) == [
+        Speech("One."),
+        Pause(0.75),
+        Speech("Two."),
+        Pause(2.0),
+        Speech("Three."),
+        Pause(project.ssml.BREAK_STRENGTHS["weak"]),
+        Speech("Four."),
+        Pause(project.ssml.BREAK_STRENGTHS["medium"]),
+        Speech("Five."),
+    ]
+
+
+def test_adjacent_pauses_are_merged_and_capped(monkeypatch):
+    monkeypatch.setattr(project.ssml, "SSML_MAX_BREAK_SECONDS", 3.0)
+    document = '<speak>One.<break time="1s"/><break time="1500ms"/> Two.<break time="9s"/></speak>'
+    assert segment(document) == [Speech("One."), Pause(2.5), Speech("Two."), Pause(3.0)]
+
+
+def test_paragraphs_end_with_a_pause():
+    document = "<speak><p>First paragraph.</p><p><s>Second</s><s>paragraph.</s></p></speak>"
+    pause = Pause(project.ssml.SSML_PARAGRAPH_PAUSE_SECONDS)
+    assert segment(document) == [
+        Speech("First paragraph."),
+        pause,
+        Speech("Second"),
+        Speech("paragraph."),
+        pause,
+    ]
+
+
+def test_nested_prosody_multiplies_rates_and_adds_pitches():
+    document = (
+        "<speak>Normal. "
+        '<prosody rate="slow" pitch="+2st">Slow. <prosody rate="50%" pitch="-1st">Slower.'
+        "</prosody> Slow again.</prosody> Normal again.</speak>"
+    )
+    assert segment(document) == [
+        Speech("Normal."),
+        Speech("Slow.", 0.75, 2.0),
+        Speech("Slower.", 0.375, 1.0),
+        Speech("Slow again.", 0.75, 2.0),
+        Speech("Normal again."),
+    ]
+
+
+def test_sub_speaks_its_alias():
+    document = '<speak>Made by <sub alias="World Wide Web Consortium">W3C</sub> in 1994.</speak>'
+    assert segment(document) == [Speech("Made by World Wide Web Consortium in 1994.")]
+
+
+def test_feeding_in_pieces_matches_the_whole_document():
+    document = (
+        '<speak><p>Hello <prosody rate="fast">there</prosody>.<break time="1s"/>'
+        '<break time="1s"/>How are you?</p> Bye.<break time="200ms"/></speak>'
+    )
+    segmenter = project.ssml.SsmlSegmenter(200)
+    pieces = []
+    for index in range(0, len(document), 7):
+        pieces.extend(segmenter.feed(document[index : index + 7]))
+    pieces.extend(segmenter.close())
+    assert pieces == segment(document)
+
+
+def test_document_without_content_has_no_segments():
+    assert segment("<speak>  </speak>") == []
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        "<speak>Unclosed",
+        "<speak>One</speech>",
+        '<speak><break time="soon"/></speak>',
+        '<speak><break strength="huge"/></speak>',
+        '<speak><prosody rate="-100%">x</prosody></speak>',
+        '<speak><prosody rate="quick">x</prosody></speak>',
+        '<speak><prosody pitch="shrill">x</prosody></speak>',
+    ],
+)
+def test_invalid_documents_are_rejected(document):
+    with pytest.raises(ValueError):
+        segment(document)
+
+
+@pytest.mark.parametrize(
+    "value, rate",
+    [
+        ("x-slow", 0.5),
+        ("medium", 1.0),
+        ("80%", 0.8),
+        ("150%", 1.5),
+        ("+20%", 1.2),
+        ("-10%", 0.9),
+        ("1.25", 1.25),
+    ],
+)
+def test_prosody_rate(value, rate):
+    assert project.ssml.prosody_rate(value) == pytest.approx(rate)
+
+
+@pytest.mark.parametrize(
+    "value, semitones",
+    [("high", 3.0), ("+2st", 2.0), ("-1.5st", -1.5), ("+100%", 12.0), ("-50%", -12.0)],
+)
+def test_prosody_pitch(value, semitones):
+    assert project.ssml.prosody_pitch(value) == pytest.approx(semitones)
+
+
+def test_speech_effects_combine_with_the_request_and_stay_in_range():
+    assert Speech("x").effects(None, None) == (None, None)
+    assert Speech("x", 0.5, 2.0).effects(1.5, -1.0) == (0.75, 1.0)
+    assert Speech("x", 3.0, 10.0).effects(2.0, 6.0) == (4.0, 12.0)
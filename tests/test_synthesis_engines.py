@@ -0,0 +1,73 @@
+import base64
+
+import httpx
+import pytest
+import requests
+from gtts import gTTS, gTTSError
+
+import project.synthesis_engines
+import project.upstream_http
+
+# Long enough for gTTS to split it into several requests.
+TEXT = (
+    "The quick brown fox jumps over the lazy dog, again and again, until the dog finally "
+    "wakes up. Then the fox runs off into the forest, and the dog goes back to sleep."
+)
+
+
+def rpc_body(audio: bytes) -> str:
+    payload = base64.b64encode(audio).decode("ascii")
+    return f')]}}\'\n\n[["wrb.fr","jQ1olc","[\\"{payload}\\"]",null,null,null,"generic"]]\n'
+
+
+def audio_part(index: int) -> bytes:
+    return bytes([0xFF, 0xF3, 0x44, 0xC4]) + bytes([index]) * 92
+
+
+def test_gtts_engine_matches_gtts_stream(monkeypatch):
+    gtts_requests = []
+
+    def send(session, request, **kwargs):
+        gtts_requests.append((request.url, request.body))
+        response = requests.Response()
+        response.status_code = 200
+        response.request = request
+        response._content = rpc_body(audio_part(len(gtts_requests))).encode("utf-8")
+        response._content_consumed = True
+        return response
+
+    monkeypatch.setattr(requests.Session, "send", send)
+    expected = b"".join(gTTS(text=TEXT, lang="en").stream())
+
+    engine_requests = []
+
+    def post(url, content, headers):
+        engine_requests.append((url, content))
+        body = rpc_body(audio_part(len(engine_requests)))
+        return httpx.Response(200, text=body, request=httpx.Request("POST", url))
+
+    monkeypatch.setattr(project.upstream_http.upstream_session, "post", post)
+    audio = project.synthesis_engines.GTTSEngine().synthesize(TEXT, "en", "default")
+
+    assert len(gtts_requests) > 1
+    assert engine_requests == gtts_requests
+    assert audio == expected
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        httpx.Response(500, text="", request=httpx.Request("POST", "https://example.test")),
+        httpx.Response(
+            200,
+            text='[["wrb.fr","jQ1olc",null]]',
+            request=httpx.Request("POST", "https://example.test"),
+        ),
+    ],
+)
+def test_gtts_engine_rejects_answers_without_audio(monkeypatch, response):
+    monkeypatch.setattr(
+        project.upstream_http.upstream_session, "post", lambda url, content, headers: response
+    )
+    with pytest.raises(gTTSError):
+        project.synthesis_engines.GTTSEngine().synthesize("Hello.", "en", "default")
@@ -0,0 +1,166 @@
+import asyncio
+
+import pytest
+
+import project.synthesis_scheduler
+from project.synthesis_scheduler import (
+    PlanPolicy,
+    SubscriptionPlanCache,
+    SynthesisQueueFull,
+    SynthesisRateLimited,
+    SynthesisScheduler,
+    TokenBucket,
+)
+
+
+@pytest.fixture
+def clock(fake_clock):
+    return fake_clock(project.synthesis_scheduler)
+
+
+def policy(weight=1.0, rate=0.0, burst=1.0, max_concurrency=8, max_queue=8) -> PlanPolicy:
+    return PlanPolicy(weight, rate, burst, max_concurrency, max_queue)
+
+
+def scheduler(max_concurrency: int, **policies: PlanPolicy) -> SynthesisScheduler:
+    plans = SubscriptionPlanCache(ttl_seconds=3600, max_entries=100)
+    for plan in policies:
+        plans.store(plan.lower(), plan)
+    return SynthesisScheduler(max_concurrency, policies, plans, max_tracked_users=100)
+
+
+def test_token_bucket_allows_a_burst_then_the_rate(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.take() == 0.0
+    assert bucket.take() == pytest.approx(0.5)
+
+
+def test_token_bucket_refills_up_to_the_burst(clock):
+    bucket = TokenBucket(rate=10, burst=2)
+    bucket.take()
+    bucket.take()
+    clock.now += 60
+    assert [bucket.take() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.take() > 0
+
+
+def test_rate_limit(clock):
+    async def run():
+        synthesis = scheduler(4, FREE=policy(rate=1, burst=2))
+        for _ in range(2):
+            synthesis.release(await synthesis.acquire("free"))
+        with pytest.raises(SynthesisRateLimited) as raised:
+            await synthesis.acquire("free")
+        assert raised.value.retry_after == 1
+        clock.now += 1
+        synthesis.release(await synthesis.acquire("free"))
+
+    asyncio.run(run())
+
+
+def test_charged_requests_acquire_without_tokens(clock):
+    async def run():
+        synthesis = scheduler(4, FREE=policy(rate=1, burst=1))
+        await synthesis.charge("free")
+        for _ in range(5):
+            async with synthesis.admit("free", charge=False):
+                pass
+        with pytest.raises(SynthesisRateLimited):
+            await synthesis.charge("free")
+
+    asyncio.run(run())
+
+
+def test_full_queue_is_refused():
+    async def run():
+        synthesis = scheduler(1, FREE=policy(max_queue=1))
+        held = await synthesis.acquire("free")
+        waiter = asyncio.ensure_future(synthesis.acquire("free"))
+        await asyncio.sleep(0)
+        with pytest.raises(SynthesisQueueFull):
+            await synthesis.acquire("free")
+        synthesis.release(held)
+        synthesis.release(await waiter)
+
+    asyncio.run(run())
+
+
+def test_free_slots_are_shared_by_weight():
+    async def run():
+        synthesis = scheduler(1, FREE=policy(weight=1), PREMIUM=policy(weight=3))
+        order = []
+
+        async def convert(user_id: str) -> None:
+            async with synthesis.admit(user_id) as plan:
+                order.append(plan)
+
+        held = await synthesis.acquire("free")
+        waiters = [asyncio.ensure_future(convert(user)) for user in ["free"] * 4 + ["premium"] * 4]
+        await asyncio.sleep(0)
+        synthesis.release(held)
+        await asyncio.gather(*waiters)
+        return order
+
+    order = asyncio.run(run())
+    assert order[:4].count("PREMIUM") == 3
+    assert sorted(order) == ["FREE"] * 4 + ["PREMIUM"] * 4
+
+
+def test_idle_plans_get_no_credit():
+    async def run():
+        synthesis = scheduler(1, FREE=policy(weight=1), PREMIUM=policy(weight=1))
+        order = []
+
+        async def convert(user_id: str) -> None:
+            async with synthesis.admit(user_id) as plan:
+                order.append(plan)
+
+        # PREMIUM runs alone for a while, then FREE joins. Credited with that idle time, FREE
+        # would take every slot until it caught up; it rejoins at the current virtual time.
+        for _ in range(5):
+            async with synthesis.admit("premium"):
+                pass
+        held = await synthesis.acquire("premium")
+        waiters = [asyncio.ensure_future(convert(user)) for user in ["premium", "free"] * 3]
+        await asyncio.sleep(0)
+        synthesis.release(held)
+        await asyncio.gather(*waiters)
+        return order
+
+    order = asyncio.run(run())
+    assert "PREMIUM" in order[:3]
+    assert sorted(order) == ["FREE"] * 3 + ["PREMIUM"] * 3
+
+
+def test_plan_concurrency_cap():
+    async def run():
+        synthesis = scheduler(4, FREE=policy(max_concurrency=1), PREMIUM=policy())
+        held = await synthesis.acquire("free")
+        waiter = asyncio.ensure_future(synthesis.acquire("free"))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        premium = await asyncio.wait_for(synthesis.acquire("premium"), 1)
+        synthesis.release(premium)
+        synthesis.release(held)
+        synthesis.release(await waiter)
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiters_leave_the_queue():
+    async def run():
+        synthesis = scheduler(1, FREE=policy())
+        held = await synthesis.acquire("free")
+        cancelled = asyncio.ensure_future(synthesis.acquire("free"))
+        waiter = asyncio.ensure_future(synthesis.acquire("free"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        synthesis.release(held)
+        synthesis.release(await asyncio.wait_for(waiter, 1))
+        assert synthesis._total_in_flight == 0
+
+    asyncio.run(run())
@@ -0,0 +1,181 @@
+import asyncio
+
+import pytest
+
+import project.upstream_resilience
+from project.upstream_resilience import (
+    CircuitBreaker,
+    ResilientUpstream,
+    UpstreamDeadlineExceeded,
+    UpstreamUnavailable,
+)
+
+
+@pytest.fixture
+def clock(fake_clock):
+    return fake_clock(project.upstream_resilience)
+
+
+def breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        "test", window_seconds=10, min_requests=4, error_rate=0.5, open_seconds=30
+    )
+
+
+def opened(clock) -> CircuitBreaker:
+    circuit = breaker()
+    for _ in range(4):
+        circuit.record(False)
+    assert circuit.state == CircuitBreaker.OPEN
+    return circuit
+
+
+def upstream(circuit: CircuitBreaker, retries: int = 2, deadline: float = 5) -> ResilientUpstream:
+    return ResilientUpstream(
+        "test",
+        circuit,
+        retries=retries,
+        backoff_seconds=0.001,
+        deadline_seconds=deadline,
+        hedge_percentile=0,
+        hedge_min_delay=0,
+        hedge_budget=0,
+    )
+
+
+def test_breaker_needs_min_requests_to_open(clock):
+    circuit = breaker()
+    for _ in range(3):
+        circuit.record(False)
+    assert circuit.state == CircuitBreaker.CLOSED
+    assert circuit.allow()
+
+
+def test_breaker_opens_at_the_error_rate(clock):
+    circuit = breaker()
+    for success in (True, True, False):
+        circuit.record(success)
+    assert circuit.state == CircuitBreaker.CLOSED
+    circuit.record(False)
+    assert circuit.state == CircuitBreaker.OPEN
+    assert not circuit.allow()
+    clock.now += 10
+    assert circuit.retry_after() == 20
+
+
+def test_breaker_forgets_outcomes_outside_the_window(clock):
+    circuit = breaker()
+    for _ in range(3):
+        circuit.record(False)
+    clock.now += 11
+    for success in (True, True, True, False):
+        circuit.record(success)
+    assert circuit.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_lets_one_probe_through_when_half_open(clock):
+    circuit = opened(clock)
+    clock.now += 30
+    assert circuit.state == CircuitBreaker.HALF_OPEN
+    assert circuit.allow()
+    assert not circuit.allow()
+
+
+def test_successful_probe_closes_the_breaker(clock):
+    circuit = opened(clock)
+    clock.now += 30
+    circuit.allow()
+    circuit.record(True)
+    assert circuit.state == CircuitBreaker.CLOSED
+    # The failures that opened it are forgotten.
+    circuit.record(False)
+    assert circuit.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    circuit = opened(clock)
+    clock.now += 30
+    circuit.allow()
+    circuit.record(False)
+    assert circuit.state == CircuitBreaker.OPEN
+    clock.now += 29
+    assert not circuit.allow()
+    clock.now += 1
+    assert circuit.allow()
+
+
+def test_released_probe_lets_another_through(clock):
+    circuit = opened(clock)
+    clock.now += 30
+    circuit.allow()
+    circuit.release()
+    assert circuit.state == CircuitBreaker.HALF_OPEN
+    assert circuit.allow()
+
+
+def test_call_retries_upstream_failures():
+    calls = []
+
+    async def attempt() -> str:
+        calls.append(None)
+        if len(calls) < 3:
+            raise ConnectionError("reset")
+        return "audio"
+
+    circuit = breaker()
+    result = asyncio.run(upstream(circuit).call(attempt, lambda e: True))
+    assert result == "audio"
+    assert len(calls) == 3
+    assert circuit._failures == 2
+
+
+def test_call_does_not_retry_or_count_caller_errors():
+    calls = []
+
+    async def attempt() -> str:
+        calls.append(None)
+        raise ValueError("bad input")
+
+    circuit = breaker()
+    with pytest.raises(ValueError):
+        asyncio.run(upstream(circuit).call(attempt, lambda e: False))
+    assert len(calls) == 1
+    assert circuit._failures == 0
+
+
+def test_call_sheds_while_open(clock):
+    async def attempt() -> str:
+        raise AssertionError("the upstream must not be called")
+
+    with pytest.raises(UpstreamUnavailable) as raised:
+        asyncio.run(upstream(opened(clock)).call(attempt, lambda e: True))
+    assert raised.value.retry_after == 30
+
+
+def test_call_gives_up_at_the_deadline():
+    async def attempt() -> str:
+        await asyncio.sleep(10)
+        return "audio"
+
+    circuit = breaker()
+    with pytest.raises(UpstreamDeadlineExceeded):
+        asyncio.run(upstream(circuit, deadline=0.05).call(attempt, lambda e: True))
+    assert circuit._failures == 1
+
+
+def test_cancelled_probe_is_released(clock):
+    async def attempt() -> str:
+        await asyncio.sleep(10)
+        return "audio"
+
+    async def run(circuit: CircuitBreaker) -> None:
+        call = asyncio.ensure_future(upstream(circuit).call(attempt, lambda e: True))
+        await asyncio.sleep(0.01)
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+
+    circuit = opened(clock)
+    clock.now += 30
+    asyncio.run(run(circuit))
+    assert circuit.state == CircuitBreaker.HALF_OPEN
+    assert circuit.allow()